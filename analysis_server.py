@@ -0,0 +1,438 @@
+# ============================================================
+# 将棋AI 解析サーバー
+# ============================================================
+# 常駐して局面の解析要求を受け付け、あらかじめ起動しておいた
+# 探索用ワーカープロセスに振り分ける。
+#
+# 使い方:
+#   python analysis_server.py --port 8765 --workers 4 --max-queue 64
+#
+#   解析: POST /analyze  {"sfen": "startpos", "depth": 4, "time": 2.0, "nodes": 100000}
+#         （"id" を付けると中断に使える。"timeout" は結果を待つ上限秒数）
+#   中断: POST /cancel   {"id": "..."}
+#   統計: GET  /stats    （待ち行列の長さ、レイテンシの分位点、スループット）
+#
+# 理由: 解析のたびにPythonプロセスを起動すると、インタプリタの起動と
+#       shogi の import の時間が毎回かかる。ワーカーを常駐させて使い回す。
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import wait
+
+import shogi
+
+DEFAULT_DEPTH = 4
+DEFAULT_TIMEOUT = 30.0   # 1件の解析にかけてよい時間の上限（秒）
+CANCEL_GRACE = 2.0       # 中断を要求してからワーカーを強制終了するまでの猶予（秒）
+LATENCY_SAMPLES = 1000   # レイテンシの分位点を計算するために残す件数
+THROUGHPUT_WINDOW = 60.0 # スループットを計算する直近の期間（秒）
+
+
+class QueueFull(Exception):
+    """待ち行列が上限に達していて、要求を受け付けられないことを表す例外"""
+
+
+# ============================================================
+# ワーカープロセス
+# ============================================================
+
+def _worker_main(conn, cancel):
+    """
+    探索ワーカーのメインループ（別プロセスで動く）
+
+    Args:
+        conn: サービスとの通信用 Pipe
+        cancel: 実行中の解析を中断させるための Event
+
+    実装の理由:
+        起動直後に浅い探索を1回して、import と初回実行のコストを
+        先に払っておく（pre-warm）。以降は要求を受け取るたびに探索する。
+    """
+    shogi.search(shogi.create_initial_board(), shogi.create_empty_hands(), 'sente', depth=1)
+    conn.send(('ready', None, None))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        try:
+            board, hands, turn, _ = shogi.sfen_to_board(task['sfen'])
+            result = shogi.search(board, hands, turn, depth=task['depth'],
+                                  nodes=task['nodes'], time_limit=task['time'],
+                                  stop=cancel.is_set)
+            result['cancelled'] = cancel.is_set()
+            conn.send(('done', task['id'], result))
+        except Exception as e:
+            conn.send(('error', task['id'], '%s: %s' % (type(e).__name__, e)))
+
+
+class _Worker:
+    """ワーカープロセス1つ分の状態"""
+
+    def __init__(self, ctx):
+        self.cancel = ctx.Event()
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, self.cancel), daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+        self.job = None  # 実行中の Job
+
+
+class Job:
+    """
+    解析要求1件
+
+    属性:
+        id: 要求ID
+        request: 解析条件 {'sfen', 'depth', 'time', 'nodes'}
+        deadline: この時刻を過ぎたら中断する（time.monotonic()の値）
+        result: 解析結果（完了後）
+        error: エラーメッセージ（失敗時）
+    """
+
+    def __init__(self, job_id, request, timeout):
+        self.id = job_id
+        self.request = request
+        self.submitted = time.monotonic()
+        self.deadline = self.submitted + timeout
+        self.started = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# ============================================================
+# 解析サービス（ワーカープールと待ち行列）
+# ============================================================
+
+class AnalysisService:
+    """
+    探索ワーカーのプールと、上限付きの待ち行列を管理する
+
+    Args:
+        workers: ワーカープロセスの数
+        max_queue: 待ち行列（実行待ちの要求）の上限。超えたら QueueFull
+
+    実装の理由:
+        要求はいったん待ち行列に入り、空いたワーカーに順に割り当てる。
+        待ち行列に上限を設け、溢れたら即座に断る（バックプレッシャー）ことで、
+        処理しきれない要求が溜まり続けるのを防ぐ。
+        タイムアウトや中断要求はワーカーの Event で探索に伝え、
+        それでも止まらないワーカーは強制終了して起動し直す。
+    """
+
+    def __init__(self, workers=2, max_queue=32):
+        self.max_queue = max_queue
+        self._ctx = mp.get_context('spawn')
+        self._workers = [_Worker(self._ctx) for _ in range(workers)]
+        self._pending = deque()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._started_at = time.monotonic()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._finished_at = deque()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._thread.start()
+
+    # ---- 外部から呼ぶ操作 ----
+
+    def submit(self, sfen, depth=DEFAULT_DEPTH, time_limit=None, nodes=None,
+               timeout=DEFAULT_TIMEOUT, job_id=None):
+        """
+        解析要求を待ち行列に入れる
+
+        Returns:
+            Job: 完了すると job.done がセットされる
+
+        Raises:
+            QueueFull: 待ち行列が上限に達している場合
+            ValueError: SFENが不正、またはIDが重複している場合
+        """
+        shogi.sfen_to_board(sfen)  # 不正なSFENはワーカーに渡す前に弾く
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('サービスは終了しています')
+            if len(self._pending) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFull('待ち行列が上限(%d)に達しています' % self.max_queue)
+            job_id = str(job_id) if job_id is not None else 'job-%d' % next(self._ids)
+            if job_id in self._jobs:
+                raise ValueError('IDが重複しています: %s' % job_id)
+            job = Job(job_id, {'id': job_id, 'sfen': sfen, 'depth': depth,
+                               'time': time_limit, 'nodes': nodes}, timeout)
+            self._jobs[job_id] = job
+            self._pending.append(job)
+            self._assign_locked()
+        return job
+
+    def cancel(self, job_id):
+        """
+        解析を中断する（待ち行列にあれば取り除き、実行中なら探索を止める）
+
+        Returns:
+            bool: 対象の要求が見つかればTrue
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if job in self._pending:
+                self._pending.remove(job)
+                self._finish_locked(job, error='cancelled')
+                return True
+            for w in self._workers:
+                if w.job is job:
+                    w.cancel.set()
+                    return True
+        return False
+
+    def stats(self):
+        """
+        待ち行列の長さ・レイテンシの分位点・スループットを返す
+
+        Returns:
+            dict: 統計情報（レイテンシはミリ秒）
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._finished_at and self._finished_at[0] < now - THROUGHPUT_WINDOW:
+                self._finished_at.popleft()
+            latencies = sorted(self._latencies)
+            window = min(THROUGHPUT_WINDOW, now - self._started_at) or 1e-9
+            return {
+                'queue_depth': len(self._pending),
+                'max_queue': self.max_queue,
+                'running': sum(1 for w in self._workers if w.job is not None),
+                'workers': len(self._workers),
+                'ready_workers': sum(1 for w in self._workers if w.ready),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'latency_ms': {
+                    'p50': _percentile(latencies, 50) * 1000,
+                    'p90': _percentile(latencies, 90) * 1000,
+                    'p99': _percentile(latencies, 99) * 1000,
+                },
+                'throughput_per_sec': len(self._finished_at) / window,
+                'uptime_sec': now - self._started_at,
+            }
+
+    def close(self):
+        """ワーカーを停止する（未完了の要求は失敗として終わらせる）"""
+        with self._lock:
+            self._closed = True
+            for job in list(self._pending):
+                self._finish_locked(job, error='shutdown')
+            self._pending.clear()
+            for w in self._workers:
+                if w.job is not None:
+                    self._finish_locked(w.job, error='shutdown')
+                    w.job = None
+                try:
+                    w.conn.send(None)
+                except OSError:
+                    pass
+        self._thread.join(timeout=1.0)
+        for w in self._workers:
+            w.process.join(timeout=1.0)
+            if w.process.is_alive():
+                w.process.terminate()
+
+    # ---- 内部処理 ----
+
+    def _assign_locked(self):
+        """空いているワーカーに待ち行列の先頭から要求を割り当てる（ロック中に呼ぶ）"""
+        for w in self._workers:
+            if not self._pending:
+                return
+            if w.ready and w.job is None:
+                job = self._pending.popleft()
+                w.cancel.clear()
+                w.job = job
+                job.started = time.monotonic()
+                w.conn.send(job.request)
+
+    def _finish_locked(self, job, result=None, error=None):
+        """要求を完了させ、統計に記録する（ロック中に呼ぶ）"""
+        job.result = result
+        job.error = error
+        now = time.monotonic()
+        if error is None:
+            self.completed += 1
+            self._latencies.append(now - job.submitted)
+            self._finished_at.append(now)
+        else:
+            self.failed += 1
+        self._jobs.pop(job.id, None)
+        job.done.set()
+
+    def _dispatch_loop(self):
+        """
+        ワーカーからの結果を受け取り、タイムアウトを監視する（専用スレッド）
+        """
+        while not self._closed:
+            conns = [w.conn for w in self._workers]
+            for conn in wait(conns, timeout=0.05):
+                w = next(w for w in self._workers if w.conn is conn)
+                try:
+                    kind, job_id, payload = conn.recv()
+                except (EOFError, OSError):
+                    with self._lock:
+                        if not self._closed:
+                            self._restart_locked(w, 'worker died')
+                    continue
+                with self._lock:
+                    if kind == 'ready':
+                        w.ready = True
+                    elif w.job is not None and w.job.id == job_id:
+                        job, w.job = w.job, None
+                        if kind == 'done':
+                            self._finish_locked(job, result=payload)
+                        else:
+                            self._finish_locked(job, error=payload)
+                    self._assign_locked()
+            self._check_timeouts()
+
+    def _check_timeouts(self):
+        """時間切れの解析を中断し、止まらないワーカーは起動し直す"""
+        now = time.monotonic()
+        with self._lock:
+            for w in self._workers:
+                job = w.job
+                if job is None or now < job.deadline:
+                    continue
+                if not w.cancel.is_set():
+                    w.cancel.set()  # 探索を打ち切らせ、それまでの結果を返させる
+                elif now >= job.deadline + CANCEL_GRACE:
+                    self._restart_locked(w, 'timeout')
+
+    def _restart_locked(self, w, reason):
+        """ワーカーを強制終了して起動し直す（ロック中に呼ぶ）"""
+        if w.job is not None:
+            self._finish_locked(w.job, error=reason)
+        w.process.terminate()
+        w.conn.close()
+        i = self._workers.index(w)
+        self._workers[i] = _Worker(self._ctx)
+
+
+def _percentile(sorted_values, q):
+    """ソート済みの値の q パーセンタイル（値がなければ0）"""
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))
+    return sorted_values[i]
+
+
+# ============================================================
+# HTTPインターフェース
+# ============================================================
+
+def job_response(job):
+    """完了した Job をレスポンス用の辞書にする"""
+    if job.error is not None:
+        return {'id': job.id, 'error': job.error}
+    res = dict(job.result)
+    res['id'] = job.id
+    res['queue_time'] = (job.started or job.submitted) - job.submitted
+    return res
+
+
+class AnalysisHandler(BaseHTTPRequestHandler):
+    """解析サーバーのHTTPハンドラ（server.service に AnalysisService を持たせて使う）"""
+
+    def _send(self, code, obj, headers=()):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.service.stats())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        try:
+            req = self._read_json()
+        except ValueError:
+            self._send(400, {'error': 'JSONが不正です'})
+            return
+        service = self.server.service
+        if self.path == '/cancel':
+            self._send(200, {'cancelled': service.cancel(str(req.get('id')))})
+            return
+        if self.path != '/analyze':
+            self._send(404, {'error': 'not found'})
+            return
+        timeout = float(req.get('timeout', DEFAULT_TIMEOUT))
+        try:
+            job = service.submit(req.get('sfen', 'startpos'),
+                                 depth=int(req.get('depth', DEFAULT_DEPTH)),
+                                 time_limit=req.get('time'), nodes=req.get('nodes'),
+                                 timeout=timeout, job_id=req.get('id'))
+        except QueueFull as e:
+            self._send(503, {'error': str(e)}, headers=[('Retry-After', '1')])
+            return
+        except (ValueError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        job.done.wait(timeout + CANCEL_GRACE + 1.0)
+        if not job.done.is_set():
+            self._send(504, {'id': job.id, 'error': 'timeout'})
+            return
+        self._send(200, job_response(job))
+
+    def log_message(self, fmt, *args):
+        pass  # 1件ごとのアクセスログは出さない（統計は /stats で見る）
+
+
+def serve(host='127.0.0.1', port=8765, workers=2, max_queue=32):
+    """
+    解析サーバーを起動する（Ctrl+Cで終了）
+    """
+    service = AnalysisService(workers=workers, max_queue=max_queue)
+    server = ThreadingHTTPServer((host, port), AnalysisHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"解析サーバー起動: http://{host}:{port} (ワーカー{workers}個, 待ち行列上限{max_queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='将棋AI 解析サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count() - 1))
+    parser.add_argument('--max-queue', type=int, default=32)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.max_queue)
@@ -0,0 +1,227 @@
+# ============================================================
+# 将棋AI 一括局面解析
+# ============================================================
+# 局面のリスト（ファイルまたは標準入力）を読み、各局面の最善手と評価値を
+# 複数のワーカープロセスで計算してJSONLで書き出す。
+#
+# 使い方:
+#   python batch_analyze.py positions.jsonl -o results.jsonl --workers 4 --depth 3
+#   cat positions.sfen | python batch_analyze.py - -o results.jsonl --nodes 20000
+#
+# 入力: 1行1局面。SFEN文字列、または {"id": ..., "sfen": ...} のJSON
+# 出力: 1行1局面のJSON（入力と同じ順番）
+#   {"id", "line", "move", "score", "eval", "depth", "nodes", "time"}
+#   （解析できなかった局面は {"id", "line", "error"}）
+#
+# 中断と再開:
+#   -o で出力ファイルを指定すると、定期的に「何行目まで書いたか」を
+#   <出力ファイル>.ckpt に保存する。同じコマンドをもう一度実行すると、
+#   途中から再開する（--restart で最初からやり直す）。
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from collections import deque
+
+import shogi
+
+CHECKPOINT_EVERY = 5.0  # チェックポイントを保存する間隔（秒）
+
+
+def parse_line(line, lineno):
+    """
+    入力の1行を (ID, SFEN) に変換する
+
+    Returns:
+        tuple: (ID, SFEN)。空行ならNone
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        obj = json.loads(line)
+        return obj.get('id', lineno), obj['sfen']
+    return lineno, line
+
+
+def analyze_position(task):
+    """
+    1局面を解析する（ワーカープロセスで動く）
+
+    Args:
+        task: (行番号, ID, SFEN, 探索条件の辞書)
+
+    Returns:
+        dict: 出力する1行分の結果
+    """
+    lineno, pos_id, sfen, limits = task
+    try:
+        board, hands, turn, _ = shogi.sfen_to_board(sfen)
+        res = shogi.search(board, hands, turn, depth=limits['depth'],
+                           nodes=limits['nodes'], time_limit=limits['time'])
+        return {
+            'id': pos_id, 'line': lineno, 'move': res['move'], 'score': res['score'],
+            'eval': shogi.evaluate_board(board, turn), 'depth': res['depth'],
+            'nodes': res['nodes'], 'time': round(res['time'], 6),
+        }
+    except Exception as e:
+        return {'id': pos_id, 'line': lineno, 'error': '%s: %s' % (type(e).__name__, e)}
+
+
+def _iter_tasks(stream, skip, limits):
+    """
+    入力を1行ずつ読み、(行番号, ID, SFEN, 探索条件) を順に返す
+
+    実装の理由:
+        入力全体をメモリに読み込まずに1行ずつ流す。
+        再開時は、すでに出力済みの行を読み飛ばす。
+        不正な行はエラー結果として出力するため (行番号, None, 理由) を返す。
+    """
+    for lineno, line in enumerate(stream, 1):
+        if lineno <= skip:
+            continue
+        try:
+            parsed = parse_line(line, lineno)
+        except (ValueError, KeyError) as e:
+            yield lineno, None, 'invalid input: %s' % e
+            continue
+        if parsed is not None:
+            yield lineno, parsed, limits
+
+
+def load_checkpoint(path):
+    """
+    チェックポイントを読む
+
+    Returns:
+        dict: {'lines': 処理済みの入力行数, 'bytes': 出力済みのバイト数}（なければ0）
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'lines': 0, 'bytes': 0}
+
+
+def save_checkpoint(path, lines, nbytes):
+    """
+    チェックポイントを書く（書きかけのファイルを残さないよう置き換えで保存）
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'lines': lines, 'bytes': nbytes}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def run(stream, out, workers=2, limits=None, skip=0, window=None, on_progress=None):
+    """
+    入力を解析して結果を入力順に書き出す
+
+    Args:
+        stream: 入力（行のイテレータ）
+        out: 出力先（テキストファイル）
+        workers: ワーカープロセスの数
+        limits: 探索条件 {'depth', 'nodes', 'time'}
+        skip: 読み飛ばす入力行数（再開時）
+        window: 同時に処理中にしておく局面数の上限（既定はワーカー数の4倍）
+        on_progress: 1件書くごとに (処理済みの入力行数) を受け取る関数
+
+    Returns:
+        int: 書き出した結果の件数
+
+    実装の理由:
+        Pool.imap は入力を先読みしきってしまうため、処理中の件数を
+        window 件までに抑えて投入する。こうすると入力がどれだけ大きくても
+        メモリ使用量は一定で、結果も入力順のまま書き出せる。
+    """
+    limits = limits or {'depth': 3, 'nodes': None, 'time': None}
+    window = window or workers * 4
+    written = 0
+    with mp.Pool(workers) as pool:
+        inflight = deque()
+
+        def flush_one():
+            nonlocal written
+            lineno, result = inflight.popleft()
+            if not isinstance(result, dict):
+                result = result.get()
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            written += 1
+            if on_progress is not None:
+                on_progress(lineno)
+
+        for lineno, parsed, extra in _iter_tasks(stream, skip, limits):
+            if parsed is None:
+                inflight.append((lineno, {'id': lineno, 'line': lineno, 'error': extra}))
+            else:
+                pos_id, sfen = parsed
+                task = (lineno, pos_id, sfen, limits)
+                inflight.append((lineno, pool.apply_async(analyze_position, (task,))))
+            while len(inflight) > window or (inflight and _ready(inflight[0][1])):
+                flush_one()
+        while inflight:
+            flush_one()
+    return written
+
+
+def _ready(result):
+    """結果がすでに出ているか（エラー行の辞書は常に出ている）"""
+    return isinstance(result, dict) or result.ready()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 一括局面解析')
+    parser.add_argument('input', help="入力ファイル（'-' で標準入力）")
+    parser.add_argument('-o', '--output', help='出力ファイル（省略時は標準出力。再開には必須）')
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count()))
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--nodes', type=int, default=None)
+    parser.add_argument('--time', type=float, default=None, help='1局面あたりの探索時間の上限（秒）')
+    parser.add_argument('--restart', action='store_true', help='チェックポイントを無視して最初から解析する')
+    args = parser.parse_args(argv)
+
+    limits = {'depth': args.depth, 'nodes': args.nodes, 'time': args.time}
+    stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    start = time.monotonic()
+
+    if args.output is None:
+        n = run(stream, sys.stdout, args.workers, limits)
+    else:
+        ckpt_path = args.output + '.ckpt'
+        ckpt = {'lines': 0, 'bytes': 0} if args.restart else load_checkpoint(ckpt_path)
+        out = open(args.output, 'a+' if ckpt['lines'] else 'w', encoding='utf-8')
+        # 前回の実行でチェックポイント後に書かれた分を捨ててから続きを書く
+        out.seek(ckpt['bytes'])
+        out.truncate()
+        last_save = time.monotonic()
+
+        def on_progress(lineno):
+            nonlocal last_save
+            now = time.monotonic()
+            if now - last_save >= CHECKPOINT_EVERY:
+                out.flush()
+                os.fsync(out.fileno())
+                save_checkpoint(ckpt_path, lineno, out.tell())
+                last_save = now
+
+        if ckpt['lines']:
+            print(f"{ckpt['lines']}行目まで処理済み。続きから再開します", file=sys.stderr)
+        n = run(stream, out, args.workers, limits, skip=ckpt['lines'], on_progress=on_progress)
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+        # 最後まで終わったらチェックポイントは不要
+        if os.path.exists(ckpt_path):
+            os.remove(ckpt_path)
+
+    elapsed = time.monotonic() - start
+    print(f"{n}局面を解析しました（{elapsed:.1f}秒, {n / max(elapsed, 1e-9):.1f}局面/秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
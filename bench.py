@@ -0,0 +1,359 @@
+# ============================================================
+# 将棋AI 探索ベンチマーク
+# ============================================================
+# 決まった局面のセット（SUITE）を決まった深さ・ノード数で探索し、
+# 読み切るまでの時間・ノード数・1秒あたりのノード数（nps）・最大メモリ使用量・
+# 選んだ手を記録して、リポジトリに置いた基準値（bench_baseline.json）と比べる。
+# shogi.py を速くする変更は、この数字で良し悪しを判断する。
+#
+# 使い方:
+#   python bench.py                    # 計測して基準値と比べる（劣化していれば終了コード1）
+#   python bench.py --repeat 9         # 各局面を9回（既定5回）計測して最も速い時間を使う
+#   python bench.py --update           # 計測結果を新しい基準値として保存する
+#   python bench.py --only startpos,endgame-drops --json result.json
+#   python bench.py --movegen          # 合法手生成（全部・駒を取る手・王手・それ以外）の時間だけ測る
+#   python bench.py --profile          # 各局面を1回ずつ探索してプロファイルを書き出す（profile.txt など）
+#
+# 判定:
+#   - 全局面の合計 nps が基準値より threshold（既定30%）以上下がったら失敗
+#     （各局面の時間は repeat 回のうち最も速い回。1回だけの計測は、同じコードでも
+#       ほかのプロセスの影響で30%以上遅くなることがあるので、判定には使わない）
+#   - 選んだ手が基準値と変わったら失敗（探索を変えて手が変わるのが正しいときは
+#     --allow-move-change で確認し、--update で基準値を更新する）
+#   - ノード数・メモリの変化は表示だけ（探索の枝刈りを変えればノード数は変わる）
+#
+# 各局面は新しいプロセスで1つずつ探索する。合法手キャッシュなどの状態を
+# 持ち越さず、最大メモリ使用量も局面ごとに測れる。
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import sys
+import time
+
+import shogi
+from profiling import Profiler
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_THRESHOLD = 0.30
+DEFAULT_REPEAT = 5
+
+# 計測する局面（名前は基準値との対応に使うので変えない）
+SUITE = [
+    {'name': 'startpos', 'sfen': shogi.STARTPOS_SFEN, 'depth': 4},
+    {'name': 'opening-bishop-open',
+     'sfen': 'ln2kgsnl/3s1r1b1/pgppppppp/1p7/9/2PP5/PP2PPPPP/1B1G2SR1/LNS1KG1NL b - 1', 'depth': 4},
+    {'name': 'middlegame-rook-file',
+     'sfen': '1ng2gsnl/l6b1/1pskp1p1p/p1p4p1/3r1P2P/P2pP4/LPP3PPN/1BK3G2/1NSGR1S1L w Pp 1', 'depth': 4},
+    {'name': 'middlegame-closed',
+     'sfen': '1ns2kgn1/l2gr2bl/2pp1pppp/pp1s5/4p2P1/3P1PP2/PPP1P3P/LB1G1R1S1/1NSK2GNL w - 1', 'depth': 4},
+    {'name': 'middlegame-pawn-drop',
+     'sfen': '1n3k1n1/L1srgsgbl/1pppp2pp/5pp2/L7P/3P1P1P1/1PP1P1P1N/1BSGR1G2/1N2K1S1L w Pp 1', 'depth': 4},
+    {'name': 'middlegame-king-exposed',
+     'sfen': '1n3g1nl/lr3bs2/ppgsp1ppp/3pkp3/2p4P1/PP1PP3P/2PR1PP2/1B1S1G1S1/LNGK3NL w - 1', 'depth': 4},
+    {'name': 'endgame-drops',
+     'sfen': '3kg2nb/l1gs2s2/n1rpp1ppl/2p2p2p/1p5P1/L4P2P/2PPP1P1N/2SKRS3/BN3GG1L b P2p 1', 'depth': 3},
+    {'name': 'hands-wide-nodes',
+     'sfen': 'lnsk2bn1/2r5l/1p1g1pgpp/p1ppp4/PN6P/9/1PPPPPPP1/1B1RK3L/L1S1GGS2 w GSP 1',
+     'depth': 8, 'nodes': 30000},
+]
+
+
+def peak_rss_kb():
+    """このプロセスの最大メモリ使用量（KB。Linux の ru_maxrss の単位）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def bench_position(entry):
+    """
+    1局面を探索して計測する（ワーカープロセスで動く）
+
+    Args:
+        entry: SUITE の1要素 {'name', 'sfen', 'depth', 'nodes'(省略可)}
+
+    Returns:
+        dict: {'name', 'move', 'depth', 'nodes', 'time', 'nps', 'rss_kb'}
+
+    実装の理由:
+        ai_choose_move と同じ探索（search）を呼び、選んだ手に加えて
+        読み切った深さとノード数も受け取る。時間は探索の呼び出しの前後で測る。
+    """
+    board, hands, turn, _ = shogi.sfen_to_board(entry['sfen'])
+    start = time.perf_counter()
+    res = shogi.search(board, hands, turn, depth=entry['depth'], nodes=entry.get('nodes'))
+    elapsed = time.perf_counter() - start
+    return {
+        'name': entry['name'], 'move': res['move'], 'depth': res['depth'],
+        'nodes': res['nodes'], 'time': round(elapsed, 6),
+        'nps': round(res['nodes'] / max(elapsed, 1e-9)), 'rss_kb': peak_rss_kb(),
+    }
+
+
+def run_suite(suite=SUITE, repeat=DEFAULT_REPEAT):
+    """
+    局面のセットを計測する
+
+    Args:
+        suite: 計測する局面のリスト
+        repeat: 各局面を計測する回数（最も速い回の結果を使う）
+
+    Returns:
+        list: 局面ごとの bench_position の結果（suite と同じ順番）
+
+    実装の理由:
+        1局面1回ごとに新しいプロセスを使い（maxtasksperchild=1）、
+        同時には1つしか動かさない。並列に動かすと互いの時間に影響する。
+        計測の揺れはほかのプロセスに割り込まれて遅くなる向きにしか出ないので、
+        平均ではなく最も速い回を使う。
+    """
+    results = []
+    with mp.Pool(1, maxtasksperchild=1) as pool:
+        for entry in suite:
+            runs = [pool.apply(bench_position, (entry,)) for _ in range(repeat)]
+            best = min(runs, key=lambda r: r['time'])
+            best['rss_kb'] = max(r['rss_kb'] for r in runs)
+            results.append(best)
+    return results
+
+
+def summarize(results):
+    """全局面の合計 {'nodes', 'time', 'nps', 'rss_kb'}"""
+    nodes = sum(r['nodes'] for r in results)
+    elapsed = sum(r['time'] for r in results)
+    return {'nodes': nodes, 'time': round(elapsed, 6), 'nps': round(nodes / max(elapsed, 1e-9)),
+            'rss_kb': max((r['rss_kb'] for r in results), default=0)}
+
+
+def _same_move(a, b):
+    """JSONを通した指し手（リスト）とタプルの指し手を比べる"""
+    return json.loads(json.dumps(a)) == json.loads(json.dumps(b))
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, allow_move_change=False):
+    """
+    計測結果を基準値と比べる
+
+    Args:
+        results: run_suite の結果
+        baseline: load_baseline で読んだ基準値
+        threshold: 許す nps の低下の割合（0.2 なら20%まで）
+        allow_move_change: 選んだ手が変わっても失敗にしない
+
+    Returns:
+        list: 失敗の理由の文字列（空なら合格）
+
+    実装の理由:
+        nps は局面ごとには揺れが大きいので、合計の nps で判定する。
+        基準値にない局面（新しく足した局面）は比べない。
+    """
+    base = {r['name']: r for r in baseline['results']}
+    failures = []
+    compared = [r for r in results if r['name'] in base]
+    for r in compared:
+        if not allow_move_change and not _same_move(r['move'], base[r['name']]['move']):
+            failures.append('%s: 選んだ手が変わりました（基準 %s → %s）'
+                            % (r['name'], base[r['name']]['move'], r['move']))
+    if compared:
+        now = summarize(compared)
+        before = summarize([base[r['name']] for r in compared])
+        if now['nps'] < before['nps'] * (1 - threshold):
+            failures.append('nps が %.1f%% 下がりました（基準 %d → %d、許容 %.0f%%）'
+                            % (100.0 * (1 - now['nps'] / before['nps']), before['nps'],
+                               now['nps'], threshold * 100))
+    return failures
+
+
+def load_baseline(path=DEFAULT_BASELINE):
+    """基準値のJSONを読む（なければNone）"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(results, path=DEFAULT_BASELINE):
+    """計測結果を基準値として保存する（計測した環境も一緒に記録する）"""
+    data = {
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'processor': platform.processor() or platform.machine()},
+        'total': summarize(results),
+        'results': results,
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        # 差分が読みやすいよう、1局面を1行に書く
+        f.write('{\n')
+        for key in ('machine', 'total'):
+            f.write(' %s: %s,\n' % (json.dumps(key), json.dumps(data[key], ensure_ascii=False)))
+        f.write(' "results": [\n  ')
+        f.write(',\n  '.join(json.dumps(r, ensure_ascii=False) for r in results))
+        f.write('\n ]\n}\n')
+    os.replace(tmp, path)
+
+
+def format_table(results, baseline=None):
+    """計測結果の表（基準値があれば nps とノード数の変化も並べる）"""
+    base = {r['name']: r for r in baseline['results']} if baseline else {}
+    lines = ['%-24s %5s %9s %8s %8s %8s %8s  %s'
+             % ('局面', '深さ', 'ノード', '時間', 'nps', '基準比', 'RSS(MB)', '選んだ手')]
+    for r in results + [dict(summarize(results), name='合計', depth='', move='')]:
+        b = base.get(r['name']) if r['name'] != '合計' else (
+            summarize([base[x['name']] for x in results if x['name'] in base]) if base else None)
+        ratio = '%+.1f%%' % (100.0 * (r['nps'] / b['nps'] - 1)) if b and b.get('nps') else '-'
+        if b and 'nodes' in b and b['nodes'] != r['nodes'] and r['name'] != '合計':
+            ratio += ' (ノード %+d)' % (r['nodes'] - b['nodes'])
+        lines.append('%-24s %5s %9d %8.3f %8d %8s %8.1f  %s'
+                     % (r['name'], r['depth'], r['nodes'], r['time'], r['nps'], ratio,
+                        r['rss_kb'] / 1024, r['move']))
+    return '\n'.join(lines)
+
+
+MOVEGEN_KINDS = (
+    ('legal', shogi.generate_legal_moves),
+    ('captures', shogi.generate_captures),
+    ('checks', shogi.generate_checks),
+    ('quiets', shogi.generate_quiets),
+)
+
+
+def bench_movegen(suite=SUITE, repeat=200):
+    """
+    局面ごとに合法手生成の1回あたりの時間を測る
+
+    Args:
+        suite: 計測する局面のリスト
+        repeat: 1つの生成関数を続けて呼ぶ回数
+
+    Returns:
+        list: 局面ごとの {'name', 種類: {'moves', 'usec'}}（種類は MOVEGEN_KINDS の名前）
+
+    実装の理由:
+        駒を取る手・王手・それ以外の手だけを作る関数が、全合法手を作るより
+        どれだけ安いかを比べる。合法手キャッシュが効くと全合法手の時間が
+        正しく測れないので、計測の間は外しておく。
+    """
+    cache = shogi.set_move_cache(None)
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    results = []
+    try:
+        for entry in suite:
+            board, hands, turn, _ = shogi.sfen_to_board(entry['sfen'])
+            pos = shogi.Position.from_board(board, hands, turn)
+            row = {'name': entry['name']}
+            for kind, generate in MOVEGEN_KINDS:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    n = generate(pos, buf)
+                elapsed = time.perf_counter() - start
+                row[kind] = {'moves': n, 'usec': round(elapsed / repeat * 1e6, 1)}
+            results.append(row)
+    finally:
+        shogi.set_move_cache(cache)
+    return results
+
+
+def format_movegen(results):
+    """bench_movegen の結果の表（手の数と1回あたりの時間、全合法手に対する時間の割合）"""
+    lines = ['%-24s' % '局面' + ''.join('%20s' % kind for kind, _ in MOVEGEN_KINDS)]
+    for r in results:
+        legal = r['legal']['usec']
+        cells = []
+        for kind, _ in MOVEGEN_KINDS:
+            c = r[kind]
+            share = '' if kind == 'legal' else ' %3.0f%%' % (100.0 * c['usec'] / max(legal, 1e-9))
+            cells.append('%20s' % ('%3d手 %7.1fus%s' % (c['moves'], c['usec'], share)))
+        lines.append('%-24s' % r['name'] + ''.join(cells))
+    return '\n'.join(lines)
+
+
+def profile_suite(suite=SUITE, mode='sample', prefix='profile', movegen=False):
+    """
+    局面のセットを1回ずつ計測しながらプロファイルを取り、ファイルに書き出す
+
+    Args:
+        suite: 計測する局面のリスト
+        mode: profiling.Profiler のモード（'sample' または 'cprofile'）
+        prefix: 出力先（拡張子なし。<prefix>.txt と <prefix>.collapsed を書く）
+        movegen: True なら探索のかわりに bench_movegen を計測する
+
+    Returns:
+        tuple: (計測結果, 書き出した2つのファイルのパス)
+
+    実装の理由:
+        プロファイラは同じプロセスの中しか計測できないので、run_suite と違い
+        このプロセスで順に探索する。計測の分だけ遅くなるので、基準値とは比べない。
+    """
+    profiler = Profiler(mode)
+    shogi.reset_call_counts()
+    with profiler:
+        if movegen:
+            results = bench_movegen(suite)
+        else:
+            results = [bench_position(entry) for entry in suite]
+    return results, profiler.write(prefix, shogi.CALL_COUNTS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 探索ベンチマーク')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基準値のJSONファイル')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='失敗にする nps の低下の割合（既定 0.3）')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='各局面を計測する回数（最も速い回を使う。既定 %d）' % DEFAULT_REPEAT)
+    parser.add_argument('--only', help='計測する局面の名前（カンマ区切り）')
+    parser.add_argument('--update', action='store_true', help='計測結果を基準値として保存する')
+    parser.add_argument('--allow-move-change', action='store_true', help='選んだ手の変化を失敗にしない')
+    parser.add_argument('--json', help='計測結果をJSONで書き出すファイル')
+    parser.add_argument('--movegen', action='store_true',
+                        help='探索のかわりに合法手生成（種類ごと）の時間を測る（基準値とは比べない）')
+    parser.add_argument('--profile', nargs='?', const='sample', choices=('sample', 'cprofile'),
+                        help='計測しながらプロファイルを取る（sample: サンプリング, cprofile: cProfile。'
+                             '基準値とは比べない）')
+    parser.add_argument('--profile-out', default='profile', help='プロファイルの出力先（拡張子なし）')
+    args = parser.parse_args(argv)
+
+    suite = SUITE
+    if args.only:
+        names = args.only.split(',')
+        unknown = set(names) - {e['name'] for e in SUITE}
+        if unknown:
+            parser.error('unknown position: %s' % ', '.join(sorted(unknown)))
+        suite = [e for e in SUITE if e['name'] in names]
+
+    if args.profile:
+        results, paths = profile_suite(suite, args.profile, args.profile_out, args.movegen)
+        print(format_movegen(results) if args.movegen else format_table(results))
+        print('プロファイル: %s, %s' % paths)
+        return 0
+    if args.movegen:
+        print(format_movegen(bench_movegen(suite)))
+        return 0
+
+    results = run_suite(suite, args.repeat)
+    baseline = None if args.update else load_baseline(args.baseline)
+    print(format_table(results, baseline))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'total': summarize(results), 'results': results}, f, ensure_ascii=False, indent=1)
+    if args.update:
+        save_baseline(results, args.baseline)
+        print('基準値を保存しました: %s' % args.baseline)
+        return 0
+    if baseline is None:
+        print('基準値がありません（--update で作成してください）: %s' % args.baseline)
+        return 0
+    failures = compare(results, baseline, args.threshold, args.allow_move_change)
+    for message in failures:
+        print('失敗: ' + message)
+    if not failures:
+        print('基準値との比較: OK')
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
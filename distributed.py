@@ -0,0 +1,533 @@
+# ============================================================
+# 将棋AI 分散探索（複数のマシンのワーカーで1つの局面を読む）
+# ============================================================
+# コーディネーター（探索を頼む側）が、ルート局面の指し手ごとの探索を
+# TCPでつながったワーカープロセスに配り、結果を集めて最善手を決める。
+# ワーカーはそれぞれの手を shogi.search_moves（search と同じ _minimax）で読む。
+#
+# 使い方:
+#   python distributed.py worker --port 8770 --procs 4        # 各マシンで（8770〜8773で待ち受け）
+#   python distributed.py bench --workers host1:8770,host1:8771,host2:8770 --depth 4
+#   python shogi.py --cluster host1:8770,host2:8770             # AIの探索をワーカーに任せて対局する
+#   プログラムからは Coordinator を Engine の代わりに ai_choose_move(..., engine=coordinator) に渡す。
+#
+# 通信: TCPで1行1つのJSON（改行区切り）。1つの接続で1つずつ順に処理する。
+#   {"op": "search", "id": 番号, "position": 局面, "move": 指し手, "depth": 深さ,
+#    "alpha": 窓の下限, "beta": 窓の上限, "time": 残り時間（秒。null なら無制限）}
+#     → {"id": 番号, "score": 評価値, "nodes": ノード数, "pv": [指し手, ...], "time": 秒}
+#       （時間切れなら {"id": 番号, "aborted": true}）
+#   {"op": "clear", "id": 番号} → {"id": 番号, "type": "cleared"}（置換表などの表を空にする）
+#   {"op": "ping"} → {"type": "pong"}
+#   局面は selfplay のレコード（RECORD_SIZE バイト）を base64 にしたもの、
+#   指し手・読み筋は shogi の整数の指し手。持ち駒の大文字・小文字もそのまま送るので、
+#   ワーカーが返す指し手はコーディネーターの合法手とそのまま比べられる。
+#
+# 並列化（ルートでの Young Brothers Wait）:
+#   深さ1から反復深化し、各深さで前の深さの評価値の順に手を並べる。
+#   最初の手（最善手の候補）だけを全幅の窓で読み、その値を α にして、残りの手を
+#   null window (α, α+1) で一斉に配る。α を超えた手は全幅で読み直し、α を更新する。
+#   古い α で配った手の結果が新しい α との比較に足りなければ、新しい α で配り直す（窓の更新）。
+#
+# 障害: ワーカーとの接続が切れる（またはタイムアウトする）と、そのワーカーは使わなくなり、
+#       読んでいた手はほかのワーカーに配り直す。すべてのワーカーを失ったら、
+#       コーディネーターのプロセスで残りを読む。
+
+import argparse
+import base64
+import json
+import multiprocessing as mp
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import selfplay
+import shogi
+
+DEFAULT_PORT = 8770
+CONNECT_TIMEOUT = 5.0   # ワーカーにつなぐときのタイムアウト（秒）
+
+# ============================================================
+# 局面の受け渡し
+# ============================================================
+
+def pack_position(pos):
+    """局面を送れる文字列にする（selfplay のレコードを base64 にしたもの）"""
+    return base64.b64encode(selfplay.pack_sample(pos, 0, 0, 0)).decode('ascii')
+
+def unpack_position(data):
+    """pack_position の逆"""
+    return selfplay.unpack_sample(base64.b64decode(data))['position']
+
+def run_job(tables, job):
+    """
+    1つの仕事（ルートの1手）を読む（ワーカーで動く。ワーカーを失ったときはコーディネーターでも使う）
+
+    Args:
+        tables: 使い回す SearchTables
+        job: 通信の "search" の辞書
+
+    Returns:
+        dict: 通信の応答の辞書
+    """
+    start = time.monotonic()
+    pos = unpack_position(job['position'])
+    try:
+        res = shogi.search_moves(pos, [job['move']], job['depth'], job['alpha'], job['beta'],
+                                 tables, job.get('time'))
+    except shogi.SearchAborted:
+        return {'id': job['id'], 'aborted': True}
+    return {'id': job['id'], 'score': res['score'], 'nodes': res['nodes'], 'pv': list(res['pv']),
+            'time': time.monotonic() - start}
+
+# ============================================================
+# ワーカー
+# ============================================================
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+                if req.get('op') == 'search':
+                    res = run_job(self.server.tables, req)
+                elif req.get('op') == 'clear':
+                    self.server.tables.clear()
+                    res = {'id': req.get('id'), 'type': 'cleared'}
+                elif req.get('op') == 'ping':
+                    res = {'type': 'pong'}
+                else:
+                    res = {'type': 'error', 'error': '不明な op です: %r' % req.get('op')}
+            except (ValueError, KeyError, TypeError) as e:
+                res = {'type': 'error', 'error': '%s: %s' % (type(e).__name__, e)}
+            self.wfile.write((json.dumps(res) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+class WorkerServer(socketserver.TCPServer):
+    """
+    コーディネーターから仕事を受けて読むワーカー（1プロセスで1つずつ読む）
+
+    Args:
+        host: 待ち受けるアドレス
+        port: 待ち受けるポート（0なら空いているポート）
+
+    実装の理由:
+        探索は shogi のモジュール変数（置換表・読み筋の表）を使うので、1プロセスで
+        同時に読めるのは1つだけ。接続も1つずつ受け持つ（ほかの接続は受け持ちが
+        終わるまで待たせる）。複数のコアを使うときはポートを変えて複数起動する。
+        置換表は接続をまたいで使い回す（局面・深さ・最大化側で決まる値なので、
+        別の探索の値を使っても間違いにはならない）。
+    """
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        super().__init__((host, port), _WorkerHandler)
+        self.tables = shogi.SearchTables()
+
+def serve_worker(host='127.0.0.1', port=DEFAULT_PORT, ready=None):
+    """
+    ワーカーを起動して待ち受け続ける
+
+    Args:
+        ready: 待ち受けを始めたらポート番号を送る multiprocessing の Connection（Noneなら送らない）
+    """
+    with WorkerServer(host, port) as server:
+        if ready is not None:
+            ready.send(server.server_address[1])
+            ready.close()
+        server.serve_forever()
+
+def start_local_workers(n, host='127.0.0.1', port=0):
+    """
+    このマシンでワーカーを n プロセス起動する（テスト・ベンチマーク・worker コマンド用）
+
+    Args:
+        port: 最初のワーカーのポート（0なら空いているポートを使う。それ以外は1つずつずらす）
+
+    Returns:
+        tuple: (プロセスのリスト, "host:port" のリスト)。終わったら stop_local_workers で止める
+    """
+    procs, addresses = [], []
+    for i in range(n):
+        recv, send = mp.Pipe(duplex=False)
+        p = mp.Process(target=serve_worker, args=(host, port + i if port else 0, send), daemon=True)
+        p.start()
+        send.close()
+        addresses.append('%s:%d' % (host, recv.recv()))
+        recv.close()
+        procs.append(p)
+    return procs, addresses
+
+def stop_local_workers(procs):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.join()
+
+# ============================================================
+# コーディネーター
+# ============================================================
+
+class _Worker:
+    """コーディネーターから見た1つのワーカー（接続と統計）"""
+
+    def __init__(self, address):
+        host, _, port = address.rpartition(':')
+        self.address = address
+        self.host, self.port = host or '127.0.0.1', int(port or DEFAULT_PORT)
+        self.sock = self.file = None
+        self.alive = True
+        self.error = None
+        self.jobs = self.nodes = 0
+        self.busy = 0.0
+
+    def request(self, job, timeout):
+        """仕事を送って応答を待つ（失敗したら OSError か ValueError）"""
+        if self.file is None:
+            self.sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+            self.sock.settimeout(timeout)
+            self.file = self.sock.makefile('rwb')
+        self.file.write((json.dumps(job) + '\n').encode('utf-8'))
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('ワーカーとの接続が切れました')
+        res = json.loads(line)
+        if res.get('id') != job['id']:
+            raise ValueError('ワーカーの応答が不正です: %r' % (res,))
+        return res
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+                self.sock.close()
+            except OSError:
+                pass
+            self.file = self.sock = None
+
+class Coordinator:
+    """
+    ワーカーに仕事を配って1つの局面を読む（Engine と同じ think / choose_move を持つ）
+
+    Args:
+        workers: ワーカーのアドレス（"host:port" のリスト）
+        depth: 探索する深さの既定値
+        timeout: 1つの仕事の応答を待つ秒数（超えたらそのワーカーを失ったとみなす。Noneなら待ち続ける）
+
+    使い方:
+        with Coordinator(['host1:8770', 'host2:8770']) as coordinator:
+            move = shogi.ai_choose_move(board, hands, turn, depth=4, engine=coordinator)
+
+    実装の理由:
+        ワーカーごとにスレッドを1つ持ち、共有の仕事のキューから取っては送り、
+        応答を結果のキューに入れる。探索の進め方（窓の管理）はすべて呼び出し側の
+        スレッドで行うので、スレッドの間で共有するのはキューと統計だけ。
+        ワーカーを失ったスレッドは、読んでいた仕事をキューに戻して終わる。
+        評価関数は各ワーカーの設定を使う（評価関数そのものは送らない）。
+    """
+
+    def __init__(self, workers, depth=3, timeout=None):
+        self.depth = depth
+        self.timeout = timeout
+        self.workers = [_Worker(a) for a in workers]
+        self.stats = {'searches': 0, 'lost': 0}  # lost: 失ったワーカーの数
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._tables = shogi.SearchTables()  # ワーカーを失ったときに自分で読む用
+        self._next_id = 0
+        self._redispatched = 0
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._serve, args=(w,), daemon=True)
+                         for w in self.workers]
+        for t in self._threads:
+            t.start()
+
+    def close(self):
+        """ワーカーのスレッドを止めて接続を閉じる"""
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def new_game(self):
+        """
+        生きているワーカーの置換表などの表を空にする（Engine.new_game と同じ役目）
+
+        実装の理由:
+            探索と探索の間（どのスレッドも仕事を待っているとき）にだけ呼ぶので、
+            このスレッドから直接ワーカーに送ってもスレッドの送受信とは重ならない。
+        """
+        for w in self.workers:
+            if w.alive:
+                self._next_id += 1
+                try:
+                    w.request({'op': 'clear', 'id': self._next_id}, self.timeout)
+                except (OSError, ValueError):
+                    w.close()
+
+    def _serve(self, w):
+        """1つのワーカーを受け持つスレッド"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                w.close()
+                return
+            start = time.monotonic()
+            try:
+                res = w.request(job, self.timeout)
+            except (OSError, ValueError) as e:
+                w.alive = False
+                w.error = '%s: %s' % (type(e).__name__, e)
+                w.close()
+                # 読んでいた仕事はほかのワーカー（またはコーディネーター）に回す
+                with self._lock:
+                    self._redispatched += 1
+                self._jobs.put(job)
+                return
+            w.busy += time.monotonic() - start
+            self._results.put((job, w, res))
+
+    def _next_result(self):
+        """
+        結果を1つ受け取る
+
+        Returns:
+            tuple: (仕事, 応答)
+
+        実装の理由:
+            生きているワーカーがいれば結果を待つだけ。すべて失ったら、
+            キューに残った仕事をこのスレッドで読む（少しずつ待ちながら確かめる）。
+        """
+        while True:
+            if not any(w.alive for w in self.workers):
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    pass
+                else:
+                    if job is not None:
+                        return job, run_job(self._tables, job)
+            try:
+                job, w, res = self._results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if 'nodes' in res:
+                w.jobs += 1
+                w.nodes += res['nodes']
+            return job, res
+
+    def _submit(self, packed, move, depth, alpha, beta, deadline):
+        self._next_id += 1
+        self._jobs.put({'op': 'search', 'id': self._next_id, 'position': packed, 'move': move,
+                        'depth': depth, 'alpha': alpha, 'beta': beta,
+                        'time': max(0.0, deadline - time.monotonic()) if deadline is not None else None})
+
+    def _search_depth(self, packed, order, depth, deadline, stats):
+        """
+        1つの深さを読む
+
+        Returns:
+            tuple: (評価値, 最善手, 読み筋, 指し手 -> 評価値（上限を含む）)。時間切れならNone
+        """
+        self._submit(packed, order[0], depth, -1e9, 1e9, deadline)
+        job, res = self._next_result()
+        if res.get('aborted'):
+            return None
+        stats['nodes'] += res['nodes']
+        alpha, best, pv = res['score'], order[0], res['pv']
+        scores = {best: alpha}
+        for m in order[1:]:
+            self._submit(packed, m, depth, alpha, alpha + 1, deadline)
+        pending = len(order) - 1
+        aborted = False
+        while pending:
+            job, res = self._next_result()
+            pending -= 1
+            if res.get('aborted'):
+                aborted = True
+                continue
+            stats['nodes'] += res['nodes']
+            if aborted:
+                continue
+            m, s = job['move'], res['score']
+            if job['beta'] - job['alpha'] > 1:
+                # 全幅で読み直した結果
+                scores[m] = s
+                if s > alpha:
+                    alpha, best, pv = s, m, res['pv']
+            elif s <= job['alpha']:
+                scores[m] = s
+            elif s <= alpha:
+                # 配ったあとで α が上がったので、新しい α で配り直す
+                stats['window_updates'] += 1
+                self._submit(packed, m, depth, alpha, alpha + 1, deadline)
+                pending += 1
+            else:
+                stats['researches'] += 1
+                self._submit(packed, m, depth, alpha, 1e9, deadline)
+                pending += 1
+        return None if aborted else (alpha, best, pv, scores)
+
+    def think(self, board, hands=None, turn=None, depth=None, nodes=None, time_limit=None,
+              stop=None, time_manager=None):
+        """
+        反復深化で読み、結果を返す（引数と戻り値は search と同じ）
+
+        Returns:
+            dict: search の戻り値に、分散の統計を加えたもの
+                  'researches': α を超えて全幅で読み直した手の数
+                  'window_updates': α が上がったため null window を配り直した数
+                  'redispatched': ワーカーを失ったため、ほかのワーカー（またはこのプロセス）で読み直した仕事の数
+                  'workers': [{'address', 'alive', 'jobs', 'nodes', 'busy'}, ...]
+                  'utilization': ワーカーが仕事をしていた時間の割合（生きているワーカーの数で割る）
+
+        実装の理由:
+            nodes は深さを1つ読み終えるごとに確かめ、超えていたら次の深さに進まない。
+            時間の制限は各仕事に残り時間として付けるので、ワーカーが時間切れで打ち切る。
+            stop は深さを1つ読み終えるごとに確かめる。
+        """
+        root = board.copy() if isinstance(board, shogi.Position) else shogi.Position.from_board(board, hands, turn)
+        start = time.monotonic()
+        deadline = start + time_limit if time_limit is not None else None
+        if time_manager is not None:
+            deadline = min(deadline, time_manager.deadline()) if deadline is not None else time_manager.deadline()
+        for w in self.workers:
+            w.jobs = w.nodes = 0
+            w.busy = 0.0
+        stats = {'nodes': 0, 'researches': 0, 'window_updates': 0}
+        self._redispatched = 0
+        buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+        order = list(buf[:shogi.generate_legal_moves(root, buf)])
+        packed = pack_position(root)
+        best, score, pv, done = (order[0] if order else None), None, (), 0
+        prev = {}
+        for d in range(1, (depth or self.depth) + 1):
+            if not order:
+                break
+            order.sort(key=lambda m: -prev.get(m, -1e9))
+            res = self._search_depth(packed, order, d, deadline, stats)
+            if res is None:
+                break
+            score, best, pv, prev = res
+            done = d
+            if time_manager is not None:
+                time_manager.on_iteration(d, score, best)
+                if time_manager.should_stop():
+                    break
+            if (nodes is not None and stats['nodes'] >= nodes) or (stop is not None and stop()):
+                break
+        if done == 0:
+            pv = (best,) if best is not None else ()
+        elapsed = time.monotonic() - start
+        alive = sum(w.alive for w in self.workers)
+        self.stats['searches'] += 1
+        self.stats['lost'] = len(self.workers) - alive
+        return {
+            'move': shogi.decode_move(best) if best is not None else None,
+            'score': score,
+            'pv': [shogi.decode_move(m) for m in pv],
+            'depth': done,
+            'nodes': stats['nodes'],
+            'time': elapsed,
+            'researches': stats['researches'],
+            'window_updates': stats['window_updates'],
+            'redispatched': self._redispatched,
+            'workers': [{'address': w.address, 'alive': w.alive, 'jobs': w.jobs, 'nodes': w.nodes,
+                         'busy': w.busy} for w in self.workers],
+            'utilization': sum(w.busy for w in self.workers) / (elapsed * alive) if alive and elapsed else 0.0,
+        }
+
+    def choose_move(self, board, hands=None, turn=None, depth=None, nodes=None, time_limit=None,
+                    time_manager=None):
+        """think の最善手だけを返す（ai_choose_move と同じ形）"""
+        return self.think(board, hands, turn, depth, nodes, time_limit, time_manager=time_manager)['move']
+
+# ============================================================
+# スケーリングの計測
+# ============================================================
+
+def scaling_report(board, hands, turn, workers, depth=4, timeout=None):
+    """
+    ワーカーの数を1, 2, 4, ... と増やして同じ局面を読み、速くなった割合を調べる
+
+    Args:
+        workers: ワーカーのアドレスのリスト（先頭から使う）
+
+    Returns:
+        list: [{'workers', 'time', 'nodes', 'speedup', 'efficiency', 'move', 'score'}, ...]
+              speedup はワーカー1つのときの時間との比、efficiency は speedup / ワーカー数
+
+    実装の理由:
+        ワーカーの置換表が前の計測で読んだ値を覚えていると速く見えるので、
+        計測ごとに new_game ですべてのワーカーの表を空にしてから読む。
+        ノード数は仕事の配り方で変わる（並列にすると α が決まる前に読む手が増える）ので、
+        時間と一緒に返して、探索の無駄の増え方も見られるようにする。
+    """
+    counts = []
+    n = 1
+    while n < len(workers):
+        counts.append(n)
+        n *= 2
+    counts.append(len(workers))
+    rows = []
+    for n in counts:
+        with Coordinator(workers, depth, timeout) as c:
+            c.new_game()
+        with Coordinator(workers[:n], depth, timeout) as c:
+            res = c.think(board, hands, turn)
+        base = rows[0]['time'] if rows else res['time']
+        rows.append({'workers': n, 'time': res['time'], 'nodes': res['nodes'],
+                     'speedup': base / res['time'], 'efficiency': base / res['time'] / n,
+                     'move': res['move'], 'score': res['score']})
+    return rows
+
+# ============================================================
+# 実行
+# ============================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 分散探索')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('worker', help='ワーカーを起動する')
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--procs', type=int, default=1, help='起動するワーカーの数（ポートを1つずつずらす）')
+    p = sub.add_parser('bench', help='ワーカーの数を変えて速くなった割合を調べる')
+    p.add_argument('--workers', required=True, help='ワーカーのアドレス（host:port をカンマ区切り）')
+    p.add_argument('--depth', type=int, default=4)
+    p.add_argument('--sfen', default='startpos')
+    p.add_argument('--timeout', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        if args.procs == 1:
+            print(f"{args.host}:{args.port} で待ち受けます", file=sys.stderr)
+            serve_worker(args.host, args.port)
+            return
+        procs, addresses = start_local_workers(args.procs, args.host, args.port)
+        print('%s で待ち受けます' % ', '.join(addresses), file=sys.stderr)
+        try:
+            for p in procs:
+                p.join()
+        except KeyboardInterrupt:
+            stop_local_workers(procs)
+        return
+
+    board, hands, turn, _ = shogi.sfen_to_board(args.sfen)
+    for row in scaling_report(board, hands, turn, args.workers.split(','), args.depth, args.timeout):
+        print(f"ワーカー{row['workers']:3d}  {row['time']:7.2f}秒  {row['nodes']:9d}ノード  "
+              f"速さ{row['speedup']:5.2f}倍  効率{row['efficiency'] * 100:5.1f}%  "
+              f"{row['move']} {row['score']}")
+
+
+if __name__ == "__main__":
+    main()
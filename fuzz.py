@@ -0,0 +1,312 @@
+# ============================================================
+# 将棋AI 差分ファジング（高速な実装と参照実装の突き合わせ）
+# ============================================================
+# ランダムな合法局面をたくさん作り、shogi.py の高速な実装と
+# shogi_reference.py の参照実装（ルールを素直に書いたもの）の結果を比べる。
+# 食い違いが見つかったら、食い違いが残る範囲で駒を取り除いていき、
+# 最小の再現局面（SFEN）にして報告する。
+#
+# 使い方:
+#   python fuzz.py --seed 1 --cases 2000             # 決まった seed で決まった数だけ調べる（テスト用）
+#   python fuzz.py --soak --duration 3600 -o bad.jsonl  # seed を変えながら時間いっぱい調べ続ける
+#   python fuzz.py --seed 1 --case 1234              # 1局面だけ作り直して調べる（再現用）
+#
+# 局面の作り方: 初期局面から0〜MAX_PLIES手ランダムに指す。半分の局面では
+# 最初に両者へランダムな持ち駒を配り、打つ手（打ち歩詰め・二歩・行き所のない駒）も
+# たくさん通るようにする。局面は SFEN を通して作り直すので、報告した SFEN から
+# まったく同じ局面を再現できる。
+#
+# 出力: 食い違い1件を1行のJSON
+#   {"seed", "case", "check", "sfen", "shrunk", "expected", "actual"}
+#   expected は参照実装、actual は高速な実装の結果（shrunk の局面での値）
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import random
+import sys
+import time
+
+import shogi
+import shogi_reference as reference
+
+MAX_PLIES = 160
+CHUNK = 50          # ワーカーに1回で渡す局面数
+HAND_PIECES = 'PPPPLNSGBR'
+
+# ============================================================
+# 比べる実装
+# ============================================================
+# 名前 -> 関数(board, hands, turn) -> (参照実装の結果, 高速な実装の結果)
+# 新しく高速な実装を入れたら、ここに突き合わせを足す。
+
+def check_legal_moves(board, hands, turn):
+    """全合法手（順番は問わないが、重複も含めて同じ手の集まり）"""
+    return (sorted(reference.get_all_legal_moves(board, hands, turn)),
+            sorted(shogi.get_all_legal_moves(board, hands, turn)))
+
+def check_is_check(board, hands, turn):
+    """両方の側の王手判定"""
+    sides = ('sente', 'gote')
+    return ([reference.is_check(board, s) for s in sides], [shogi.is_check(board, s) for s in sides])
+
+def check_uchifuzume(board, hands, turn):
+    """手番側が歩を打てるすべての空きマスでの打ち歩詰めの判定"""
+    squares = [(r, f) for r in range(1, 10) for f in range(1, 10) if (r, f) not in board]
+    return ([sq for sq in squares if reference.is_uchifuzume(board, hands, sq, turn)],
+            [sq for sq in squares if shogi.is_uchifuzume(board, hands, sq, turn)])
+
+def check_evaluate(board, hands, turn):
+    """両方の側から見た評価値"""
+    sides = ('sente', 'gote')
+    return ([reference.evaluate_board(board, s) for s in sides],
+            [shogi.evaluate_board(board, s) for s in sides])
+
+CHECKS = {
+    'legal_moves': check_legal_moves,
+    'is_check': check_is_check,
+    'uchifuzume': check_uchifuzume,
+    'evaluate': check_evaluate,
+}
+
+def run_check(name, board, hands, turn):
+    """
+    1つの突き合わせを実行する
+
+    Returns:
+        tuple or None: 食い違えば (参照実装の結果, 高速な実装の結果)、一致すればNone
+
+    実装の理由:
+        片方だけが例外を出すのも食い違いとして扱う（例外の種類を結果として比べる）。
+    """
+    results = []
+    for i in (0, 1):
+        try:
+            results.append(CHECKS[name](board, hands, turn)[i])
+        except Exception as e:  # 実装の不具合も報告する
+            results.append('%s: %s' % (type(e).__name__, e))
+    return None if results[0] == results[1] else tuple(results)
+
+# ============================================================
+# 局面の生成と縮小
+# ============================================================
+
+def random_position(seed, case, max_plies=MAX_PLIES):
+    """
+    seed と局面番号から決まるランダムな局面
+
+    Returns:
+        tuple: (SFEN, 盤面, 持ち駒, 手番)
+
+    実装の理由:
+        局面番号ごとに乱数を作り直すので、どのワーカーで何番目に作っても
+        同じ局面になり、--case で1局面だけ作り直せる。
+        指し手は高速な生成器で選ぶが、選ぶだけなので比べる結果には影響しない。
+    """
+    rng = random.Random(seed * 1000003 + case)
+    hands = shogi.create_empty_hands()
+    if rng.random() < 0.5:
+        for side in ('sente', 'gote'):
+            hands[side] = [rng.choice(HAND_PIECES) for _ in range(rng.randint(0, 4))]
+    pos = shogi.Position.from_board(shogi.create_initial_board(), hands, 'sente')
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    for _ in range(rng.randint(0, max_plies)):
+        n = shogi.generate_legal_moves(pos, buf)
+        if not n:
+            break
+        pos.do_move(buf[rng.randrange(n)])
+    sfen = shogi.board_to_sfen(pos, None, None)
+    board, hands, turn, _ = shogi.sfen_to_board(sfen)
+    return sfen, board, hands, turn
+
+def shrink(name, board, hands, turn):
+    """
+    食い違いが残る範囲で、盤上の駒（玉以外）と持ち駒を1つずつ取り除く
+
+    Returns:
+        tuple: (盤面, 持ち駒) どの駒を1つ取り除いても食い違いが消える局面
+
+    実装の理由:
+        1つ取り除いて食い違いが残れば採用し、最初からやり直す（貪欲な縮小）。
+        玉を取り除くと王手・打ち歩詰めの判定が意味を持たなくなるので残す。
+    """
+    changed = True
+    while changed:
+        changed = False
+        for rf in sorted(board):
+            if board[rf] in ('k', 'K'):
+                continue
+            b = dict(board)
+            del b[rf]
+            if run_check(name, b, hands, turn) is not None:
+                board, changed = b, True
+                break
+        if changed:
+            continue
+        for side in ('sente', 'gote'):
+            for p in dict.fromkeys(hands[side]):
+                h = {s: list(hands[s]) for s in hands}
+                h[side].remove(p)
+                if run_check(name, board, h, turn) is not None:
+                    hands, changed = h, True
+                    break
+            if changed:
+                break
+    return board, hands
+
+def fuzz_case(seed, case, checks=None):
+    """
+    1局面を作ってすべての突き合わせを行う
+
+    Returns:
+        list: 食い違いの報告（出力する1行分の辞書）のリスト
+    """
+    sfen, board, hands, turn = random_position(seed, case)
+    found = []
+    for name in checks or CHECKS:
+        if run_check(name, board, hands, turn) is None:
+            continue
+        b, h = shrink(name, board, hands, turn)
+        expected, actual = run_check(name, b, h, turn)
+        found.append({'seed': seed, 'case': case, 'check': name, 'sfen': sfen,
+                      'shrunk': shogi.board_to_sfen(b, h, turn),
+                      'expected': expected, 'actual': actual})
+    return found
+
+def fuzz_range(task):
+    """
+    連続した局面番号をまとめて調べる（ワーカープロセスで動く）
+
+    Args:
+        task: (seed, 最初の局面番号, 局面数, 調べる突き合わせの名前のリスト)
+
+    Returns:
+        tuple: (調べた局面数, 食い違いの報告のリスト)
+    """
+    seed, start, count, checks = task
+    found = []
+    for case in range(start, start + count):
+        found.extend(fuzz_case(seed, case, checks))
+    return count, found
+
+# ============================================================
+# 実行
+# ============================================================
+
+def _tasks(seed, cases, checks, soak):
+    """ワーカーに渡す仕事を順に作る（soak なら seed を変えて終わりなく作る）"""
+    while True:
+        for start in range(0, cases, CHUNK):
+            yield (seed, start, min(CHUNK, cases - start), checks)
+        if not soak:
+            return
+        seed += 1
+
+def run(seed=0, cases=1000, workers=2, checks=None, out=None, soak=False, duration=None,
+        progress=None):
+    """
+    局面を作って突き合わせる
+
+    Args:
+        seed: 乱数の seed（soak なら cases 局面ごとに1ずつ増やす）
+        cases: 調べる局面数（soak なら seed 1つあたりの局面数）
+        workers: ワーカープロセスの数
+        checks: 調べる突き合わせの名前のリスト（Noneならすべて）
+        out: 食い違いを1行ずつ書き出すファイル（Noneなら書き出さない）
+        soak: True なら duration 秒が過ぎるか中断されるまで調べ続ける
+        duration: soak の時間の上限（秒。Noneなら無制限）
+        progress: 進み具合を受け取る関数 progress(調べた局面数, 食い違いの数, 経過秒)
+
+    Returns:
+        dict: {'cases', 'mismatches', 'time', 'reports'}
+
+    実装の理由:
+        局面の生成と突き合わせ（参照実装は遅い）をワーカーで並列に行い、
+        食い違いの縮小もそのワーカーで済ませる。Pool.imap は仕事を先読みしきって
+        しまう（soak では終わりがない）ため、処理中の仕事をワーカー数の2倍までに
+        抑えて投入し、終わった順に受け取る。Ctrl-C で止めたときも、それまでの結果を返す。
+    """
+    start = time.monotonic()
+    done = 0
+    reports = []
+    pool = mp.Pool(workers)
+    try:
+        tasks = _tasks(seed, cases, checks, soak)
+        inflight = [pool.apply_async(fuzz_range, (t,)) for t in itertools.islice(tasks, workers * 2)]
+        while inflight:
+            ready = next((r for r in inflight if r.ready()), None)
+            if ready is None:
+                inflight[0].wait(0.05)
+                continue
+            inflight.remove(ready)
+            count, found = ready.get()
+            done += count
+            for report in found:
+                reports.append(report)
+                if out is not None:
+                    out.write(json.dumps(report, ensure_ascii=False) + '\n')
+                    out.flush()
+            elapsed = time.monotonic() - start
+            if progress is not None:
+                progress(done, len(reports), elapsed)
+            if soak and duration is not None and elapsed >= duration:
+                break
+            inflight.extend(pool.apply_async(fuzz_range, (t,)) for t in itertools.islice(tasks, 1))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.terminate()
+        pool.join()
+    return {'cases': done, 'mismatches': len(reports), 'time': time.monotonic() - start,
+            'reports': reports}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 差分ファジング')
+    parser.add_argument('--seed', type=int, help='乱数の seed（省略時は soak なら現在時刻、それ以外は0）')
+    parser.add_argument('--cases', type=int, default=1000, help='調べる局面数（soak では seed 1つあたり）')
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count()))
+    parser.add_argument('--checks', help='調べる突き合わせ（カンマ区切り。%s）' % ','.join(CHECKS))
+    parser.add_argument('--soak', action='store_true', help='seed を変えながら調べ続ける')
+    parser.add_argument('--duration', type=float, help='soak の時間の上限（秒）')
+    parser.add_argument('--case', type=int, help='この番号の局面だけを調べる')
+    parser.add_argument('-o', '--output', help='食い違いを書き出すJSONLファイル')
+    args = parser.parse_args(argv)
+
+    checks = args.checks.split(',') if args.checks else None
+    unknown = set(checks or ()) - set(CHECKS)
+    if unknown:
+        parser.error('unknown check: %s' % ', '.join(sorted(unknown)))
+    seed = args.seed if args.seed is not None else (int(time.time()) if args.soak else 0)
+    out = open(args.output, 'a', encoding='utf-8') if args.output else None
+
+    if args.case is not None:
+        reports = fuzz_case(seed, args.case, checks)
+        print(random_position(seed, args.case)[0])
+        for report in reports:
+            print(json.dumps(report, ensure_ascii=False))
+            if out is not None:
+                out.write(json.dumps(report, ensure_ascii=False) + '\n')
+        print('一致しました' if not reports else '%d件の食い違い' % len(reports))
+        return 1 if reports else 0
+
+    last = [0.0]
+
+    def progress(done, mismatches, elapsed):
+        if elapsed - last[0] >= 10:
+            last[0] = elapsed
+            print(f"{done}局面 {done / elapsed:.0f}局面/秒 食い違い{mismatches}件", file=sys.stderr)
+
+    print(f"seed {seed} から調べます（{args.workers}プロセス）", file=sys.stderr)
+    res = run(seed, args.cases, args.workers, checks, out, args.soak, args.duration, progress)
+    if out is not None:
+        out.close()
+    for report in res['reports']:
+        print('食い違い: %s case %d: %s' % (report['check'], report['case'], report['shrunk']))
+    print(f"{res['cases']}局面を調べました（食い違い{res['mismatches']}件）{res['time']:.1f}秒",
+          file=sys.stderr)
+    return 1 if res['mismatches'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,500 @@
+# ============================================================
+# 将棋AI 対局サーバー（asyncio）
+# ============================================================
+# 1つのプロセスで多数の対局を同時に受け持つ。通信と対局の進行は
+# イベントループで行い、AIの思考は共有のプロセスプールで行う
+# （run_in_executor）ので、探索中もほかの対局の通信は止まらない。
+#
+# 使い方:
+#   python game_server.py --port 8766 --workers 4 --max-think 5
+#
+# 通信: TCPで1行1つのJSON（改行区切り）。1つの接続で複数の対局を持てる。
+#   {"op": "new", "human": "sente", "depth": 3, "main_time": 600, "byoyomi": 10, "sfen": "startpos"}
+#       → {"type": "started", "game": ID, ...局面}
+#   {"op": "move", "game": ID, "move": ["move", [7, 7], [6, 7]]}   （"move 7 7 6 7" の文字列も可）
+#       → {"type": "moved", ...局面}、AIが指すと {"type": "ai_move", "move": ..., ...局面}
+#   {"op": "state", "game": ID} → {"type": "state", ...局面}
+#   {"op": "resign", "game": ID} → {"type": "state", ...局面}（終局）
+#   {"op": "stats"} → {"type": "stats", ...}
+#   エラーは {"type": "error", "error": 理由}。局面には "status"（"playing" / "finished"）と
+#   終局なら "winner"・"reason"（"checkmate" / "no_moves" / "time" / "resign"）が付く。
+#
+# 公平性: 同時に探索できるのはワーカーの数だけ。空きを待つ対局は、
+#         これまでに使った思考時間が短い対局から順に探索させる。
+#         1手の思考時間は --max-think 秒で打ち切るので、深い探索をする対局が
+#         ほかの対局を待たせ続けることはない。
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import shogi
+
+DEFAULT_DEPTH = 3
+DEFAULT_MAX_THINK = 5.0   # 1手の思考時間の上限（秒）
+DEFAULT_MAX_GAMES = 1000  # 同時に持てる対局数の上限
+MAX_LINE = 64 * 1024      # 1行（1メッセージ）の長さの上限
+
+
+class GameError(Exception):
+    """要求を受け付けられないことを表す例外（エラーとしてクライアントに返す）"""
+
+
+# ============================================================
+# ワーカープロセス
+# ============================================================
+
+def _think(sfen, depth, max_think, clock=None):
+    """
+    1手を考える（ワーカープロセスで動く）
+
+    Args:
+        sfen: 局面
+        depth: 探索する深さ
+        max_think: 思考時間の上限（秒）
+        clock: 持ち時間があれば {'remaining', 'byoyomi', 'increment', 'move_number'}
+
+    Returns:
+        dict: {'move', 'score', 'depth', 'nodes', 'time'}
+
+    実装の理由:
+        TimeManager の状態はプロセスをまたいで共有できないので、
+        残り時間からワーカー側で作り直して soft/hard を決め、
+        hard を思考時間の上限で抑える。消費時間はサーバー側の時計で引く。
+    """
+    board, hands, turn, _ = shogi.sfen_to_board(sfen)
+    if clock is None:
+        res = shogi.search(board, hands, turn, depth=depth, time_limit=max_think)
+    else:
+        tm = shogi.TimeManager(clock['remaining'], clock['byoyomi'], clock['increment'])
+        tm.start_move(turn, clock['move_number'])
+        tm.hard = min(tm.hard, max_think)
+        tm.soft = min(tm.soft, tm.hard)
+        res = shogi.search(board, hands, turn, depth=shogi.MAX_CLOCK_DEPTH, time_manager=tm)
+    return {k: res[k] for k in ('move', 'score', 'depth', 'nodes', 'time')}
+
+
+# ============================================================
+# 思考の割り当て（公平なスケジューリング）
+# ============================================================
+
+class FairScheduler:
+    """
+    同時に探索する数をワーカーの数までに抑え、空きを公平に割り当てる
+
+    Args:
+        slots: 同時に探索できる数（プロセスプールのワーカー数）
+
+    実装の理由:
+        プロセスプールにそのまま投げると、先に投げた対局から順に処理され、
+        深く読む対局が続くと後から来た対局が長く待たされる。
+        空きを待つ対局を「これまでに使った思考時間」の短い順に並べ、
+        同じなら先に待ち始めた順に割り当てる。
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.running = 0
+        self._waiters = []  # (使った思考時間, 順番, Future) のヒープ
+        self._seq = itertools.count()
+
+    @property
+    def waiting(self):
+        return sum(1 for _, _, fut in self._waiters if not fut.done())
+
+    async def acquire(self, priority):
+        """空きができるまで待つ（priority が小さいほど先）"""
+        if self.running < self.slots and not self.waiting:
+            self.running += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # 割り当てられた直後に取り消された
+            raise
+
+    def release(self):
+        """空きを返し、待っている中で最も優先度の高い対局に渡す"""
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # running の数はそのまま引き継ぐ
+                return
+        self.running -= 1
+
+
+# ============================================================
+# 対局
+# ============================================================
+
+class Game:
+    """
+    1局分の状態（盤面・持ち駒・手番・持ち時間）
+
+    Args:
+        game_id: 対局ID
+        human: 人間の手番 'sente' または 'gote'
+        depth: AIの探索の深さ（持ち時間があるときは時間で打ち切る）
+        sfen: 開始局面
+        clock: 持ち時間の TimeManager（Noneなら時間制限なし）
+    """
+
+    def __init__(self, game_id, human='sente', depth=DEFAULT_DEPTH, sfen='startpos', clock=None):
+        if human not in ('sente', 'gote'):
+            raise GameError('human は sente か gote です: %r' % (human,))
+        try:
+            self.board, self.hands, self.turn, _ = shogi.sfen_to_board(sfen)
+        except ValueError as e:
+            raise GameError(str(e))
+        self.id = game_id
+        self.human = human
+        self.ai = 'gote' if human == 'sente' else 'sente'
+        self.depth = depth
+        self.clock = clock
+        self.move_number = 0
+        self.moves = []
+        self.status = 'playing'
+        self.winner = None
+        self.reason = None
+        self.think_used = 0.0   # AIがこの対局で使った思考時間（公平性の判断に使う）
+        self.thinking = False
+        self.task = None
+        self.send = None        # 結果を送る関数（接続ごと）
+        if clock is not None and self.turn == human:
+            clock.start_move(self.turn, self.move_number)
+
+    def state(self):
+        """クライアントに送る局面の情報"""
+        res = {'game': self.id, 'sfen': shogi.board_to_sfen(self.board, self.hands, self.turn,
+                                                             self.move_number + 1),
+               'turn': self.turn, 'human': self.human, 'moves': len(self.moves),
+               'status': self.status, 'thinking': self.thinking}
+        if self.clock is not None:
+            res['clock'] = dict(self.clock.remaining)
+        if self.status == 'finished':
+            res.update(winner=self.winner, reason=self.reason)
+        return res
+
+    def hand_letter(self, piece):
+        """
+        手番側の持ち駒の中で、打つ駒 piece（大文字・小文字は問わない）の実際の表記
+
+        実装の理由:
+            取った駒は大小反転して持ち駒になる（先手が取った歩は 'p'）が、
+            state の SFEN やワーカーが SFEN から読んだ局面では持ち駒は大文字になる。
+            クライアント・ワーカーから来る打つ手はどちらの表記でも受け付け、
+            この対局の持ち駒の表記に直してから指す。
+        """
+        for p in self.hands[self.turn]:
+            if p.upper() == piece.upper():
+                return p
+        return piece
+
+    def finish(self, winner, reason):
+        self.status = 'finished'
+        self.winner = winner
+        self.reason = reason
+
+    def play(self, move):
+        """
+        手番側の手を指し、時計を進めて終局を判定する
+
+        Raises:
+            GameError: 指せない手（動かす駒・打つ持ち駒がない）の場合。局面は変わらない
+
+        実装の理由:
+            play_game と同じ順番で、指した側の消費時間を引いてから手番を渡し、
+            手番側が詰んでいるか・指す手がないかを調べる。
+        """
+        turn = self.turn
+        if move[0] == 'move':
+            board, hands = shogi.make_move(self.board, move[1], move[2], self.hands, turn=turn)
+        else:
+            board, hands = shogi.drop_piece(self.board, self.hands, self.hand_letter(move[1]), move[2], turn)
+        if board is None:
+            raise GameError('指せない手です: %r' % (move,))
+        self.board, self.hands = board, hands
+        self.moves.append(move)
+        other = 'gote' if turn == 'sente' else 'sente'
+        if self.clock is not None and not self.clock.finish_move(turn):
+            self.finish(other, 'time')
+            return
+        self.turn = other
+        self.move_number += 1
+        if shogi.is_checkmate(self.board, self.hands, other):
+            self.finish(turn, 'checkmate')
+        elif not shogi.get_all_legal_moves(self.board, self.hands, other):
+            self.finish(turn, 'no_moves')
+        elif self.clock is not None and other == self.human:
+            self.clock.start_move(other, self.move_number)
+
+
+def parse_move(obj):
+    """
+    クライアントから受け取った指し手を ('move', 元, 先) / ('drop', 駒, 位置) にする
+
+    Raises:
+        GameError: 指し手の形式が不正な場合
+    """
+    try:
+        if isinstance(obj, str):
+            move = shogi.parse_input(obj)
+        elif obj[0] == 'move':
+            move = ('move', tuple(obj[1]), tuple(obj[2]))
+        else:
+            move = (obj[0], obj[1], tuple(obj[2]))
+    except (IndexError, TypeError, ValueError, KeyError):
+        move = None
+    if move is None:
+        raise GameError('指し手の形式が不正です: %r' % (obj,))
+    return move
+
+
+# ============================================================
+# サーバー
+# ============================================================
+
+class GameServer:
+    """
+    多数の対局を受け持ち、AIの思考を共有のプロセスプールで行う
+
+    Args:
+        workers: 思考に使うワーカープロセスの数
+        max_think: 1手の思考時間の上限（秒）
+        max_games: 同時に持てる対局数の上限
+
+    実装の理由:
+        対局の状態はすべてイベントループのスレッドだけが触るので、ロックはいらない。
+        AIの手番になったら対局ごとにタスクを作り、FairScheduler で空きを待ってから
+        run_in_executor でワーカーに探索させる。待っている間も、探索している間も
+        イベントループはほかの接続を処理できる。
+        AIの持ち時間は、ワーカーに割り当てられた時点から数える
+        （空き待ちの時間はサーバーの都合なので、AIの持ち時間から引かない）。
+    """
+
+    def __init__(self, workers=2, max_think=DEFAULT_MAX_THINK, max_games=DEFAULT_MAX_GAMES):
+        self.workers = workers
+        self.max_think = max_think
+        self.max_games = max_games
+        self.games = {}
+        self.scheduler = FairScheduler(workers)
+        self.executor = None
+        self.searches = 0
+        self._ids = itertools.count(1)
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8766):
+        """接続の受け付けを始める（port=0 なら空いているポート）"""
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=mp.get_context('spawn'))
+        self._server = await asyncio.start_server(self._handle_client, host, port, limit=MAX_LINE)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """接続の受け付けをやめ、思考中のタスクを止めてワーカーを終了する"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for game in list(self.games.values()):
+            self._drop_game(game)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        """対局数・探索の状況"""
+        return {'games': len(self.games),
+                'playing': sum(1 for g in self.games.values() if g.status == 'playing'),
+                'thinking': self.scheduler.running, 'waiting': self.scheduler.waiting,
+                'workers': self.workers, 'searches': self.searches}
+
+    # ---- 要求の処理 ----
+
+    def new_game(self, req, send):
+        """対局を作る（AIが先手なら考え始める）"""
+        if len(self.games) >= self.max_games:
+            raise GameError('対局数が上限(%d)に達しています' % self.max_games)
+        clock = None
+        if req.get('main_time') is not None:
+            clock = shogi.TimeManager(float(req['main_time']), float(req.get('byoyomi', 0)),
+                                      float(req.get('increment', 0)))
+        game = Game('game-%d' % next(self._ids), req.get('human', 'sente'),
+                    int(req.get('depth', DEFAULT_DEPTH)), req.get('sfen', 'startpos'), clock)
+        game.send = send
+        self.games[game.id] = game
+        self._start_ai(game)
+        return game
+
+    def human_move(self, game, move):
+        """人間の手を検証して指し、AIの手番なら考え始める"""
+        if game.status != 'playing':
+            raise GameError('対局は終わっています')
+        if game.turn != game.human:
+            raise GameError('あなたの手番ではありません')
+        if move[0] == 'drop':
+            move = ('drop', game.hand_letter(move[1]), move[2])
+        if move not in shogi.get_all_legal_moves(game.board, game.hands, game.turn):
+            raise GameError('不正な手です: %r' % (move,))
+        game.play(move)
+        self._start_ai(game)
+
+    def _start_ai(self, game):
+        if game.status == 'playing' and game.turn == game.ai and not game.thinking:
+            game.thinking = True
+            game.task = asyncio.ensure_future(self._ai_turn(game))
+
+    async def _ai_turn(self, game):
+        """AIの1手（空きを待ち、ワーカーで考え、指して結果を送る）"""
+        loop = asyncio.get_running_loop()
+        await self.scheduler.acquire(game.think_used)
+        if game.status != 'playing':
+            # 空きを待っている間に終局した（投了など）
+            self.scheduler.release()
+            game.thinking = False
+            return
+        clock = None
+        if game.clock is not None:
+            game.clock.start_move(game.turn, game.move_number)
+            clock = {'remaining': dict(game.clock.remaining), 'byoyomi': game.clock.byoyomi,
+                     'increment': game.clock.increment, 'move_number': game.move_number}
+        sfen = shogi.board_to_sfen(game.board, game.hands, game.turn)
+        start = time.monotonic()
+        fut = loop.run_in_executor(self.executor, _think, sfen, game.depth, self.max_think, clock)
+        try:
+            res = await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # ワーカーの探索は途中で止められないので、終わるまで空きは返さない
+            fut.add_done_callback(lambda f: self.scheduler.release())
+            raise
+        except Exception as e:
+            self.scheduler.release()
+            game.thinking = False
+            await game.send({'type': 'error', 'game': game.id,
+                             'error': 'AIの思考に失敗しました: %s: %s' % (type(e).__name__, e)})
+            return
+        self.scheduler.release()
+        game.think_used += time.monotonic() - start
+        self.searches += 1
+        game.thinking = False
+        if game.status != 'playing' or self.games.get(game.id) is not game:
+            # 考えている間に終局した・対局がなくなった: 手は指さず、結果も送らない
+            return
+        if res['move'] is None:
+            game.finish(game.human, 'no_moves')
+        else:
+            try:
+                game.play(res['move'])
+            except GameError as e:
+                await game.send({'type': 'error', 'game': game.id,
+                                 'error': 'AIの手を指せませんでした: %s' % e})
+                return
+        info = {k: res[k] for k in ('score', 'depth', 'nodes', 'time')}
+        await game.send(dict(game.state(), type='ai_move', move=res['move'], info=info))
+
+    def _drop_game(self, game):
+        self.games.pop(game.id, None)
+        if game.task is not None and not game.task.done():
+            game.task.cancel()
+
+    def _game(self, req, owned):
+        game = self.games.get(req.get('game'))
+        if game is None or game.id not in owned:
+            raise GameError('対局がありません: %r' % (req.get('game'),))
+        return game
+
+    async def _handle_client(self, reader, writer):
+        """1つの接続（1行1つのJSONを読み、結果を返す）"""
+        lock = asyncio.Lock()
+        owned = set()
+
+        async def send(obj):
+            async with lock:
+                writer.write((json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # 1行が長すぎる
+                    await send({'type': 'error', 'error': 'メッセージが長すぎます'})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                req = {}
+                try:
+                    req = json.loads(line)
+                    op = req.get('op')
+                    if op == 'new':
+                        game = self.new_game(req, send)
+                        owned.add(game.id)
+                        reply = dict(game.state(), type='started')
+                    elif op == 'move':
+                        game = self._game(req, owned)
+                        self.human_move(game, parse_move(req.get('move')))
+                        reply = dict(game.state(), type='moved')
+                    elif op == 'state':
+                        reply = dict(self._game(req, owned).state(), type='state')
+                    elif op == 'resign':
+                        game = self._game(req, owned)
+                        if game.status == 'playing':
+                            game.finish(game.ai, 'resign')
+                        reply = dict(game.state(), type='state')
+                    elif op == 'stats':
+                        reply = dict(self.stats(), type='stats')
+                    else:
+                        raise GameError('不明な op です: %r' % (op,))
+                except GameError as e:
+                    reply = {'type': 'error', 'error': str(e)}
+                except (ValueError, TypeError, AttributeError) as e:
+                    reply = {'type': 'error', 'error': '要求が不正です: %s' % e}
+                if isinstance(req, dict) and 'id' in req:
+                    reply['id'] = req['id']  # 要求と応答の対応付けに使える
+                await send(reply)
+        except ConnectionError:
+            pass
+        finally:
+            # 接続が切れたら、その接続の対局はすべて終わらせる
+            for game_id in owned:
+                game = self.games.get(game_id)
+                if game is not None:
+                    self._drop_game(game)
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8766, workers=2, max_think=DEFAULT_MAX_THINK,
+                max_games=DEFAULT_MAX_GAMES):
+    """対局サーバーを起動する（Ctrl+Cで終了）"""
+    server = GameServer(workers, max_think, max_games)
+    host, port = await server.start(host, port)
+    print(f"対局サーバー起動: {host}:{port} (ワーカー{workers}個, 1手の思考は最大{max_think}秒)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 対局サーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count() - 1))
+    parser.add_argument('--max-think', type=float, default=DEFAULT_MAX_THINK, help='1手の思考時間の上限（秒）')
+    parser.add_argument('--max-games', type=int, default=DEFAULT_MAX_GAMES, help='同時に持てる対局数の上限')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_think, args.max_games))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
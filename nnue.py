@@ -0,0 +1,572 @@
+# ============================================================
+# 将棋AI NNUE評価関数
+# ============================================================
+# 小さなニューラルネットワークで局面を評価する（NNUE: 効率的に差分更新できるネットワーク）。
+# NumPy が必要（インストールされていなければ NNUEEvaluator は作れない）。
+#
+# 使い方:
+#   import nnue, shogi
+#   ev = nnue.NNUEEvaluator.from_file('eval.nnue')   # 学習済みの重み
+#   ev = nnue.NNUEEvaluator()                        # 駒の価値から作った初期の重み
+#   shogi.ai_choose_move(board, hands, turn, evaluator=ev)
+#
+#   python nnue.py bench                  # evaluate_board との速度比較（評価回数/秒）
+#   python nnue.py init -o eval.nnue      # 初期の重みをファイルに書き出す
+#
+# ネットワーク:
+#   入力: 玉の位置ごとの駒の配置（HalfKP）
+#         「自玉のマス × 駒の種類(味方/敵 × 9種) × マス」と「持ち駒の種類(7種) × 枚数」
+#         後手から見るときは盤を180度回転して、味方/敵を入れ替える
+#   第1層: 入力 → L1 個（+ 駒割り用の1個）。手番側・相手側の2つの視点で別々に足し合わせる
+#          （累積器。1手ごとに変わった入力の分だけ足し引きする）
+#   第2層: 2視点の L1 個をつないで clipped ReLU → L2 個 → clipped ReLU → 評価値
+#   評価値 = 第2層の出力 + 駒割り（手番側 - 相手側）/ 2
+#
+# 重みファイル（リトルエンディアン）:
+#   ヘッダ: b'SHNN', 版数, 入力数, L1, L2（それぞれ uint32）
+#   本体: W1 (入力数 × (L1+1)), b1 (L1+1), W2 (L2 × 2*L1), b2 (L2), w3 (L2), b3 (1) の float32
+
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # NumPy がなくても shogi 本体は使えるようにする
+    np = None
+
+import shogi
+from shogi import SENTE, GOTE, SIDE_OF
+
+MAGIC = b'SHNN'
+VERSION = 2  # 2: 盤上の駒に龍王・龍馬を追加
+HEADER = struct.Struct('<4sIIII')
+
+L1 = 64
+L2 = 16
+
+# 持ち駒になる駒の種類（7種類）
+PIECE_TYPES = 'RBGSNLP'
+# 盤上の駒の種類（成った歩・香・桂・銀は金になるので、龍王・龍馬を足した9種類）
+BOARD_TYPES = PIECE_TYPES + 'DH'
+# 持ち駒の枚数の上限（特徴量の数）
+HAND_MAX = {'R': 2, 'B': 2, 'G': 4, 'S': 4, 'N': 4, 'L': 4, 'P': 18}
+HAND_OFFSET = {}
+_n = 0
+for _t in PIECE_TYPES:
+    HAND_OFFSET[_t] = _n
+    _n += HAND_MAX[_t]
+HAND_FEATURES = _n  # 片方の持ち駒の特徴量の数（38）
+
+BOARD_FEATURES = 2 * len(BOARD_TYPES) * 81
+FEATURES_PER_KING = BOARD_FEATURES + 2 * HAND_FEATURES
+KING_BUCKETS = 82  # 81マス + 玉がいない局面（テスト用の盤面など）
+NUM_FEATURES = KING_BUCKETS * FEATURES_PER_KING
+
+# 視点ごとのマス番号（後手の視点では盤を180度回転）
+ORIENT = (list(range(81)), [80 - sq for sq in range(81)])
+
+
+def _piece_base(persp, p):
+    """駒 p の、視点 persp での特徴量の先頭（+ マス番号で特徴量になる）"""
+    t = BOARD_TYPES.index(p.upper())
+    if SIDE_OF[p] != persp:
+        t += len(BOARD_TYPES)
+    return t * 81
+
+
+# PIECE_BASE[視点][駒] と HAND_BASE[視点][持ち主][種類]
+# 理由: 差分更新のたびに計算しないよう、表にしておく
+PIECE_BASE = tuple({p: _piece_base(persp, p) for p in shogi.PIECE_VALUES if p not in 'kK'}
+                   for persp in (SENTE, GOTE))
+HAND_BASE = tuple(tuple({t: BOARD_FEATURES + (owner != persp) * HAND_FEATURES + HAND_OFFSET[t]
+                         for t in PIECE_TYPES} for owner in (SENTE, GOTE))
+                  for persp in (SENTE, GOTE))
+
+
+def _king_offset(pos, persp):
+    """視点 persp の玉の位置で決まる特徴量の先頭"""
+    k = pos.kings[persp]
+    return (ORIENT[persp][k] if k >= 0 else 81) * FEATURES_PER_KING
+
+
+def _hand_count(hand, t):
+    """持ち駒の枚数（表記の大文字・小文字をまとめて数える）"""
+    return hand.get(t, 0) + hand.get(t.lower(), 0)
+
+
+def active_features(pos, persp):
+    """
+    局面の、視点 persp での入力（値が1の特徴量）のリスト
+
+    実装の理由:
+        盤上の駒は（玉の位置, 駒, マス）で1つ、持ち駒は枚数の分だけ
+        （1枚目, 2枚目, ...）立てる。こうすると持ち駒が1枚増減したときも
+        特徴量1つの足し引きで済む。
+    """
+    kofs = _king_offset(pos, persp)
+    bases = PIECE_BASE[persp]
+    orient = ORIENT[persp]
+    feats = []
+    for sq, p in enumerate(pos.squares):
+        if p and p != 'k' and p != 'K':
+            feats.append(kofs + bases[p] + orient[sq])
+    for owner in (SENTE, GOTE):
+        hand = pos.hands[owner]
+        hbase = HAND_BASE[persp][owner]
+        for t in PIECE_TYPES:
+            n = min(_hand_count(hand, t), HAND_MAX[t])
+            base = kofs + hbase[t]
+            feats.extend(range(base, base + n))
+    return feats
+
+
+# ============================================================
+# 重み
+# ============================================================
+
+def _shapes(num_features, l1, l2):
+    return (('W1', (num_features, l1 + 1)), ('b1', (l1 + 1,)),
+            ('W2', (l2, 2 * l1)), ('b2', (l2,)), ('w3', (l2,)), ('b3', (1,)))
+
+
+def initial_weights(seed=0, l1=L1, l2=L2):
+    """
+    学習前の初期の重みを作る
+
+    Returns:
+        dict: 'W1', 'b1', 'W2', 'b2', 'w3', 'b3' の配列
+
+    実装の理由:
+        学習済みの重みがなくても指せるように、駒割りの列（W1 の最後の列）を
+        evaluate_board と同じ駒の価値・駒の働き（E1-E5, E7）で初期化する。
+        持ち駒にも駒の価値を付ける（evaluate_board は持ち駒を数えない）。
+        ネットワークの部分は小さな乱数で、評価値への影響は数点程度。
+        学習した重みは write_weights で書き出して from_file で読み込む。
+    """
+    _require_numpy()
+    rng = np.random.default_rng(seed)
+    w = {'W1': (rng.standard_normal((NUM_FEATURES, l1 + 1)) * 0.05).astype(np.float32)}
+    psqt = np.zeros((KING_BUCKETS, FEATURES_PER_KING), np.float32)
+    for t in BOARD_TYPES:
+        value = shogi.PIECE_VALUES[t]
+        for osq in range(81):
+            # 視点側から見たマス osq（先手と同じ向き）での駒の働き
+            rank, file = osq // 9 + 1, osq % 9 + 1
+            bonus = (10 - rank) * 2 + max(0, 3 - abs(file - 5)) * 5
+            psqt[:, BOARD_TYPES.index(t) * 81 + osq] = value + bonus
+            psqt[:, (BOARD_TYPES.index(t) + len(BOARD_TYPES)) * 81 + osq] = -(value + bonus)
+    for t in PIECE_TYPES:
+        value = shogi.PIECE_VALUES[t]
+        for k in range(HAND_MAX[t]):
+            psqt[:, BOARD_FEATURES + HAND_OFFSET[t] + k] = value
+            psqt[:, BOARD_FEATURES + HAND_FEATURES + HAND_OFFSET[t] + k] = -value
+    w['W1'][:, l1] = psqt.ravel()
+    w['b1'] = np.zeros(l1 + 1, np.float32)
+    w['W2'] = (rng.standard_normal((l2, 2 * l1)) * 0.1).astype(np.float32)
+    w['b2'] = np.zeros(l2, np.float32)
+    w['w3'] = (rng.standard_normal(l2) * 2.0).astype(np.float32)
+    w['b3'] = np.zeros(1, np.float32)
+    return w
+
+
+def write_weights(path, weights):
+    """重みをファイルに書き出す"""
+    l1 = weights['W1'].shape[1] - 1
+    l2 = weights['W2'].shape[0]
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, weights['W1'].shape[0], l1, l2))
+        for name, shape in _shapes(weights['W1'].shape[0], l1, l2):
+            a = np.ascontiguousarray(weights[name], dtype='<f4')
+            if a.shape != shape:
+                raise ValueError('重み %s の形が %s ではありません: %s' % (name, shape, a.shape))
+            f.write(a.tobytes())
+
+
+def load_weights(path):
+    """
+    重みファイルを mmap で開く
+
+    Returns:
+        dict: 重みの配列（ファイルの中身をそのまま指す読み取り専用の配列）
+
+    実装の理由:
+        第1層の重みは数十MBあるが、1局で実際に使うのは自玉の位置に
+        対応する一部の行だけ。mmap ならファイル全体を読み込まずに済み、
+        使った部分だけがOSに読み込まれる（複数のプロセスでも共有される）。
+    """
+    _require_numpy()
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, num_features, l1, l2 = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('NNUEの重みファイルではありません: %s' % path)
+    if num_features != NUM_FEATURES:
+        raise ValueError('入力の数が合いません: %d（期待値 %d）' % (num_features, NUM_FEATURES))
+    weights = {}
+    offset = HEADER.size
+    for name, shape in _shapes(num_features, l1, l2):
+        count = 1
+        for n in shape:
+            count *= n
+        weights[name] = np.frombuffer(mm, dtype='<f4', count=count, offset=offset).reshape(shape)
+        offset += count * 4
+    if offset != len(mm):
+        raise ValueError('重みファイルの大きさが合いません: %s' % path)
+    return weights
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('NNUE評価関数には NumPy が必要です（pip install numpy）')
+
+
+# ============================================================
+# 評価関数
+# ============================================================
+
+_SIGN_MATRICES = {}
+
+
+def _sign_matrix(n_added, n_removed, hand_sign):
+    """
+    差分更新で、取り出した重みの行に掛ける符号の行列 [視点][行]
+
+    実装の理由:
+        push では両視点の特徴量を「先手の視点の分、後手の視点の分」の順に
+        同じ並び（足す駒・引く駒・持ち駒）で並べるので、符号の行列は
+        足す数・引く数・持ち駒の増減だけで決まる。毎回作らずに使い回す。
+    """
+    key = (n_added, n_removed, hand_sign)
+    m = _SIGN_MATRICES.get(key)
+    if m is None:
+        row = [1.0] * n_added + [-1.0] * n_removed + ([hand_sign] if hand_sign else [])
+        zeros = [0.0] * len(row)
+        m = _SIGN_MATRICES[key] = np.array([row + zeros, zeros + row], np.float32)
+    return m
+
+
+class NNUEEvaluator(shogi.Evaluator):
+    """
+    NNUE評価関数（shogi.Evaluator）
+
+    Args:
+        weights: 重み（load_weights / initial_weights の戻り値。Noneなら初期の重み）
+
+    実装の理由:
+        第1層の出力（累積器）を局面ごとに計算し直すと、盤上の駒40枚分の
+        重みの行を毎回足すことになる。探索で1手進めると変わる入力は
+        数個だけなので、親局面の累積器にその分だけ足し引きする。
+        探索の1手ごとに push で「変わった入力」だけを記録しておき、
+        評価値が必要になったときに初めて累積器を計算する（遅延評価）。
+        末端の評価では親の累積器を1回計算すれば兄弟の局面で使い回せる。
+        自玉が動いたときは、その視点の入力がすべて変わるので計算し直す。
+    """
+    name = 'nnue'
+    incremental = True
+
+    def __init__(self, weights=None):
+        _require_numpy()
+        if weights is None:
+            weights = initial_weights()
+        self.W1 = weights['W1']
+        self.b1 = np.asarray(weights['b1'], np.float32)
+        self.W2 = np.asarray(weights['W2'], np.float32)
+        self.b2 = np.asarray(weights['b2'], np.float32)
+        self.w3 = np.asarray(weights['w3'], np.float32)
+        self.b3 = float(weights['b3'][0])
+        self.l1 = self.W1.shape[1] - 1
+        # 出力の計算に使う作業用の配列
+        self._x = np.zeros((2, self.l1), np.float32)
+        self._x_flat = self._x.reshape(-1)
+        self._h = np.zeros(self.W2.shape[0], np.float32)
+        # ルートからの手数ごとの累積器 [手数][視点][L1+1] と、その手で変わった入力
+        self.accs = np.zeros((32, 2, self.l1 + 1), np.float32)
+        self.diffs = [None] * 32
+        self.valid = [False] * 32
+        self.root_ply = 0
+
+    @classmethod
+    def from_file(cls, path):
+        """重みファイルから作る"""
+        return cls(load_weights(path))
+
+    # ------------------------------------------------------------
+    # 累積器
+    # ------------------------------------------------------------
+
+    def refresh(self, pos, persp):
+        """視点 persp の累積器を最初から計算する"""
+        return self.b1 + self.W1[active_features(pos, persp)].sum(axis=0)
+
+    def reset(self, pos):
+        """ルート局面の累積器を計算する"""
+        self.root_ply = pos.ply
+        self.accs[0, SENTE] = self.refresh(pos, SENTE)
+        self.accs[0, GOTE] = self.refresh(pos, GOTE)
+        self.valid[0] = True
+
+    def _grow(self, i):
+        """手数 i の分まで累積器の配列を伸ばす"""
+        n = len(self.diffs)
+        while n <= i:
+            n *= 2
+        accs = np.zeros((n, 2, self.l1 + 1), np.float32)
+        accs[:len(self.diffs)] = self.accs
+        self.accs = accs
+        self.diffs.extend([None] * (n - len(self.diffs)))
+        self.valid.extend([False] * (n - len(self.valid)))
+
+    def push(self, pos, code, undo):
+        """
+        1手進めた局面の、視点ごとの入力の変化を記録する
+
+        実装の理由:
+            ここでは特徴量の番号と符号（足すなら+1、引くなら-1）を並べるだけで、
+            重みの足し引きはしない。両方の視点の変化を1つの表にまとめておき、
+            評価するときに「重みの行を取り出す」「符号の行列を掛ける」の
+            2回の NumPy の演算で両視点を一度に更新する。
+            自玉が動いた視点は、その局面の全特徴量を記録しておく
+            （評価するときには局面がさらに先へ進んでいるため）。
+        """
+        i = pos.ply - self.root_ply
+        if i >= len(self.diffs):
+            self._grow(i)
+        mover = pos.side ^ 1
+        to = code & shogi.MOVE_TO_MASK
+        p, captured = undo[0], undo[1]
+        if code & shogi.MOVE_DROP_MASK:
+            t = p.upper()
+            added = ((pos.squares[to], to),)
+            removed = ()
+            hand = (mover, t, _hand_count(pos.hands[mover], t) + 1, -1.0)
+        else:
+            frm = (code >> shogi.MOVE_FROM_SHIFT) & shogi.MOVE_TO_MASK
+            added = ((pos.squares[to], to),)
+            if captured:
+                t = shogi.demote(captured).upper()  # 龍王・龍馬は飛車・角として持ち駒になる
+                removed = ((p, frm), (captured, to))
+                hand = (mover, t, _hand_count(pos.hands[mover], t), 1.0)
+            else:
+                removed = ((p, frm),)
+                hand = None
+            if p == 'k' or p == 'K' or captured == 'k' or captured == 'K':
+                self.diffs[i] = self._king_diff(pos, p, captured, added, removed, hand)
+                self.valid[i] = False
+                return
+        if hand is not None and hand[2] > HAND_MAX[hand[1]]:
+            hand = None  # 上限を超えた枚数の持ち駒は特徴量にしない
+        idx = []
+        for persp in (SENTE, GOTE):
+            kofs = _king_offset(pos, persp)
+            bases = PIECE_BASE[persp]
+            orient = ORIENT[persp]
+            for q, sq in added:
+                idx.append(kofs + bases[q] + orient[sq])
+            for q, sq in removed:
+                idx.append(kofs + bases[q] + orient[sq])
+            if hand is not None:
+                idx.append(kofs + HAND_BASE[persp][hand[0]][hand[1]] + hand[2] - 1)
+        self.diffs[i] = (idx, _sign_matrix(len(added), len(removed), hand[3] if hand else 0.0))
+        self.valid[i] = False
+
+    def _king_diff(self, pos, p, captured, added, removed, hand):
+        """
+        玉が動いた手の変化（動いた側の視点は全特徴量、もう一方は差分）
+
+        Returns:
+            tuple: (None, [視点ごとに (全特徴量, None) または (足す特徴量, 引く特徴量)])
+        """
+        per = []
+        for persp in (SENTE, GOTE):
+            if p == ('k', 'K')[persp] or captured in ('k', 'K'):
+                per.append((active_features(pos, persp), None))
+                continue
+            kofs = _king_offset(pos, persp)
+            bases = PIECE_BASE[persp]
+            orient = ORIENT[persp]
+            plus = [kofs + bases[q] + orient[sq] for q, sq in added if q not in ('k', 'K')]
+            minus = [kofs + bases[q] + orient[sq] for q, sq in removed if q not in ('k', 'K')]
+            if hand is not None:
+                owner, t, n, sign = hand
+                if n <= HAND_MAX[t]:
+                    (plus if sign > 0 else minus).append(kofs + HAND_BASE[persp][owner][t] + n - 1)
+            per.append((plus, minus))
+        return None, per
+
+    def _accumulator(self, i):
+        """i 番目（ルートからの手数）の累積器。計算していなければ親から差分で求める"""
+        valid = self.valid
+        j = i
+        while not valid[j]:
+            j -= 1
+        W1 = self.W1
+        accs = self.accs
+        for k in range(j + 1, i + 1):
+            idx, signs = self.diffs[k]
+            if idx is not None:
+                np.add(accs[k - 1], signs @ W1[idx], out=accs[k])
+            else:
+                for persp, (plus, minus) in enumerate(signs):
+                    if minus is None:
+                        accs[k, persp] = self.b1 + W1[plus].sum(axis=0)
+                    else:
+                        acc = accs[k - 1, persp] + W1[plus].sum(axis=0)
+                        accs[k, persp] = acc - W1[minus].sum(axis=0)
+            valid[k] = True
+        return accs[i]
+
+    # ------------------------------------------------------------
+    # 評価
+    # ------------------------------------------------------------
+
+    def _output(self, acc, side):
+        """
+        累積器 acc（[視点][L1+1]）から side 側の評価値を計算する
+        """
+        l1 = self.l1
+        x, h = self._x, self._h
+        # 手番側の視点を先にして並べる（後手なら視点の順を逆にする）
+        # clipped ReLU: np.clip より maximum/minimum の方が呼び出しが軽い
+        np.maximum(acc[::-1, :l1] if side else acc[:, :l1], 0.0, out=x)
+        np.minimum(x, 1.0, out=x)
+        np.dot(self.W2, self._x_flat, out=h)
+        h += self.b2
+        np.maximum(h, 0.0, out=h)
+        np.minimum(h, 1.0, out=h)
+        psqt = acc[:, l1].tolist()
+        value = float(np.dot(self.w3, h)) + self.b3 + (psqt[side] - psqt[side ^ 1]) * 0.5
+        return int(round(value))
+
+    def evaluate(self, pos, side):
+        """
+        探索中の局面を side から見た評価値（reset/push で作った累積器を使う）
+        """
+        i = pos.ply - self.root_ply
+        if not 0 <= i < len(self.valid):
+            return self.evaluate_full(pos, side)
+        return self._output(self._accumulator(i), side)
+
+    def evaluate_full(self, pos, side):
+        """累積器を使わずに、局面から直接評価値を計算する（差分更新の確認用）"""
+        return self._output(np.stack([self.refresh(pos, SENTE), self.refresh(pos, GOTE)]), side)
+
+
+# ============================================================
+# 速度の比較
+# ============================================================
+
+def sample_positions(count, seed=0, max_moves=80):
+    """ランダムに指し進めた局面（と、そこから指せる合法手）を集める"""
+    rng = random.Random(seed)
+    positions = []
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    while len(positions) < count:
+        pos = shogi.Position.from_board(shogi.create_initial_board(), shogi.create_empty_hands(), 'sente')
+        for _ in range(rng.randrange(10, max_moves)):
+            n = shogi.generate_legal_moves(pos, buf)
+            if not n:
+                break
+            pos.do_move(buf[rng.randrange(n)])
+        n = shogi.generate_legal_moves(pos, buf)
+        if n:
+            positions.append((pos, list(buf[:n])))
+    return positions
+
+
+def benchmark(evaluator=None, count=200, seed=0, depth=3):
+    """
+    evaluate_board と NNUE の1秒あたりの評価回数を比べる
+
+    Returns:
+        dict: 'handcrafted'（従来）, 'nnue_full'（毎回計算し直す）,
+              'nnue_incremental'（親局面から1手分の差分更新）の評価回数/秒と、
+              同じ局面を深さ depth で探索したときの1秒あたりのノード数
+
+    実装の理由:
+        探索で評価関数を呼ぶのは末端の局面なので、「親の累積器があり、
+        1手進めて評価する」場合の速さが実際の探索に近い。
+    """
+    evaluator = evaluator or NNUEEvaluator()
+    positions = sample_positions(count, seed)
+    result = {}
+
+    def rate(fn):
+        calls = 0
+        start = time.perf_counter()
+        for pos, moves in positions:
+            calls += fn(pos, moves)
+        return calls / (time.perf_counter() - start)
+
+    def handcrafted(pos, moves):
+        for code in moves:
+            undo = pos.do_move(code)
+            shogi._evaluate_position(pos, pos.side)
+            pos.undo_move(code, undo)
+        return len(moves)
+
+    def full(pos, moves):
+        for code in moves:
+            undo = pos.do_move(code)
+            evaluator.evaluate_full(pos, pos.side)
+            pos.undo_move(code, undo)
+        return len(moves)
+
+    def incremental(pos, moves):
+        evaluator.reset(pos)
+        for code in moves:
+            undo = pos.do_move(code)
+            evaluator.push(pos, code, undo)
+            evaluator.evaluate(pos, pos.side)
+            pos.undo_move(code, undo)
+        return len(moves)
+
+    result['handcrafted'] = rate(handcrafted)
+    result['nnue_full'] = rate(full)
+    result['nnue_incremental'] = rate(incremental)
+    for name, ev in (('handcrafted_nps', None), ('nnue_nps', evaluator)):
+        nodes = 0
+        start = time.perf_counter()
+        for pos, _ in positions[:max(1, count // 10)]:
+            nodes += shogi.search(pos, depth=depth, evaluator=ev)['nodes']
+        result[name] = nodes / (time.perf_counter() - start)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI NNUE評価関数')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench = sub.add_parser('bench', help='evaluate_board との速度比較')
+    bench.add_argument('--weights', help='重みファイル（省略時は初期の重み）')
+    bench.add_argument('--positions', type=int, default=200)
+    bench.add_argument('--depth', type=int, default=3)
+    init = sub.add_parser('init', help='初期の重みをファイルに書き出す')
+    init.add_argument('-o', '--output', required=True)
+    init.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print('NumPy がインストールされていません（pip install numpy）', file=sys.stderr)
+        return 1
+    if args.command == 'init':
+        write_weights(args.output, initial_weights(args.seed))
+        print('書き出しました: %s' % args.output)
+        return 0
+    ev = NNUEEvaluator.from_file(args.weights) if args.weights else NNUEEvaluator()
+    res = benchmark(ev, args.positions, depth=args.depth)
+    print('評価回数/秒:')
+    print('  evaluate_board        %10.0f' % res['handcrafted'])
+    print('  NNUE（毎回計算）      %10.0f' % res['nnue_full'])
+    print('  NNUE（差分更新）      %10.0f  (evaluate_board の %.2f倍)'
+          % (res['nnue_incremental'], res['nnue_incremental'] / res['handcrafted']))
+    print('探索ノード数/秒（深さ%d）:' % args.depth)
+    print('  evaluate_board        %10.0f' % res['handcrafted_nps'])
+    print('  NNUE                  %10.0f' % res['nnue_nps'])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
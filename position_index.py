@@ -0,0 +1,348 @@
+# ============================================================
+# 将棋AI 局面データベース（棋譜の局面索引）
+# ============================================================
+# たくさんの棋譜を再生し、「この局面は何回現れ、どの手が指され、
+# その結果はどうだったか」を SQLite の索引に集計する。
+# 索引は局面ハッシュ（主キー）で引くので、問い合わせは数ミリ秒で終わる。
+#
+# 使い方:
+#   python position_index.py build games.jsonl -o games.db --workers 4
+#   cat more_games.jsonl | python position_index.py build - -o games.db   # 既存の索引に足し込む
+#   python position_index.py query games.db "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+#
+# 入力: 1行1局のJSON
+#   {"id": ..., "sfen": 開始局面（省略時は初期局面）, "moves": [指し手, ...], "winner": "sente" / "gote" / null}
+#   指し手は game_server と同じく ["move", [7, 7], [6, 7]] / ["drop", "P", [5, 5]]
+#   または "move 7 7 6 7" の文字列。winner が null（または省略）なら引き分け。
+#
+# 索引: moves(hash, move, games, wins, draws, losses)
+#   hash は局面ハッシュ、move は encode_move の整数。勝ち・負けはその局面の手番側から見た結果。
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+from collections import deque
+
+import shogi
+
+CHUNK_GAMES = 200   # ワーカーに1回で渡す棋譜の数
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS moves (
+    hash INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    PRIMARY KEY (hash, move)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+'''
+
+UPSERT = '''
+INSERT INTO moves (hash, move, games, wins, draws, losses) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (hash, move) DO UPDATE SET
+    games = games + excluded.games, wins = wins + excluded.wins,
+    draws = draws + excluded.draws, losses = losses + excluded.losses
+'''
+
+# ============================================================
+# 棋譜の再生
+# ============================================================
+
+def position_key(board, hands, turn):
+    """
+    索引のキーにする局面ハッシュ（SQLite の符号付き64bit整数）
+
+    実装の理由:
+        取った駒は大文字・小文字をそのまま持ち駒に残すが、SFEN から読んだ局面の
+        持ち駒はすべて大文字になる。同じ局面が同じキーになるよう、
+        持ち駒を大文字にそろえてから position_hash を計算する。
+    """
+    h = shogi.position_hash(board, {s: [p.upper() for p in hands[s]] for s in hands}, turn)
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+def move_key(move):
+    """指し手を索引の整数にする（打つ駒は持ち駒の表記によらず大文字にそろえる）"""
+    if move[0] == 'drop':
+        move = ('drop', move[1].upper(), move[2])
+    return shogi.encode_move(move)
+
+def parse_move(obj):
+    """
+    棋譜の指し手を ('move', 元, 先) / ('drop', 駒, 位置) にする
+
+    Raises:
+        ValueError: 指し手の形式が不正な場合
+    """
+    try:
+        if isinstance(obj, str):
+            move = shogi.parse_input(obj)
+        elif obj[0] == 'move':
+            move = ('move', tuple(obj[1]), tuple(obj[2]))
+        else:
+            move = (obj[0], obj[1], tuple(obj[2]))
+    except (IndexError, TypeError, ValueError, KeyError):
+        move = None
+    if move is None or move[0] not in ('move', 'drop'):
+        raise ValueError('指し手の形式が不正です: %r' % (obj,))
+    return move
+
+def replay_game(game):
+    """
+    1局を再生し、指した局面ごとに (局面キー, 指し手キー, 結果) を返す
+
+    Args:
+        game: 入力の1行を読んだ辞書
+
+    Returns:
+        list: [(局面キー, 指し手キー, 結果), ...]。結果は手番側から見て 1 / 0 / -1
+
+    Raises:
+        ValueError: 棋譜が読めない、または再生できない手がある場合
+
+    実装の理由:
+        make_move / drop_piece で1手ずつ進める。移動元に自分の駒がない手や、
+        持っていない駒を打つ手があれば、その棋譜は途中まででも使わない
+        （壊れた棋譜の局面を索引に混ぜない）。
+    """
+    board, hands, turn, _ = shogi.sfen_to_board(game.get('sfen') or 'startpos')
+    winner = game.get('winner')
+    if winner not in ('sente', 'gote', None):
+        raise ValueError('winner が不正です: %r' % (winner,))
+    entries = []
+    for obj in game['moves']:
+        move = parse_move(obj)
+        result = 0 if winner is None else (1 if winner == turn else -1)
+        entries.append((position_key(board, hands, turn), move_key(move), result))
+        if move[0] == 'move':
+            p = board.get(move[1])
+            if p is None or (turn == 'sente') != shogi.is_sente(p):
+                raise ValueError('%s の手番で動かせない駒です: %r' % (turn, obj))
+            board, hands = shogi.make_move(board, move[1], move[2], hands, turn=turn)
+        else:
+            # 持ち駒の表記（大文字・小文字）は棋譜と違ってもよい
+            piece = next((p for p in hands[turn] if p.upper() == move[1].upper()), move[1])
+            board, hands = shogi.drop_piece(board, hands, piece, move[2], turn)
+            if board is None:
+                raise ValueError('%s の手番で打てない駒です: %r' % (turn, obj))
+        turn = 'gote' if turn == 'sente' else 'sente'
+    return entries
+
+def index_games(lines):
+    """
+    棋譜の行をまとめて再生し、(局面, 指し手) ごとに集計する（ワーカープロセスで動く）
+
+    Args:
+        lines: 入力の行のリスト
+
+    Returns:
+        tuple: ({(局面キー, 指し手キー): [局数, 勝ち, 引き分け, 負け]}, 再生した局数, 読めなかった局数)
+
+    実装の理由:
+        同じ開始局面の棋譜が多いので、ワーカーの中で先に足し合わせてから
+        書き込むと、書き込む行数が大きく減る。
+    """
+    stats = {}
+    games = errors = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries = replay_game(json.loads(line))
+        except (ValueError, KeyError, TypeError):
+            errors += 1
+            continue
+        games += 1
+        for key, move, result in entries:
+            s = stats.get((key, move))
+            if s is None:
+                s = stats[(key, move)] = [0, 0, 0, 0]
+            s[0] += 1
+            s[2 - result] += 1  # 1 → 勝ち, 0 → 引き分け, -1 → 負け
+    return stats, games, errors
+
+# ============================================================
+# 索引の作成
+# ============================================================
+
+def _chunks(stream, size):
+    """入力を size 行ずつのリストにして順に返す（全体をメモリに読み込まない）"""
+    chunk = []
+    for line in stream:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _open(path):
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+    return con
+
+def build(stream, path, workers=2, chunk=CHUNK_GAMES, window=None, on_progress=None):
+    """
+    棋譜を読んで索引に足し込む（索引がなければ作る）
+
+    Args:
+        stream: 入力（行のイテレータ）
+        path: 索引のファイル
+        workers: ワーカープロセスの数
+        chunk: ワーカーに1回で渡す棋譜の数
+        window: 同時に処理中にしておくまとまりの数の上限（既定はワーカー数の2倍）
+        on_progress: まとまりを1つ書き込むごとに (再生した局数, 読めなかった局数) を受け取る関数
+
+    Returns:
+        dict: {'games', 'errors', 'rows', 'time'}（今回足し込んだ分。rows は書き込んだ行数）
+
+    実装の理由:
+        棋譜の再生はワーカーで並列に行い、書き込みは親プロセスだけが行う
+        （SQLite は書き込みを1つずつしか受け付けない）。処理中のまとまりを
+        window 個までに抑えて投入するので、入力がどれだけ大きくてもメモリ使用量は一定。
+        集計の足し算は順番によらないので、終わったまとまりから書き込む。
+        書き込みはまとまりごとに1つのトランザクションで executemany する。
+    """
+    window = window or workers * 2
+    start = time.monotonic()
+    total = {'games': 0, 'errors': 0, 'rows': 0}
+    con = _open(path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    try:
+        with mp.Pool(workers) as pool:
+            inflight = deque()
+
+            def flush_one():
+                stats, games, errors = inflight.popleft().get()
+                with con:
+                    con.executemany(UPSERT, ((k, m, *s) for (k, m), s in stats.items()))
+                    for key, n in (('games', games), ('errors', errors)):
+                        con.execute('INSERT INTO meta VALUES (?, ?) ON CONFLICT (key) DO UPDATE '
+                                    'SET value = value + excluded.value', (key, n))
+                total['games'] += games
+                total['errors'] += errors
+                total['rows'] += len(stats)
+                if on_progress is not None:
+                    on_progress(total['games'], total['errors'])
+
+            for lines in _chunks(stream, chunk):
+                inflight.append(pool.apply_async(index_games, (lines,)))
+                while len(inflight) > window or (inflight and inflight[0].ready()):
+                    flush_one()
+            while inflight:
+                flush_one()
+    finally:
+        con.close()
+    total['time'] = time.monotonic() - start
+    return total
+
+# ============================================================
+# 問い合わせ
+# ============================================================
+
+class PositionIndex:
+    """
+    索引から局面の統計を引く
+
+    Args:
+        path: build で作った索引のファイル
+
+    実装の理由:
+        接続を開いたまま使い回すので、1回の問い合わせは主キーの範囲検索1回で済む。
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError('索引がありません: %s' % path)
+        uri = pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+        self.con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def games(self):
+        """索引に入っている局数"""
+        row = self.con.execute("SELECT value FROM meta WHERE key = 'games'").fetchone()
+        return row[0] if row else 0
+
+    def lookup(self, board, hands=None, turn=None):
+        """
+        局面で指された手とその結果を返す
+
+        Args:
+            board: 盤面（または SFEN 文字列。その場合 hands・turn は使わない）
+            hands: 持ち駒
+            turn: 'sente' または 'gote'
+
+        Returns:
+            dict: {'games': この局面が現れた回数,
+                   'moves': [{'move', 'games', 'wins', 'draws', 'losses'}, ...]（多く指された順）}
+            勝ち・負けは turn 側から見た結果。打つ駒は大文字で返す。
+        """
+        if isinstance(board, str):
+            board, hands, turn, _ = shogi.sfen_to_board(board)
+        rows = self.con.execute(
+            'SELECT move, games, wins, draws, losses FROM moves WHERE hash = ? ORDER BY games DESC, move',
+            (position_key(board, hands, turn),)).fetchall()
+        moves = [{'move': shogi.decode_move(m), 'games': g, 'wins': w, 'draws': d, 'losses': l}
+                 for m, g, w, d, l in rows]
+        return {'games': sum(m['games'] for m in moves), 'moves': moves}
+
+# ============================================================
+# 実行
+# ============================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 局面データベース')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('build', help='棋譜を索引に足し込む')
+    p.add_argument('input', help="棋譜のJSONLファイル（'-' で標準入力）")
+    p.add_argument('-o', '--output', required=True, help='索引のファイル')
+    p.add_argument('--workers', type=int, default=max(1, mp.cpu_count()))
+    p = sub.add_parser('query', help='局面の統計を表示する')
+    p.add_argument('index', help='索引のファイル')
+    p.add_argument('sfen', help="局面（SFEN または 'startpos'）")
+    args = parser.parse_args(argv)
+
+    if args.command == 'query':
+        with PositionIndex(args.index) as index:
+            start = time.perf_counter()
+            res = index.lookup(args.sfen)
+            elapsed = time.perf_counter() - start
+        print(f"{res['games']}回（{elapsed * 1000:.2f}ミリ秒）")
+        for m in res['moves']:
+            print(f"{json.dumps(m['move'])}\t{m['games']}局\t"
+                  f"勝{m['wins']} 分{m['draws']} 負{m['losses']}")
+        return
+
+    stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    last = [time.monotonic()]
+
+    def on_progress(games, errors):
+        now = time.monotonic()
+        if now - last[0] >= 10:
+            last[0] = now
+            print(f"{games}局（読めなかった棋譜 {errors}局）", file=sys.stderr)
+
+    res = build(stream, args.output, args.workers, on_progress=on_progress)
+    print(f"{res['games']}局を索引に足し込みました（読めなかった棋譜 {res['errors']}局、"
+          f"{res['time']:.1f}秒, {res['games'] / max(res['time'], 1e-9):.0f}局/秒）", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# ============================================================
+# 将棋AI プロファイル計測
+# ============================================================
+# 探索のどこに時間がかかっているかを調べるためのプロファイラ。
+#
+# 使い方:
+#   python shogi.py --profile                 # 対局中のAIの思考を計測
+#   python profiling.py --depth 4             # 初期局面の探索を計測
+#   python profiling.py --sfen "<SFEN>" --mode cprofile -o prof/search
+#
+# 出力:
+#   <出力先>.txt        関数ごとの時間の割合（多い順）と呼び出し回数カウンタ
+#   <出力先>.collapsed  flamegraph.pl / speedscope などで読める折りたたみスタック
+#                       （1行に「関数;関数;関数 サンプル数」）
+#
+# モード:
+#   sample   一定間隔で実行中のスタックを記録する（オーバーヘッドが小さい）
+#   cprofile 標準の cProfile ですべての関数呼び出しを計測する（正確だが遅くなる）
+#            cProfile は呼び出し経路を持たないので、.collapsed はサンプリングで作る
+
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.001  # サンプリング間隔（秒）
+REPORT_LIMIT = 30         # レポートに載せる関数の数
+
+
+def _frame_label(code):
+    """スタックの1段を表す文字列（関数名 (ファイル名:行)）"""
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class SamplingProfiler:
+    """
+    別スレッドから一定間隔で、計測対象のスレッドのスタックを記録する
+
+    Args:
+        interval: サンプリング間隔（秒）
+
+    実装の理由:
+        cProfile はすべての関数呼び出しに処理を挟むため、探索が数倍遅くなり
+        小さな関数ほど重く見えてしまう。スタックを一定間隔で覗くだけなら
+        探索そのものには手を加えないので、実際に近い時間配分が分かる。
+        Pythonのスレッドは GIL の受け渡し間隔ごとにしか切り替わらないので、
+        計測中だけその間隔をサンプリング間隔まで短くする。
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()  # (根元の関数, ..., 実行中の関数) -> サンプル数
+        self.elapsed = 0.0
+        self._thread = None
+        self._running = False
+        self._target = None
+        self._switch = None
+        self._start = None
+
+    def start(self):
+        """呼び出したスレッドの計測を始める（stop まで。何度でも再開できる）"""
+        self._target = threading.get_ident()
+        self._running = True
+        self._switch = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch, self.interval))
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """計測を止める"""
+        self._running = False
+        self._thread.join()
+        sys.setswitchinterval(self._switch)
+        self.elapsed += time.monotonic() - self._start
+
+    def _sample_loop(self):
+        while self._running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+
+    def total(self):
+        """記録したサンプル数"""
+        return sum(self.stacks.values())
+
+    def function_times(self):
+        """
+        関数ごとのサンプル数を集計する
+
+        Returns:
+            tuple: (自身で実行していたサンプル数, 呼び出し先も含めたサンプル数) の Counter
+        """
+        own = Counter()
+        cumulative = Counter()
+        for stack, n in self.stacks.items():
+            own[stack[-1]] += n
+            for label in set(stack):  # 再帰している関数を二重に数えない
+                cumulative[label] += n
+        return own, cumulative
+
+    def write_collapsed(self, f):
+        """折りたたみスタック形式（flamegraph用）で書き出す"""
+        for stack, n in sorted(self.stacks.items()):
+            f.write('%s %d\n' % (';'.join(stack), n))
+
+    def write_report(self, f, limit=REPORT_LIMIT):
+        """自身の時間・呼び出し先を含む時間の多い順に関数を書き出す"""
+        total = self.total()
+        f.write('サンプリング: 間隔 %.1fms, %dサンプル, 計測時間 %.2f秒\n\n'
+                % (self.interval * 1000, total, self.elapsed))
+        if not total:
+            return
+        own, cumulative = self.function_times()
+        for title, counter in (('自身の時間が長い関数', own), ('呼び出し先を含む時間が長い関数', cumulative)):
+            f.write('%s:\n' % title)
+            f.write('  %6s %8s  %s\n' % ('割合', 'サンプル', '関数'))
+            for label, n in counter.most_common(limit):
+                f.write('  %5.1f%% %8d  %s\n' % (100.0 * n / total, n, label))
+            f.write('\n')
+
+
+class Profiler:
+    """
+    探索を計測し、レポートと折りたたみスタックのファイルを書き出す
+
+    Args:
+        mode: 'sample'（サンプリング）または 'cprofile'
+        interval: サンプリング間隔（秒）
+
+    使い方:
+        profiler = Profiler('sample')
+        with profiler:
+            shogi.search(board, hands, turn, depth=4)
+        profiler.write('profile', shogi.CALL_COUNTS)
+
+    実装の理由:
+        対局では人間の入力待ちの間は計測したくないので、start/stop で
+        AIが考えている区間だけを何度でも足し合わせられるようにする。
+    """
+
+    def __init__(self, mode='sample', interval=DEFAULT_INTERVAL):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError('unknown profile mode: %r' % mode)
+        self.mode = mode
+        self.sampler = SamplingProfiler(interval)
+        self.cprofile = cProfile.Profile() if mode == 'cprofile' else None
+
+    def start(self):
+        self.sampler.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.sampler.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def report(self, counters=None):
+        """
+        レポートの文字列を作る
+
+        Args:
+            counters: 一緒に載せる呼び出し回数カウンタ（shogi.CALL_COUNTS など）
+        """
+        f = io.StringIO()
+        f.write('# 将棋AI プロファイル結果（モード: %s）\n\n' % self.mode)
+        if self.cprofile is not None:
+            try:
+                stats = pstats.Stats(self.cprofile, stream=f).strip_dirs()
+            except TypeError:  # 一度も計測していない
+                stats = None
+            for key in ('tottime', 'cumulative') if stats is not None else ():
+                f.write('cProfile（%s の順）:\n' % key)
+                stats.sort_stats(key).print_stats(REPORT_LIMIT)
+        self.sampler.write_report(f)
+        if counters:
+            f.write('呼び出し回数カウンタ:\n')
+            for name, n in sorted(counters.items(), key=lambda kv: -kv[1]):
+                f.write('  %-22s %12d\n' % (name, n))
+        return f.getvalue()
+
+    def write(self, prefix, counters=None):
+        """
+        <prefix>.txt にレポート、<prefix>.collapsed に折りたたみスタックを書く
+
+        Returns:
+            tuple: 書き出した2つのファイルのパス
+        """
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        report_path = prefix + '.txt'
+        collapsed_path = prefix + '.collapsed'
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(self.report(counters))
+        with open(collapsed_path, 'w', encoding='utf-8') as f:
+            self.sampler.write_collapsed(f)
+        return report_path, collapsed_path
+
+
+def main(argv=None):
+    import shogi
+
+    parser = argparse.ArgumentParser(description='将棋AI 探索のプロファイル計測')
+    parser.add_argument('--sfen', default=shogi.STARTPOS_SFEN, help='計測する局面（省略時は初期局面）')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=1, help='同じ探索をくり返す回数')
+    parser.add_argument('--mode', choices=('sample', 'cprofile'), default='sample')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='サンプリング間隔（秒）')
+    parser.add_argument('-o', '--output', default='profile', help='出力ファイル名（拡張子なし）')
+    args = parser.parse_args(argv)
+
+    board, hands, turn, _ = shogi.sfen_to_board(args.sfen)
+    shogi.reset_call_counts()
+    profiler = Profiler(args.mode, args.interval)
+    with profiler:
+        for _ in range(args.repeat):
+            res = shogi.search(board, hands, turn, depth=args.depth)
+    paths = profiler.write(args.output, shogi.CALL_COUNTS)
+    print('最善手: %s 評価値: %s ノード数: %d' % (res['move'], res['score'], res['nodes']))
+    print('レポート: %s\nflamegraph用: %s' % paths)
+
+
+if __name__ == "__main__":
+    main()
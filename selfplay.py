@@ -0,0 +1,347 @@
+# ============================================================
+# 将棋AI 自己対局による学習データの生成
+# ============================================================
+# 評価関数の重みを調整するための (局面, 探索の評価値, 対局結果) の組を、
+# 複数のワーカープロセスで自己対局して大量に作る。
+#
+# 使い方:
+#   python selfplay.py data/ --workers 4 --nodes 2000 --positions 1000000
+#   python selfplay.py data/ --games 100 --seed 1      # 同じ seed なら同じ対局になる
+#   （--positions も --games も指定しなければ Ctrl+C まで続ける。再実行すると続きの番号から書く）
+#
+# 対局: 初期局面から --opening の範囲でランダムな手数をランダムに指し（序盤のばらつき）、
+#       その後は両者とも ai_choose_move と同じ探索をノード数の上限つきで指す。
+#       詰み・指す手がない・--max-plies 手に達したら終局（最後は引き分け）。
+#
+# 出力（<出力先>/）:
+#   shard-000000.bin.gz ...  RECORD_SIZE バイトの固定長レコードを --shard-size 件ずつ gzip で圧縮
+#                            （実行を終えるときの最後のシャードだけは件数が少ないことがある）
+#   manifest.json            シャードの一覧（ファイル名・件数・バイト数・sha256）
+#   シャードは一時ファイルに書いてから名前を変え、その後で manifest を置き換えるので、
+#   途中で止まっても manifest に載っているシャードは常に完全なものだけになる。
+#
+# レコード（リトルエンディアン、RECORD.size = 120 バイト）:
+#   盤面 81バイト（マス番号順の駒コード。PIECE_CODES の位置、0 は空き）
+#   持ち駒 28バイト（先手・後手それぞれ HAND_LETTERS の順の枚数）
+#   手番 uint8 / 結果 int8（手番側から見て 1=勝ち 0=引き分け -1=負け）
+#   評価値 int16（手番側から見た探索の評価値）/ 指した手 uint32（shogi の整数の指し手）
+#   手数 uint16 / 予備 1バイト
+
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import random
+import struct
+import sys
+import time
+from collections import deque
+
+import shogi
+from shogi import SENTE, GOTE
+
+RECORD = struct.Struct('<81s28sBbhIHx')
+RECORD_SIZE = RECORD.size
+PIECE_CODES = '.KRBGSNLPkrbgsnlpDHdh'  # 龍王・龍馬は後ろに足した（前からある駒のコードは変えない）
+PIECE_INDEX = {p: i for i, p in enumerate(PIECE_CODES) if i}
+# 持ち駒は取った駒の大文字・小文字がそのまま残るので、両方を区別して数える
+HAND_LETTERS = 'RBGSNLPrbgsnlp'
+SCORE_LIMIT = 32000  # int16 に収まるよう評価値をこの範囲に丸める
+
+DEFAULT_NODES = 2000
+DEFAULT_OPENING = (4, 16)
+DEFAULT_MAX_PLIES = 256
+DEFAULT_SHARD_SIZE = 100000
+MANIFEST = 'manifest.json'
+REPORT_EVERY = 10.0       # 進み具合を表示する間隔（秒）
+GAMES_PER_WORKER = 200    # この局数を指したらワーカーを起動し直す（メモリを一定に保つ）
+
+
+# ============================================================
+# レコードの変換
+# ============================================================
+
+def pack_sample(pos, score, move, result):
+    """
+    局面1つ分のレコードを作る
+
+    Args:
+        pos: 局面（Position）
+        score: 手番側から見た評価値
+        move: 指した手（整数）
+        result: 手番側から見た対局結果（1, 0, -1）
+
+    Returns:
+        bytes: RECORD_SIZE バイトのレコード
+    """
+    board = bytes(PIECE_INDEX[p] if p else 0 for p in pos.squares)
+    hands = bytes(min(255, pos.hands[side].get(t, 0)) for side in (SENTE, GOTE) for t in HAND_LETTERS)
+    score = max(-SCORE_LIMIT, min(SCORE_LIMIT, int(score)))
+    return RECORD.pack(board, hands, pos.side, result, score, move, min(pos.ply, 0xffff))
+
+
+def unpack_sample(data, offset=0):
+    """
+    レコードを読む
+
+    Returns:
+        dict: {'position': Position, 'score', 'move', 'result', 'ply'}
+    """
+    board_bytes, hand_bytes, side, result, score, move, ply = RECORD.unpack_from(data, offset)
+    board = {shogi.SQUARES[sq]: PIECE_CODES[c] for sq, c in enumerate(board_bytes) if c}
+    hands = {'sente': [], 'gote': []}
+    for i, n in enumerate(hand_bytes):
+        hands[shogi.SIDE_NAMES[i // len(HAND_LETTERS)]].extend(HAND_LETTERS[i % len(HAND_LETTERS)] * n)
+    pos = shogi.Position.from_board(board, hands, shogi.SIDE_NAMES[side], ply)
+    return {'position': pos, 'score': score, 'move': move, 'result': result, 'ply': ply}
+
+
+def read_shard(path):
+    """シャードのレコードを順に読む（unpack_sample の結果を返すイテレータ）"""
+    with gzip.open(path, 'rb') as f:
+        data = f.read()
+    if len(data) % RECORD_SIZE:
+        raise ValueError('シャードの大きさがレコードの倍数ではありません: %s' % path)
+    for offset in range(0, len(data), RECORD_SIZE):
+        yield unpack_sample(data, offset)
+
+
+# ============================================================
+# 自己対局（ワーカープロセスで動く）
+# ============================================================
+
+def play_selfplay_game(task):
+    """
+    1局を自己対局してレコードを作る
+
+    Args:
+        task: (対局番号, seed, ノード数の上限, 序盤のランダムな手数の範囲, 最大手数)
+
+    Returns:
+        tuple: (レコードをつないだ bytes, レコード数, 手数)
+
+    実装の理由:
+        探索の評価値はルート（記録する局面）の手番側から見た値なので、そのまま記録する。
+        対局結果は終局してから分かるので、局面・評価値・指し手を覚えておき、
+        最後にまとめてレコードにする。
+    """
+    game_no, seed, nodes, opening, max_plies = task
+    rng = random.Random(seed * 1000003 + game_no)
+    pos = shogi.Position.from_board(shogi.create_initial_board(), shogi.create_empty_hands(), 'sente')
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    random_plies = rng.randint(*opening)
+    samples = []
+    winner = None
+    for ply in range(max_plies):
+        n = shogi.generate_legal_moves(pos, buf)
+        if not n:
+            winner = pos.side ^ 1  # 詰み・指す手がない
+            break
+        if ply < random_plies:
+            code = buf[rng.randrange(n)]
+        else:
+            res = shogi.search(pos, depth=shogi.MAX_CLOCK_DEPTH, nodes=nodes)
+            code = next(c for c in buf[:n] if shogi.decode_move(c) == res['move'])
+            # 深さ1も読み切れなかった局面は評価値がないので教師にしない
+            if res['score'] is not None:
+                samples.append((pos.copy(), res['score'], code))
+        pos.do_move(code)
+    out = bytearray()
+    for sample_pos, score, code in samples:
+        result = 0 if winner is None else (1 if sample_pos.side == winner else -1)
+        out += pack_sample(sample_pos, score, code, result)
+    return bytes(out), len(samples), pos.ply
+
+
+# ============================================================
+# シャードの書き出し
+# ============================================================
+
+class ShardWriter:
+    """
+    レコードを固定件数のシャードに分けて書き出し、manifest を更新する
+
+    Args:
+        directory: 出力先のディレクトリ
+        shard_size: 1シャードのレコード数
+        compresslevel: gzip の圧縮レベル
+
+    実装の理由:
+        書きかけのシャードは一時ファイル（.tmp）に書き、fsync してから
+        os.replace で正式な名前にする。manifest も同じく置き換えで更新するので、
+        どの時点で止まっても manifest に載ったシャードは完全で、
+        読む側は manifest だけを見ればよい。メモリに持つのは1シャード分だけ。
+    """
+
+    def __init__(self, directory, shard_size=DEFAULT_SHARD_SIZE, compresslevel=6):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.compresslevel = compresslevel
+        self.manifest = self._load_manifest()
+        self._buffer = bytearray()
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))  # 前回止まったときの書きかけ
+
+    def _load_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'format': 'shogi-selfplay', 'version': 1, 'record_size': RECORD_SIZE,
+                    'records': 0, 'shards': []}
+        if manifest.get('record_size') != RECORD_SIZE:
+            raise ValueError('レコードの形式が違う manifest です: %s' % path)
+        return manifest
+
+    @property
+    def records(self):
+        """manifest に載ったレコード数"""
+        return self.manifest['records']
+
+    def add(self, data):
+        """レコード（RECORD_SIZE の倍数の bytes）を加え、1シャード分たまったら書き出す"""
+        self._buffer += data
+        limit = self.shard_size * RECORD_SIZE
+        while len(self._buffer) >= limit:
+            self._write_shard(bytes(self._buffer[:limit]))
+            del self._buffer[:limit]
+
+    def close(self):
+        """残りのレコードを最後のシャードとして書き出す"""
+        if self._buffer:
+            self._write_shard(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def _write_shard(self, data):
+        name = 'shard-%06d.bin.gz' % len(self.manifest['shards'])
+        path = os.path.join(self.directory, name)
+        compressed = gzip.compress(data, self.compresslevel)
+        _atomic_write(path, compressed)
+        self.manifest['shards'].append({'file': name, 'records': len(data) // RECORD_SIZE,
+                                        'bytes': len(compressed),
+                                        'sha256': hashlib.sha256(compressed).hexdigest()})
+        self.manifest['records'] += len(data) // RECORD_SIZE
+        _atomic_write(os.path.join(self.directory, MANIFEST),
+                      json.dumps(self.manifest, indent=1).encode('utf-8'))
+
+
+def _atomic_write(path, data):
+    """一時ファイルに書いて fsync し、置き換える"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ============================================================
+# 実行
+# ============================================================
+
+def run(directory, workers=2, games=None, positions=None, nodes=DEFAULT_NODES,
+        opening=DEFAULT_OPENING, max_plies=DEFAULT_MAX_PLIES, seed=0,
+        shard_size=DEFAULT_SHARD_SIZE, report=None):
+    """
+    自己対局を続けてシャードを書き出す
+
+    Args:
+        directory: 出力先のディレクトリ
+        workers: ワーカープロセスの数
+        games: 指す局数（Noneなら制限なし）
+        positions: 集めるレコード数（Noneなら制限なし。超えた分も書き出す）
+        nodes: 1手の探索ノード数の上限
+        opening: 序盤にランダムに指す手数の範囲 (最小, 最大)
+        max_plies: 1局の最大手数（超えたら引き分け）
+        seed: 乱数の種（対局番号と組み合わせて各局の序盤を決める）
+        shard_size: 1シャードのレコード数
+        report: 進み具合を受け取る関数（run の戻り値と同じ形の辞書を渡す）
+
+    Returns:
+        dict: {'games', 'positions', 'plies', 'shards', 'time', 'positions_per_sec'}
+
+    実装の理由:
+        Pool.imap は終わりのない入力を先読みしきってしまうので、batch_analyze と
+        同じく処理中の局数を上限までに抑えて投入する。書き出しは親プロセスだけが行い、
+        ワーカーは一定の局数ごとに起動し直すので、何日動かしてもメモリは増えない。
+        対局番号は前回までに書いた分から続けるので、再実行しても同じ対局をくり返さない。
+    """
+    writer = ShardWriter(directory, shard_size)
+    first_game = writer.manifest.get('games', 0)
+    stats = {'games': 0, 'positions': 0, 'plies': 0}
+    start = time.monotonic()
+    last_report = start
+
+    def snapshot():
+        elapsed = time.monotonic() - start
+        return dict(stats, shards=len(writer.manifest['shards']), time=elapsed,
+                    positions_per_sec=stats['positions'] / max(elapsed, 1e-9))
+
+    def done():
+        return ((games is not None and stats['games'] >= games) or
+                (positions is not None and stats['positions'] >= positions))
+
+    pool = mp.Pool(workers, maxtasksperchild=GAMES_PER_WORKER)
+    inflight = deque()
+    submitted = 0
+    try:
+        while not done():
+            while len(inflight) < workers * 2 and (games is None or submitted < games):
+                task = (first_game + submitted, seed, nodes, opening, max_plies)
+                inflight.append(pool.apply_async(play_selfplay_game, (task,)))
+                submitted += 1
+            if not inflight:
+                break
+            data, count, plies = inflight.popleft().get()
+            stats['games'] += 1
+            stats['positions'] += count
+            stats['plies'] += plies
+            # 次に書くシャードの manifest に、この局までを指し終えたことを残す
+            writer.manifest['games'] = first_game + stats['games']
+            writer.add(data)
+            if report is not None and time.monotonic() - last_report >= REPORT_EVERY:
+                last_report = time.monotonic()
+                report(snapshot())
+    finally:
+        pool.terminate()
+        pool.join()
+        writer.close()
+    return snapshot()
+
+
+def _print_report(s):
+    print('%d局 %d局面 シャード%d個 %.1f局面/秒（%.0f秒）'
+          % (s['games'], s['positions'], s['shards'], s['positions_per_sec'], s['time']),
+          file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 自己対局による学習データの生成')
+    parser.add_argument('output', help='出力先のディレクトリ')
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count()))
+    parser.add_argument('--games', type=int, default=None, help='指す局数（省略時は制限なし）')
+    parser.add_argument('--positions', type=int, default=None, help='集める局面数（省略時は制限なし）')
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help='1手の探索ノード数の上限')
+    parser.add_argument('--opening', type=int, nargs=2, default=DEFAULT_OPENING, metavar=('MIN', 'MAX'),
+                        help='序盤にランダムに指す手数の範囲')
+    parser.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES, help='1局の最大手数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help='1シャードのレコード数')
+    args = parser.parse_args(argv)
+    try:
+        stats = run(args.output, args.workers, args.games, args.positions, args.nodes,
+                    tuple(args.opening), args.max_plies, args.seed, args.shard_size, _print_report)
+    except KeyboardInterrupt:
+        print('中断しました（書き出し済みのシャードは %s に記録されています）'
+              % os.path.join(args.output, MANIFEST), file=sys.stderr)
+        return
+    _print_report(stats)
+
+
+if __name__ == "__main__":
+    main()
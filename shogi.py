@@ -3,6 +3,13 @@
 # フェーズ1〜4 統合
 # ============================================================
 
+import random
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from operator import itemgetter
+
 BOARD_SIZE = 9
 
 # ============================================================
@@ -11,10 +18,13 @@ BOARD_SIZE = 9
 # 駒の内部表現（アルファベット）と画面表示（漢字）の対応表
 # 大文字 = 後手の駒、小文字 = 先手の駒
 # 理由: 大文字・小文字で先手/後手を区別することで、駒の所有者を簡単に判定できる
+#       成った飛車・角は別の文字（龍王=D, 龍馬=H）で表す
 PIECES = {
     'K': '玉', 'k': '王',  # 王将・玉将
-    'R': '飛', 'r': '龍',  # 飛車・龍王（成り飛車）
-    'B': '角', 'b': '馬',  # 角行・龍馬（成り角）
+    'R': '飛', 'r': '飛',  # 飛車
+    'B': '角', 'b': '角',  # 角行
+    'D': '龍', 'd': '龍',  # 龍王（成り飛車）
+    'H': '馬', 'h': '馬',  # 龍馬（成り角）
     'G': '金', 'g': '金',  # 金将
     'S': '銀', 's': '銀',  # 銀将
     'N': '桂', 'n': '桂',  # 桂馬
@@ -49,6 +59,10 @@ MOVES = {
     # 歩兵（前方に1マスのみ）
     'p': [(-1,0)],  # 先手の歩
     'P': [(1,0)],   # 後手の歩
+
+    # 龍王・龍馬の1マスの動き（縦横・斜めの長距離の動きは SLIDER_DIRECTIONS）
+    'd': [(-1,-1),(-1,1),(1,-1),(1,1)], 'D': [(-1,-1),(-1,1),(1,-1),(1,1)],  # 龍王: 斜め1マス
+    'h': [(-1,0),(1,0),(0,-1),(0,1)], 'H': [(-1,0),(1,0),(0,-1),(0,1)],      # 龍馬: 縦横1マス
 }
 
 # ============================================================
@@ -60,12 +74,17 @@ PROMOTABLE_PIECES = ['P','L','N','S','R','B','p','l','n','s','r','b']
 
 # 成り後の駒への変換マップ
 # 理由: 成った後の駒の種類を辞書で管理することで、変換処理を簡潔にできる
+#       歩・香・桂・銀は金として扱う。飛車・角は持ち主を変えないよう同じ大文字/小文字の
+#       別の駒（龍王・龍馬）にする
 PROMOTION_MAP = {
     'P':'G','L':'G','N':'G','S':'G',  # 後手: 歩・香・桂・銀 → 金
     'p':'g','l':'g','n':'g','s':'g',  # 先手: 歩・香・桂・銀 → 金
-    'R':'r','B':'b'                   # 飛車→龍王、角行→龍馬
+    'R':'D','B':'H','r':'d','b':'h',  # 飛車→龍王、角行→龍馬
 }
 
+# 成り駒 → 元の駒（取られて持ち駒になるときに戻す）
+UNPROMOTED = {'D':'R','H':'B','d':'r','h':'b'}
+
 # ============================================================
 # 定数定義：駒の価値（AI評価用）
 # ============================================================
@@ -74,8 +93,10 @@ PROMOTION_MAP = {
 #       成り駒は元の駒より価値が高い
 PIECE_VALUES = {
     'K':1000000,'k':1000000,  # 王: 取られたら負けなので非常に高い値
-    'R':1000,'r':1300,         # 飛車・龍王: 最も強力な駒
-    'B':800,'b':1000,          # 角行・龍馬
+    'R':1000,'r':1000,         # 飛車: 最も強力な駒
+    'D':1300,'d':1300,         # 龍王（成り飛車）
+    'B':800,'b':800,           # 角行
+    'H':1000,'h':1000,         # 龍馬（成り角）
     'G':600,'g':600,           # 金将
     'S':500,'s':500,           # 銀将
     'N':300,'n':300,           # 桂馬
@@ -83,6 +104,36 @@ PIECE_VALUES = {
     'P':100,'p':100            # 歩兵
 }
 
+# ============================================================
+# 呼び出し回数カウンタ（どの処理に時間がかかっているかの目安）
+# ============================================================
+# 主な関数が何回呼ばれたかを数える。常に有効で、辞書の値を1増やすだけなので
+# 探索速度への影響はごくわずか。reset_call_counts() で0に戻す。
+# 理由: プロファイラを使わなくても、合法手生成・王手判定・評価関数などの
+#       どこが多く呼ばれているか（キャッシュが効いているか）を本番でも確認できる
+CALL_COUNTS = {
+    'get_legal_moves': 0,       # 駒1つの移動先の生成（盤面辞書版）
+    'make_move': 0,             # 盤面をコピーして駒を動かす
+    'drop_piece': 0,            # 盤面をコピーして駒を打つ
+    'is_safe': 0,               # 指した後に自玉が取られないか（盤面辞書版）
+    'is_uchifuzume': 0,         # 打ち歩詰めの判定（盤面辞書版）
+    'evaluate_board': 0,        # 評価関数（盤面辞書版の入口）
+    'generate_legal_moves': 0,  # 全合法手の生成（Position版）
+    'generate_evasions': 0,     # 王手を受ける手の生成
+    'generate_captures': 0,     # 駒を取る手だけの生成
+    'generate_checks': 0,       # 王手になる手だけの生成
+    'generate_quiets': 0,       # 駒を取らず王手にもならない手の生成
+    'do_move': 0,               # Position上で1手進める
+    'is_attacked': 0,           # マスへの利きの判定
+    'uchifuzume_pos': 0,        # 打ち歩詰めの判定（Position版）
+    'evaluate_position': 0,     # 評価関数の本体
+}
+
+def reset_call_counts():
+    """呼び出し回数カウンタを0に戻す"""
+    for k in CALL_COUNTS:
+        CALL_COUNTS[k] = 0
+
 # ============================================================
 # 基本ユーティリティ関数
 # ============================================================
@@ -210,10 +261,11 @@ def get_legal_moves(board, r, f, turn):
         list: 移動可能な座標のリスト [(段, 筋), ...]
     
     実装の理由:
-        - MOVESの定義を使って基本移動を計算
-        - 飛車・角・香車は長距離移動なので別処理
+        - MOVESから事前計算した移動先テーブル(STEP_TARGETS)で基本移動を計算
+        - 飛車・角・香車は長距離移動なので方向ごとのマス列(SLIDER_RAYS)で処理
         - 味方の駒がいる場所や盤外には移動できない
     """
+    CALL_COUNTS['get_legal_moves'] += 1
     moves=[]
     p=get_piece(board,r,f)
     if not p: return moves
@@ -222,35 +274,28 @@ def get_legal_moves(board, r, f, turn):
     if (turn=='sente' and not is_sente(p)) or (turn=='gote' and is_sente(p)):
         return moves
 
+    sq=(r-1)*9+(f-1)
     # 基本移動（王、金、銀、桂、歩）
-    if p in MOVES:
-        for dr,df in MOVES[p]:
-            nr,nf=r+dr,f+df
-            if is_valid(nr,nf):
-                t=get_piece(board,nr,nf)
-                # 移動先が空きマス、または相手の駒がある場合のみ移動可能
-                if not t or is_sente(t)!=is_sente(p):
-                    moves.append((nr,nf))
+    if p in STEP_TARGETS:
+        for t in STEP_TARGETS[p][sq]:
+            to=SQUARES[t]
+            q=board.get(to)
+            # 移動先が空きマス、または相手の駒がある場合のみ移動可能
+            if not q or is_sente(q)!=is_sente(p):
+                moves.append(to)
 
     # 長距離移動（飛車・角・香車）
     # 理由: これらの駒は障害物にぶつかるまで直線的に移動できる
-    if p.lower() in ['r','b','l']:
-        dirs=[]
-        if p.lower()=='r': dirs=[(-1,0),(1,0),(0,-1),(0,1)]  # 飛車: 縦横4方向
-        if p.lower()=='b': dirs=[(-1,-1),(-1,1),(1,-1),(1,1)]  # 角: 斜め4方向
-        if p.lower()=='l': dirs=[(-1,0)] if p.islower() else [(1,0)]  # 香車: 前方のみ
-        
-        for dr,df in dirs:
-            nr,nf=r,f
-            while True:
-                nr+=dr; nf+=df
-                if not is_valid(nr,nf): break  # 盤外に出たら終了
-                t=get_piece(board,nr,nf)
-                if t:
+    if p in SLIDER_RAYS:
+        for ray in SLIDER_RAYS[p][sq]:
+            for t in ray:
+                to=SQUARES[t]
+                q=board.get(to)
+                if q:
                     # 駒がある場合、相手の駒なら取れるのでリストに追加して終了
-                    if is_sente(t)!=is_sente(p): moves.append((nr,nf))
+                    if is_sente(q)!=is_sente(p): moves.append(to)
                     break
-                moves.append((nr,nf))
+                moves.append(to)
     return moves
 
 # ============================================================
@@ -265,12 +310,13 @@ def demote(p):
         p: 駒の文字コード
     
     Returns:
-        str: 反転した駒（大文字↔小文字）
+        str: 反転した駒（大文字↔小文字。龍王・龍馬は飛車・角に戻す）
     
     実装の理由:
         取った駒は成りが解除され、相手の持ち駒として使われる。
         大文字↔小文字を反転させることで、所有者を変更できる。
     """
+    p = UNPROMOTED.get(p, p)
     return p.lower() if p.isupper() else p.upper()
 
 def can_promote(piece, frm, to, turn):
@@ -329,6 +375,7 @@ def make_move(board, frm, to, hands, promote=False, turn='sente'):
         - 相手の駒を取った場合、自動的に持ち駒に追加
         - 敵陣への出入りで自動的に成る
     """
+    CALL_COUNTS['make_move'] += 1
     # エラーチェック: 移動元に駒があるか
     if frm not in board:
         return None, None
@@ -372,6 +419,7 @@ def drop_piece(board, hands, piece, to, turn):
         - 打つ駒は成っていない状態で配置される
         - 持ち駒から削除し、盤上に配置する
     """
+    CALL_COUNTS['drop_piece'] += 1
     # エラーチェック: 持ち駒があるか、打つ場所が空きマスか
     if piece not in hands[turn] or get_piece(board,*to): 
         return None,None
@@ -410,33 +458,26 @@ def find_king(board, turn):
     for pos,p in board.items():
         if p==k: return pos
 
-def is_check(board, turn):
+def is_check(board, turn=None):
     """
     王手がかかっているか判定（P4: 王手判定機能）
     
     Args:
-        board: 盤面
-        turn: 'sente' または 'gote'（チェックされる側）
+        board: 盤面（または Position）
+        turn: 'sente' または 'gote'（チェックされる側。Position なら省略時は手番側）
     
     Returns:
         bool: 王手がかかっていればTrue
     
     実装の理由:
-        相手の全駒の移動可能位置に自分の王があるかをチェック。
+        自分の王のマスに相手の駒が利いているかをチェック。
         これにより王手状態を判定できる。
+        Position は王の位置を保持しているので find_king の走査も不要。
+        盤面辞書なら、利きを調べるだけなのでハッシュなしの Position を作る。
     """
-    kp=find_king(board,turn)
-    if not kp:
-        return False
-    
-    opp='gote' if turn=='sente' else 'sente'
-    
-    # 相手の全駒について、その駒が王を取れるかチェック
-    for (r,f),p in board.items():
-        if (opp=='sente' and is_sente(p)) or (opp=='gote' and is_gote(p)):
-            if kp in get_legal_moves(board,r,f,opp):
-                return True
-    return False
+    pos=_to_position(board,None,turn,with_hash=False)
+    side=pos.side if turn is None else (SENTE if turn=='sente' else GOTE)
+    return in_check(pos,side)
 
 # ============================================================
 # 特殊ルールの実装（P5: 特殊ルールによる制限）
@@ -459,6 +500,7 @@ def is_safe(board, hands, move, turn):
         将棋では自分の王が取られる手は指せない。
         仮想的に手を指してみて、王手状態にならないかを確認。
     """
+    CALL_COUNTS['is_safe'] += 1
     if move[0]=='move':
         b,_=make_move(board,move[1],move[2],hands,turn=turn)
     else:
@@ -511,7 +553,10 @@ def is_uchifuzume(board, hands, pos, turn):
         2. 相手に逃げる手がない（詰み）
         この2つを満たす場合が打ち歩詰め
     """
-    piece = 'P' if turn == 'sente' else 'p'  # 持ち駒の表記
+    CALL_COUNTS['is_uchifuzume'] += 1
+    # 持ち駒の歩の表記は大文字・小文字のどちらもありうる
+    # （取った駒は大小反転して持ち駒になり、SFENから読んだ持ち駒は大文字になる）
+    piece = 'P' if 'P' in hands[turn] else 'p'
     
     # 持ち駒に歩がなければ打ち歩詰めではない
     if piece not in hands[turn]:
@@ -572,71 +617,1306 @@ def is_dead_drop(piece, r, turn):
 
 
 # ============================================================
-# 全合法手の生成
+# 局面ハッシュ（Zobristハッシュ）
 # ============================================================
+# 盤上の(マス, 駒)、持ち駒の(手番, 駒, 枚数)、手番のそれぞれに64bitの乱数を
+# 割り当て、局面に現れるもののXORをハッシュ値とする
+# 理由: 盤面だけをキーにすると、持ち駒や手番が違う（=合法手が違う）局面を
+#       同じ局面として扱ってしまう。すべてをキーに含めて取り違えを防ぐ。
+_zobrist_rng = random.Random(20240601)  # 固定シード: 実行ごとに同じハッシュ値になる
+
+ZOBRIST_BOARD = {
+    ((r, f), p): _zobrist_rng.getrandbits(64)
+    for r in range(1, 10) for f in range(1, 10) for p in PIECES
+}
+ZOBRIST_HAND = {
+    (side, p, n): _zobrist_rng.getrandbits(64)
+    for side in ('sente', 'gote') for p in PIECES for n in range(1, 41)
+}
+ZOBRIST_GOTE = _zobrist_rng.getrandbits(64)  # 後手番のときだけXORする
 
-def get_all_legal_moves(board, hands, turn):
+def position_hash(board, hands, turn):
     """
-    すべての合法手を生成（盤上の駒の移動 + 持ち駒を打つ手）
+    盤面・持ち駒・手番から局面のハッシュ値を計算
     
     Args:
         board: 盤面
         hands: 持ち駒
-        turn: 'sente' または 'gote'
+        turn: 'sente' または 'gote'（手番）
     
     Returns:
-        list: 合法手のリスト [('move', 元, 先), ('drop', 駒, 位置), ...]
+        int: 64bitのハッシュ値
     
     実装の理由:
-        AIが次の手を選ぶためには、すべての合法手を知る必要がある。
-        特殊ルール（王手回避、二歩、打ち歩詰め等）でフィルタリング。
+        持ち駒は「どの駒を何枚持っているか」で区別する（リストの並び順は
+        合法手の集合に影響しないため無視する）。
     """
-    moves=[]
+    h = ZOBRIST_GOTE if turn == 'gote' else 0
+    for sq, p in board.items():
+        h ^= ZOBRIST_BOARD[(sq, p)]
+    for side in ('sente', 'gote'):
+        counts = {}
+        for p in hands[side]:
+            counts[p] = counts.get(p, 0) + 1
+        for p, n in counts.items():
+            h ^= ZOBRIST_HAND[(side, p, n)]
+    return h
+
+# ============================================================
+# 合法手キャッシュ（LRU）
+# ============================================================
+
+class MoveCache:
+    """
+    局面ハッシュ → 合法手（整数エンコードの配列）を保持する上限付きLRUキャッシュ
+    
+    Args:
+        max_entries: 保持する局面数の上限（Noneなら無制限）
+        max_bytes: 保持する合法手リストの推定メモリ量の上限（Noneなら無制限）
+    
+    実装の理由:
+        play_gameでは is_checkmate と get_all_legal_moves が同じ局面の合法手を
+        2回生成し、探索でも手順前後で同じ局面に何度も到達する。
+        一度生成した合法手を再利用して、重い合法手生成を省く。
+        上限を超えたら最も長く使われていない局面から捨てる。
+        64bitのハッシュは別の局面と衝突しうるので、登録するときに局面そのものを
+        表す照合用のキー（Position.key）も覚えておき、引くときに一致を確かめる。
+        一致しなければ見つからなかったものとして扱う（衝突の回数は collisions に数える）。
+    """
+
+    def __init__(self, max_entries=20000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key → (合法手の配列, バイト数, 照合用のキー)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.collisions = 0
+
+    def get(self, key, check=None):
+        """
+        キャッシュを引く。見つからなければNone。
+
+        Args:
+            key: 局面ハッシュ
+            check: 照合用のキー（登録したときの check と違えば、ハッシュの衝突としてNone）
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[2] != check:
+            self.misses += 1
+            self.collisions += 1
+            return None
+        self.entries.move_to_end(key)  # 最近使った局面として末尾へ
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, moves, check=None):
+        """合法手（array('I')）を照合用のキーとともに登録し、上限を超えた分を古い順に追い出す"""
+        size = sys.getsizeof(moves)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self.entries[key] = (moves, size, check)
+        self.nbytes += size
+        while self.entries and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries) or
+            (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """登録内容と統計をすべて消去"""
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = self.collisions = 0
+
+    def stats(self):
+        """ヒット・ミス・追い出し・衝突の回数と現在のサイズを辞書で返す"""
+        return {
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'collisions': self.collisions, 'entries': len(self.entries), 'bytes': self.nbytes,
+        }
+
+# 有効なキャッシュ（Noneならキャッシュしない）
+_move_cache = None
+
+def enable_move_cache(max_entries=20000, max_bytes=32 * 1024 * 1024):
+    """
+    合法手キャッシュを有効にする
+    
+    Returns:
+        MoveCache: 有効になったキャッシュ（統計の参照用）
+    """
+    global _move_cache
+    _move_cache = MoveCache(max_entries, max_bytes)
+    return _move_cache
+
+def disable_move_cache():
+    """合法手キャッシュを無効にする"""
+    global _move_cache
+    _move_cache = None
+
+def set_move_cache(cache):
+    """
+    合法手キャッシュを差し替える
+    
+    Args:
+        cache: MoveCache（Noneなら無効にする）
+    
+    Returns:
+        それまで使っていたキャッシュ（元に戻すときに渡す。無効だったならNone）
+    
+    実装の理由:
+        ベンチマークや対局のように、一時的にキャッシュを外したり専用のキャッシュを
+        使ったりする処理が、終わったときに呼び出し元の設定へ戻せるようにする。
+    """
+    global _move_cache
+    previous = _move_cache
+    _move_cache = cache
+    return previous
+
+def get_move_cache():
+    """有効なキャッシュを返す（無効ならNone）"""
+    return _move_cache
+
+# ============================================================
+# 指し手の整数エンコード
+# ============================================================
+# 指し手を1つの32bit整数で表す
+#   bit 0-6  : 移動先のマス番号（0-80）
+#   bit 7-13 : 移動元のマス番号（打つ手では0）
+#   bit 14   : 成りフラグ（自動成りが起きる手）
+#   bit 15-18: 打つ駒の種類（0=盤上の駒の移動, 1-7=歩香桂銀金角飛）
+#   bit 19   : 持ち駒の表記が小文字（取った駒は大小反転して持ち駒になるため）
+# マス番号は (段-1)*9 + (筋-1)
+# 理由: ('move', (r, f), (r2, f2)) のようなタプルを1手ごとに作ると、探索中に
+#       大量のオブジェクトを生成することになる。整数ならarray('I')に詰めて
+#       保持でき、比較や表への格納も軽い。
+MOVE_TO_MASK = 0x7f
+MOVE_FROM_SHIFT = 7
+MOVE_PROMOTE = 1 << 14
+MOVE_DROP_SHIFT = 15
+MOVE_DROP_MASK = 0xf << MOVE_DROP_SHIFT
+MOVE_DROP_LOWER = 1 << 19
+
+DROP_PIECES = ['', 'P', 'L', 'N', 'S', 'G', 'B', 'R']
+DROP_INDEX = {p: i for i, p in enumerate(DROP_PIECES) if p}
+
+# マス番号 → 座標タプル（使い回すことで座標タプルを新たに作らない）
+SQUARES = [(r, f) for r in range(1, 10) for f in range(1, 10)]
+
+MAX_MOVES = 600  # 1局面の合法手数の上限（将棋の最大合法手数は593）
+
+def square_index(sq):
+    """
+    座標 (段, 筋) をマス番号（0-80）に変換
+    """
+    return (sq[0] - 1) * 9 + (sq[1] - 1)
+
+def encode_move(move, promote=False):
+    """
+    タプル形式の指し手を整数に変換
+    
+    Args:
+        move: ('move', 元, 先) または ('drop', 駒, 位置)
+        promote: 成る手ならTrue（成りフラグを立てる）
+    
+    Returns:
+        int: エンコードされた指し手
+    """
+    if move[0] == 'drop':
+        piece = move[1]
+        code = DROP_INDEX[piece.upper()] << MOVE_DROP_SHIFT
+        if piece.islower():
+            code |= MOVE_DROP_LOWER
+        return code | square_index(move[2])
+    code = (square_index(move[1]) << MOVE_FROM_SHIFT) | square_index(move[2])
+    return (code | MOVE_PROMOTE) if promote else code
+
+def decode_move(code):
+    """
+    整数の指し手をタプル形式に戻す
+    
+    Args:
+        code: encode_move の戻り値
+    
+    Returns:
+        tuple: ('move', 元, 先) または ('drop', 駒, 位置)
+    
+    実装の理由:
+        parse_input・play_game・テストはタプル形式で指し手を扱うため、
+        探索結果を返すときにだけタプルに変換する。
+        成りは自動で判定されるので、タプルには成りフラグを含めない。
+    """
+    to = SQUARES[code & MOVE_TO_MASK]
+    kind = (code & MOVE_DROP_MASK) >> MOVE_DROP_SHIFT
+    if kind:
+        piece = DROP_PIECES[kind]
+        return ('drop', piece.lower() if code & MOVE_DROP_LOWER else piece, to)
+    return ('move', SQUARES[(code >> MOVE_FROM_SHIFT) & MOVE_TO_MASK], to)
+
+def apply_move_code(board, hands, code, turn):
+    """
+    整数の指し手を実行し、新しい盤面と持ち駒を返す
+    
+    Returns:
+        tuple: make_move / drop_piece と同じ (新しい盤面, 新しい持ち駒)
+    """
+    to = SQUARES[code & MOVE_TO_MASK]
+    kind = (code & MOVE_DROP_MASK) >> MOVE_DROP_SHIFT
+    if kind:
+        piece = DROP_PIECES[kind]
+        if code & MOVE_DROP_LOWER:
+            piece = piece.lower()
+        return drop_piece(board, hands, piece, to, turn)
+    return make_move(board, SQUARES[(code >> MOVE_FROM_SHIFT) & MOVE_TO_MASK], to, hands, turn=turn)
+
+# 探索の深さ（ply）ごとに確保しておく指し手バッファ
+# 理由: 各局面で新しいリストを作らず、同じ配列を上書きして使い回す
+_move_buffers = []
+
+def get_move_buffer(ply):
+    """
+    指定したplyの指し手バッファ（array('I')）を返す。なければ確保する。
+    """
+    while len(_move_buffers) <= ply:
+        _move_buffers.append(array('I', [0]) * MAX_MOVES)
+    return _move_buffers[ply]
+
+def _push_move(buf, n, code):
+    """バッファのn番目に指し手を書き込む（足りなければ配列を倍に伸ばす）"""
+    if n == len(buf):
+        buf.extend(buf)
+    buf[n] = code
+
+# ============================================================
+# 局面クラス（Position）
+# ============================================================
+
+SENTE, GOTE = 0, 1
+SIDE_NAMES = ('sente', 'gote')
+
+# 駒 → 所有者（SENTE/GOTE）
+# 理由: 内側のループで毎回 (turn=='sente' and is_sente(p)) or ... と
+#       文字列比較するかわりに、整数どうしの比較で所有者を判定する
+SIDE_OF = {p: (SENTE if is_sente(p) else GOTE) for p in PIECES}
+
+# マス番号 → 段・筋
+SQ_RANK = [r for r, f in SQUARES]
+SQ_FILE = [f for r, f in SQUARES]
+
+# マス番号ごとのZobrist乱数（ZOBRIST_BOARD と同じ値を引けるようにしたもの）
+ZOBRIST_SQ = [{p: ZOBRIST_BOARD[(sq, p)] for p in PIECES} for sq in SQUARES]
+
+# 駒の移動先・利きの事前計算テーブル
+# 長距離の駒（飛車・角・香車）が進める方向
+SLIDER_DIRECTIONS = {
+    'r': [(-1,0),(1,0),(0,-1),(0,1)], 'R': [(-1,0),(1,0),(0,-1),(0,1)],      # 飛車: 縦横4方向
+    'b': [(-1,-1),(-1,1),(1,-1),(1,1)], 'B': [(-1,-1),(-1,1),(1,-1),(1,1)],  # 角: 斜め4方向
+    'd': [(-1,0),(1,0),(0,-1),(0,1)], 'D': [(-1,0),(1,0),(0,-1),(0,1)],      # 龍王: 飛車と同じ
+    'h': [(-1,-1),(-1,1),(1,-1),(1,1)], 'H': [(-1,-1),(-1,1),(1,-1),(1,1)],  # 龍馬: 角と同じ
+    'l': [(-1,0)], 'L': [(1,0)],                                            # 香車: 前方のみ
+}
+
+def _build_move_tables():
+    """
+    駒ごと・マスごとの移動先テーブルを作る
+    
+    Returns:
+        tuple: (STEP_TARGETS, SLIDER_RAYS, STEP_ATTACKERS, ATTACK_RAYS)
+            STEP_TARGETS[駒][マス]: 1マス動く駒の移動先マス番号のタプル
+            SLIDER_RAYS[駒][マス]: 長距離の駒の方向ごとの移動先列（近い順）
+            STEP_ATTACKERS[手番][マス]: そのマスへ1マス動きで届く (移動元, 駒) の組
+            ATTACK_RAYS[手番][マス]: そのマスから見た方向ごとのマス列と、
+                                    その方向から利いてくる長距離の駒
+    
+    実装の理由:
+        get_legal_moves は呼ばれるたびに r+dr, f+df の計算、is_valid による
+        盤外チェック、方向リストの作成をしていた。盤の形は変わらないので、
+        81マス分の結果を最初に1回だけ計算して引くだけにする。
+        全部作っても数ミリ秒なので、import時に作ってしまう。
+    """
+    def ray(sq, dr, df):
+        r, f = SQUARES[sq]
+        out = []
+        r += dr; f += df
+        while is_valid(r, f):
+            out.append((r - 1) * 9 + f - 1)
+            r += dr; f += df
+        return tuple(out)
+
+    step_targets = {
+        p: [tuple((r + dr - 1) * 9 + f + df - 1 for dr, df in dirs if is_valid(r + dr, f + df))
+            for r, f in SQUARES]
+        for p, dirs in MOVES.items()
+    }
+    slider_rays = {
+        p: [tuple(ray(sq, dr, df) for dr, df in dirs) for sq in range(81)]
+        for p, dirs in SLIDER_DIRECTIONS.items()
+    }
+    step_attackers = []
+    attack_rays = []
+    for side in (SENTE, GOTE):
+        steps = [p for p in MOVES if SIDE_OF[p] == side]
+        sliders = [p for p in SLIDER_DIRECTIONS if SIDE_OF[p] == side]
+        attackers = [[] for _ in range(81)]
+        for p in steps:
+            for src in range(81):
+                for t in step_targets[p][src]:
+                    attackers[t].append((src, p))
+        step_attackers.append([tuple(a) for a in attackers])
+        per_square = []
+        for sq in range(81):
+            entries = []
+            for dr, df in [(-1,0),(1,0),(0,-1),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)]:
+                # この方向にいる駒が、逆向き(-dr, -df)に進んで sq に届くか
+                attackers = frozenset(p for p in sliders if (-dr, -df) in SLIDER_DIRECTIONS[p])
+                squares = ray(sq, dr, df)
+                if attackers and squares:
+                    entries.append((squares, attackers))
+            per_square.append(tuple(entries))
+        attack_rays.append(per_square)
+    return step_targets, slider_rays, step_attackers, attack_rays
+
+STEP_TARGETS, SLIDER_RAYS, STEP_ATTACKERS, ATTACK_RAYS = _build_move_tables()
+
+class Position:
+    """
+    局面（盤面・持ち駒・手番）を1つにまとめたクラス
+    
+    属性:
+        squares: 81マスの配列（マス番号 → 駒の文字コード、空きマスはNone）
+        hands: [先手の持ち駒, 後手の持ち駒]（それぞれ {駒: 枚数}）
+        side: 手番（SENTE=0 または GOTE=1）
+        kings: [先手の王のマス番号, 後手の王のマス番号]（いなければ-1）
+        hash: Zobristハッシュ（position_hash と同じ値）
+        ply: 手数
+    
+    実装の理由:
+        これまでの関数は board・hands・turn を別々に受け渡し、王の位置も
+        王手判定のたびに find_king で盤面を走査して探していた。
+        1つにまとめて、指す(do_move)/戻す(undo_move)ときに王の位置と
+        ハッシュを差分更新すれば、探索中の盤面コピーと走査が不要になる。
+        __slots__ で属性を固定し、メモリと属性アクセスを軽くする。
+    """
+    __slots__ = ('squares', 'hands', 'side', 'kings', 'hash', 'ply')
+
+    def __init__(self):
+        self.squares = [None] * 81
+        self.hands = [{}, {}]
+        self.side = SENTE
+        self.kings = [-1, -1]
+        self.hash = 0
+        self.ply = 0
+
+    @classmethod
+    def from_board(cls, board, hands=None, turn='sente', ply=0, with_hash=True):
+        """
+        従来の (board, hands, turn) から局面を作る
+        
+        Args:
+            board: 盤面の辞書
+            hands: 持ち駒（Noneなら持ち駒なし）
+            turn: 'sente' または 'gote'
+            ply: 手数
+            with_hash: Falseならハッシュを計算しない（hash は0のまま）
+        
+        Returns:
+            Position: 新しい局面
+        
+        実装の理由:
+            is_check・evaluate_board のように盤面辞書を1回調べるだけの呼び出しは
+            利きの表と王の位置しか使わないので、position_hash の計算を省く。
+        """
+        pos = cls()
+        squares = pos.squares
+        kings = pos.kings
+        for (r, f), p in board.items():
+            sq = (r - 1) * 9 + (f - 1)
+            squares[sq] = p
+            # find_king と同じく、最初に見つかった王を採用する
+            if p == 'k' and kings[SENTE] < 0:
+                kings[SENTE] = sq
+            elif p == 'K' and kings[GOTE] < 0:
+                kings[GOTE] = sq
+        if hands is not None:
+            for side in (SENTE, GOTE):
+                counts = pos.hands[side]
+                for p in hands[SIDE_NAMES[side]]:
+                    counts[p] = counts.get(p, 0) + 1
+        pos.side = SENTE if turn == 'sente' else GOTE
+        pos.ply = ply
+        if with_hash:
+            pos.hash = position_hash(board, hands or {'sente': [], 'gote': []}, turn)
+        return pos
+
+    def to_board(self):
+        """
+        従来の (board, hands, turn) 形式に戻す
+        
+        Returns:
+            tuple: (盤面の辞書, 持ち駒の辞書, 'sente' または 'gote')
+        """
+        board = {SQUARES[sq]: p for sq, p in enumerate(self.squares) if p}
+        hands = {
+            SIDE_NAMES[side]: [p for p, n in self.hands[side].items() for _ in range(n)]
+            for side in (SENTE, GOTE)
+        }
+        return board, hands, SIDE_NAMES[self.side]
+
+    def copy(self):
+        """局面の複製を返す"""
+        pos = Position.__new__(Position)
+        pos.squares = self.squares[:]
+        pos.hands = [self.hands[SENTE].copy(), self.hands[GOTE].copy()]
+        pos.side = self.side
+        pos.kings = self.kings[:]
+        pos.hash = self.hash
+        pos.ply = self.ply
+        return pos
+
+    def key(self):
+        """
+        局面そのもの（盤面・持ち駒・手番）を表すタプル
+
+        実装の理由:
+            hash は64bitなので別の局面と同じ値になることがある。合法手キャッシュは
+            これを照合用のキーとして覚え、衝突した局面の合法手を返さないようにする。
+            持ち駒は枚数が0の駒を除いて並べる（同じ持ち駒なら同じキーになる）。
+        """
+        return (tuple(self.squares),
+                tuple(sorted((p, n) for p, n in self.hands[SENTE].items() if n)),
+                tuple(sorted((p, n) for p, n in self.hands[GOTE].items() if n)),
+                self.side)
+
+    @property
+    def turn(self):
+        """手番を 'sente' / 'gote' で返す"""
+        return SIDE_NAMES[self.side]
+
+    def _add_hand(self, side, p, delta):
+        """持ち駒の枚数を増減し、ハッシュも更新する"""
+        hand = self.hands[side]
+        name = SIDE_NAMES[side]
+        n = hand.get(p, 0)
+        if n:
+            self.hash ^= ZOBRIST_HAND[(name, p, n)]
+        n += delta
+        if n:
+            self.hash ^= ZOBRIST_HAND[(name, p, n)]
+        # 0枚になってもキーは残す（辞書の並び=打つ手の生成順を変えないため）
+        hand[p] = n
+
+    def do_move(self, code):
+        """
+        整数エンコードの指し手をこの局面に適用する（局面を直接書き換える）
+        
+        Args:
+            code: 指し手（encode_move / generate_legal_moves の値）
+        
+        Returns:
+            tuple: undo_move に渡す復元情報
+        
+        実装の理由:
+            make_move / drop_piece と同じ規則（取った駒は大小反転して持ち駒、
+            敵陣への出入りで自動成り）で盤面を更新する。
+            盤面をコピーしないかわりに、戻すための情報だけを返す。
+        """
+        CALL_COUNTS['do_move'] += 1
+        squares = self.squares
+        side = self.side
+        to = code & MOVE_TO_MASK
+        undo = (None, None, self.hash, self.kings[SENTE], self.kings[GOTE])
+        kind = (code & MOVE_DROP_MASK) >> MOVE_DROP_SHIFT
+        if kind:
+            # 持ち駒を打つ（先手なら小文字、後手なら大文字で配置）
+            hand_p = DROP_PIECES[kind]
+            if code & MOVE_DROP_LOWER:
+                hand_p = hand_p.lower()
+            p = hand_p.lower() if side == SENTE else hand_p.upper()
+            self._add_hand(side, hand_p, -1)
+            squares[to] = p
+            self.hash ^= ZOBRIST_SQ[to][p]
+            undo = (hand_p, None) + undo[2:]
+        else:
+            frm = (code >> MOVE_FROM_SHIFT) & MOVE_TO_MASK
+            p = squares[frm]
+            # 成り先を先に決めておく（例外が出ても局面を壊さないため）
+            np = p
+            if p in PROMOTABLE_PIECES:
+                if side == SENTE:
+                    if SQ_RANK[frm] <= 3 or SQ_RANK[to] <= 3:
+                        np = PROMOTION_MAP[p]
+                elif SQ_RANK[frm] >= 7 or SQ_RANK[to] >= 7:
+                    np = PROMOTION_MAP[p]
+            captured = squares[to]
+            if captured:
+                self.hash ^= ZOBRIST_SQ[to][captured]
+                self._add_hand(side, demote(captured), 1)
+                if captured == 'k':
+                    self.kings[SENTE] = -1
+                elif captured == 'K':
+                    self.kings[GOTE] = -1
+            squares[frm] = None
+            squares[to] = np
+            self.hash ^= ZOBRIST_SQ[frm][p] ^ ZOBRIST_SQ[to][np]
+            if p == 'k':
+                self.kings[SENTE] = to
+            elif p == 'K':
+                self.kings[GOTE] = to
+            undo = (p, captured) + undo[2:]
+        self.side = side ^ 1
+        self.hash ^= ZOBRIST_GOTE
+        self.ply += 1
+        return undo
+
+    def undo_move(self, code, undo):
+        """
+        do_move で適用した指し手を取り消す
+        
+        Args:
+            code: do_move に渡した指し手
+            undo: do_move の戻り値
+        """
+        p, captured, h, k0, k1 = undo
+        side = self.side ^ 1
+        squares = self.squares
+        to = code & MOVE_TO_MASK
+        hand = self.hands[side]
+        if code & MOVE_DROP_MASK:
+            squares[to] = None
+            hand[p] = hand.get(p, 0) + 1
+        else:
+            squares[(code >> MOVE_FROM_SHIFT) & MOVE_TO_MASK] = p
+            squares[to] = captured
+            if captured:
+                hand[demote(captured)] -= 1
+        self.side = side
+        self.hash = h
+        self.kings[SENTE] = k0
+        self.kings[GOTE] = k1
+        self.ply -= 1
+
+def _to_position(board, hands, turn, with_hash=True):
+    """
+    Position ならそのまま、従来の盤面辞書なら Position に変換して返す
+    （with_hash=False ならハッシュを計算しない。探索や合法手キャッシュには使えない）
+    """
+    if isinstance(board, Position):
+        return board
+    return Position.from_board(board, hands, turn, with_hash=with_hash)
+
+def is_attacked(pos, sq, by):
+    """
+    指定したマスに by 側の駒が利いているか（その駒がそのマスへ動けるか）を判定
+    
+    Args:
+        pos: 局面
+        sq: マス番号
+        by: 利きを調べる側（SENTE/GOTE）
+    
+    Returns:
+        bool: 利いていればTrue
+    
+    実装の理由:
+        相手の全駒の移動先を生成するかわりに、調べたいマスから逆向きに
+        「そこに相手の駒がいれば届く」位置だけを事前計算テーブルで確認する。
+        移動先に味方の駒がいるかどうかは呼び出し側で判断する。
+    """
+    CALL_COUNTS['is_attacked'] += 1
+    squares = pos.squares
+    # 1マスずつ動く駒（王・金・銀・桂・歩）
+    for src, p in STEP_ATTACKERS[by][sq]:
+        if squares[src] == p:
+            return True
+    # 長距離の駒（飛車・角・香車）: 各方向の最初の駒を見る
+    for ray, sliders in ATTACK_RAYS[by][sq]:
+        for t in ray:
+            q = squares[t]
+            if q:
+                if q in sliders:
+                    return True
+                break
+    return False
+
+def in_check(pos, side=None):
+    """
+    side 側（省略時は手番側）の王に王手がかかっているか
+    
+    実装の理由:
+        王の位置は Position が保持しているので、盤面を走査せずに済む
+    """
+    if side is None:
+        side = pos.side
+    kp = pos.kings[side]
+    return kp >= 0 and is_attacked(pos, kp, side ^ 1)
+
+def _piece_targets(squares, sq, p, side):
+    """
+    局面上の駒 p（sq にいる side 側の駒）の移動先マス番号のリスト
+    
+    実装の理由:
+        get_legal_moves と同じ規則（盤外・味方の駒がいるマスには動けない、
+        飛車・角・香車は駒にぶつかるまで進める）を事前計算テーブルで計算する
+    """
+    targets = []
+    steps = STEP_TARGETS.get(p)
+    if steps:
+        for t in steps[sq]:
+            q = squares[t]
+            if not q or SIDE_OF[q] != side:
+                targets.append(t)
+    rays = SLIDER_RAYS.get(p)
+    if rays:
+        for ray in rays[sq]:
+            for t in ray:
+                q = squares[t]
+                if q:
+                    if SIDE_OF[q] != side:
+                        targets.append(t)
+                    break
+                targets.append(t)
+    return targets
+
+def _has_legal_board_move(pos):
+    """
+    手番側に盤上の駒を動かす合法手が1つでもあるか（打つ手は含めない）
+    
+    実装の理由:
+        打ち歩詰めの判定用。is_uchifuzume と同じく盤上の駒の移動だけを調べ、
+        1つ見つかった時点で打ち切る。
+    """
+    side = pos.side
+    squares = pos.squares
+    for sq in range(81):
+        p = squares[sq]
+        if p and SIDE_OF[p] == side:
+            frm_code = sq << MOVE_FROM_SHIFT
+            for to in _piece_targets(squares, sq, p, side):
+                code = frm_code | to
+                undo = pos.do_move(code)
+                ok = not in_check(pos, side)
+                pos.undo_move(code, undo)
+                if ok:
+                    return True
+    return False
+
+def _is_uchifuzume_pos(pos, to):
+    """
+    打ち歩詰めの判定（is_uchifuzume の Position 版）
+    
+    実装の理由:
+        is_uchifuzume と同じ条件で判定する: 手番側の持ち駒に
+        歩（'P'・'p' のどちらの表記でもよい）があり、打つと王手になり、
+        相手に盤上の駒を動かす合法手がなければ打ち歩詰め。
+    """
+    CALL_COUNTS['uchifuzume_pos'] += 1
+    side = pos.side
+    hand = pos.hands[side]
+    hand_p = 'P' if hand.get('P') else 'p'
+    if not hand.get(hand_p):
+        return False
+    code = (DROP_INDEX['P'] << MOVE_DROP_SHIFT) | to
+    if hand_p == 'p':
+        code |= MOVE_DROP_LOWER
+    undo = pos.do_move(code)
+    mate = in_check(pos) and not _has_legal_board_move(pos)
+    pos.undo_move(code, undo)
+    return mate
+
+# ============================================================
+# 静的交換評価（SEE: Static Exchange Evaluation）
+# ============================================================
+
+def _promoted(p, frm, to, side):
+    """sq=frm から to へ動いた駒 p が、do_move の自動成りの規則で何になるか"""
+    if p in PROMOTABLE_PIECES:
+        if side == SENTE:
+            if SQ_RANK[frm] <= 3 or SQ_RANK[to] <= 3:
+                return PROMOTION_MAP[p]
+        elif SQ_RANK[frm] >= 7 or SQ_RANK[to] >= 7:
+            return PROMOTION_MAP[p]
+    return p
+
+def _least_valuable_attacker(squares, to, side, gone):
+    """
+    to に利いている side 側の駒のうち、最も安い駒の (マス番号, 駒)（なければ (None, None)）
+
+    実装の理由:
+        is_attacked と同じ事前計算テーブルを引くが、gone のマス（取り合いで
+        すでに動いた駒）は空きマスとして扱い、その後ろの長距離の駒も見る。
+    """
+    best_sq = None
+    best_p = None
+    best_v = 0
+    for src, p in STEP_ATTACKERS[side][to]:
+        if squares[src] == p and src not in gone:
+            v = PIECE_VALUES[p]
+            if best_sq is None or v < best_v:
+                best_sq, best_p, best_v = src, p, v
+    for ray, sliders in ATTACK_RAYS[side][to]:
+        for t in ray:
+            q = squares[t]
+            if q and t not in gone:
+                if q in sliders:
+                    v = PIECE_VALUES[q]
+                    if best_sq is None or v < best_v:
+                        best_sq, best_p, best_v = t, q, v
+                break
+    return best_sq, best_p
+
+def see(pos, code):
+    """
+    指し手の行き先のマスで駒の取り合いを続けたときの駒得を見積もる（静的交換評価）
+
+    Args:
+        pos: 局面（書き換えない）
+        code: 手番側の指し手（整数エンコード。駒を取らない手・打つ手でもよい）
+
+    Returns:
+        int: 手番側から見た駒得（PIECE_VALUES の単位。取り返されて損をするなら負）
+
+    実装の理由:
+        駒を取る手を実際に指して読まなくても、そのマスに利いている駒を
+        事前計算テーブルから安い順に出して交互に取り返すと考えれば、
+        取り合いの結果が分かる。どちらの側も損になるなら取り返さない
+        （途中でやめてよい）ものとして、最後の取り返しから逆にたどって値を決める。
+        盤面はコピーも書き換えもせず、動いた駒のマスを gone に覚えておくだけにする。
+        gone のマスを飛ばして長距離の駒を探すので、後ろに控えた飛車・角・香車も
+        取り合いに加わる。敵陣に出入りして金に成る駒は、その分の得も数える。
+        玉は相手の駒がもう利いていないときだけ取り返せる。
+        ピン（動くと自玉に王手がかかる駒）は考えない。
+    """
+    squares = pos.squares
+    side = pos.side
+    to = code & MOVE_TO_MASK
+    gone = set()
+    kind = (code & MOVE_DROP_MASK) >> MOVE_DROP_SHIFT
+    if kind:
+        # 打った駒は何も取らない（取り返されるかだけを見る）
+        p = DROP_PIECES[kind].lower() if side == SENTE else DROP_PIECES[kind]
+        gain = [0]
+    else:
+        frm = (code >> MOVE_FROM_SHIFT) & MOVE_TO_MASK
+        p = squares[frm]
+        captured = squares[to]
+        np = _promoted(p, frm, to, side)
+        gain = [(PIECE_VALUES[captured] if captured else 0) + PIECE_VALUES[np] - PIECE_VALUES[p]]
+        p = np
+        gone.add(frm)
+    # gain[d]: d回目の取り返しまで進めたときの、その手を指した側から見た駒得
+    while True:
+        side ^= 1
+        src, q = _least_valuable_attacker(squares, to, side, gone)
+        if src is None:
+            break
+        gone.add(src)
+        if q == 'k' or q == 'K':
+            if _least_valuable_attacker(squares, to, side ^ 1, gone)[0] is not None:
+                break
+        nq = _promoted(q, src, to, side)
+        gain.append(PIECE_VALUES[p] + PIECE_VALUES[nq] - PIECE_VALUES[q] - gain[-1])
+        p = nq
+    for d in range(len(gain) - 1, 0, -1):
+        # 取り返すと損なら、取り返さずに止める
+        if gain[d] > -gain[d - 1]:
+            gain[d - 1] = -gain[d]
+    return gain[0]
+
+# ============================================================
+# 全合法手の生成
+# ============================================================
+
+def generate_legal_moves(pos, buf):
+    """
+    局面のすべての合法手を整数エンコードで指し手バッファに書き込む
+    
+    Args:
+        pos: 局面（Position）
+        buf: 書き込み先の array('I')（get_move_buffer で取得）
+    
+    Returns:
+        int: 書き込んだ合法手の数（buf[:n] が合法手）
+    
+    実装の理由:
+        get_all_legal_moves と同じ条件（自殺手、二歩、行き所のない駒、
+        打ち歩詰め）で合法手を生成するが、盤面をコピーせずに
+        do_move/undo_move で試し、指し手タプルも作らない。
+        持ち駒は種類ごとに1回だけ打つ手を生成する。
+        合法手キャッシュが有効なら、同じ局面の合法手を再利用する
+        （ハッシュが同じでも、照合用のキー Position.key が違えば使わない）。
+        王手をかけられているときは generate_evasions で王手を受ける手だけを作る。
+    """
+    CALL_COUNTS['generate_legal_moves'] += 1
+    cache=_move_cache
+    if cache is not None:
+        check=pos.key()
+        cached=cache.get(pos.hash,check)
+        if cached is not None:
+            n=len(cached)
+            while len(buf)<n:
+                buf.extend(buf)
+            buf[:n]=cached
+            return n
+    if in_check(pos):
+        n=generate_evasions(pos,buf)
+        if cache is not None:
+            cache.put(pos.hash,buf[:n],check)
+        return n
+
+    side=pos.side
+    squares=pos.squares
+    turn=SIDE_NAMES[side]
+    n=0
     
     # 1. 盤上の駒を動かす手
-    for (r,f),p in board.items():
-        if (turn=='sente' and is_sente(p)) or (turn=='gote' and is_gote(p)):
-            for to in get_legal_moves(board,r,f,turn):
-                m=('move',(r,f),to)
+    for sq in range(81):
+        p=squares[sq]
+        if p and SIDE_OF[p]==side:
+            frm_code=sq<<MOVE_FROM_SHIFT
+            for to in _piece_targets(squares,sq,p,side):
+                code=frm_code|to
                 # 自殺手（自玉が王手になる手）は除外
-                if is_safe(board,hands,m,turn): 
-                    moves.append(m)
+                undo=pos.do_move(code)
+                safe=not in_check(pos,side)
+                pos.undo_move(code,undo)
+                if not safe:
+                    continue
+                if p in PROMOTABLE_PIECES and (
+                        (SQ_RANK[sq]<=3 or SQ_RANK[to]<=3) if side==SENTE
+                        else (SQ_RANK[sq]>=7 or SQ_RANK[to]>=7)):
+                    code|=MOVE_PROMOTE
+                _push_move(buf,n,code); n+=1
 
     # 2. 持ち駒を打つ手
-    for piece in hands[turn]:
-        for r in range(1,10):
-            for f in range(1,10):
+    hand=pos.hands[side]
+    if any(hand.values()):
+        pawn='p' if side==SENTE else 'P'
+        pawn_files={SQ_FILE[sq] for sq in range(81) if squares[sq]==pawn}
+        for piece,count in list(hand.items()):
+            if not count: continue
+            drop_code=DROP_INDEX[piece.upper()]<<MOVE_DROP_SHIFT
+            if piece.islower():
+                drop_code|=MOVE_DROP_LOWER
+            is_pawn=piece.lower()=='p'
+            for to in range(81):
                 # 駒がある場所には打てない
-                if get_piece(board,r,f): continue
+                if squares[to]: continue
                 
                 # P5-②: 二歩チェック
-                if piece.lower()=='p' and has_pawn_on_file(board,f,turn): continue
+                if is_pawn and SQ_FILE[to] in pawn_files: continue
                 
                 # P5-④: 行き所のない駒チェック
-                if is_dead_drop(piece,r,turn): continue
+                if is_dead_drop(piece,SQ_RANK[to],turn): continue
 
                 # P5-③: 打ち歩詰めチェック
-                if piece.lower() == 'p' and is_uchifuzume(board, hands, (r,f), turn):
-                    continue
+                if is_pawn and _is_uchifuzume_pos(pos,to): continue
 
-                m=('drop',piece,(r,f))
                 # 自殺手チェック
-                if is_safe(board,hands,m,turn): 
-                    moves.append(m)
+                code=drop_code|to
+                undo=pos.do_move(code)
+                safe=not in_check(pos,side)
+                pos.undo_move(code,undo)
+                if safe:
+                    _push_move(buf,n,code); n+=1
+    
+    if cache is not None:
+        cache.put(pos.hash,buf[:n],check)
+    return n
+
+def _checkers(pos, side):
+    """
+    side 側の王に王手をかけている駒と、その間のマス
     
-    return moves
+    Returns:
+        list: [(王手をかけている駒のマス, 王との間のマスのリスト), ...]
+    
+    実装の理由:
+        is_attacked と同じ表を王のマスから逆向きにたどり、
+        最初に見つかった1つで止めずに、王手をかけている駒をすべて集める。
+        長距離の駒（飛車・角・香車）の王手は、間のマスに合駒ができる。
+    """
+    kp=pos.kings[side]
+    by=side^1
+    squares=pos.squares
+    result=[]
+    for src,p in STEP_ATTACKERS[by][kp]:
+        if squares[src]==p:
+            result.append((src,()))
+    for ray,sliders in ATTACK_RAYS[by][kp]:
+        for i,t in enumerate(ray):
+            q=squares[t]
+            if q:
+                if q in sliders:
+                    result.append((t,ray[:i]))
+                break
+    return result
+
+def generate_evasions(pos, buf):
+    """
+    王手をかけられている局面の合法手（王手を受ける手）だけを生成する
+    
+    Args:
+        pos: 手番側に王手がかかっている局面
+        buf: 書き込み先の array('I')
+    
+    Returns:
+        int: 書き込んだ合法手の数
+    
+    実装の理由:
+        王手を受ける手は次の3種類しかない。
+          1. 玉を動かす
+          2. 王手をかけている駒を取る
+          3. 長距離の駒の王手なら、間に駒を動かす・打つ（合駒）
+        両王手なら1だけ。すべての手・すべての空きマスへの打ち駒を作ってから
+        自殺手として捨てるかわりに、2と3の移動先のマスだけを調べる。
+        動かした駒が釘付けにされている場合などがあるので、
+        自殺手かどうかの確認は通常の生成と同じく行う。
+        生成の順番は generate_legal_moves と同じ（その部分列）なので、
+        どちらで生成しても同じ合法手が同じ順に並ぶ。
+    """
+    CALL_COUNTS['generate_evasions'] += 1
+    side=pos.side
+    squares=pos.squares
+    turn=SIDE_NAMES[side]
+    king=pos.kings[side]
+    checkers=_checkers(pos,side)
+    # 玉以外の駒が動ける先（王手をかけている駒のマスと合駒のマス）
+    blocks=set()
+    interpose=()
+    if len(checkers)==1:
+        src,between=checkers[0]
+        blocks.add(src)
+        blocks.update(between)
+        interpose=sorted(between)
+    n=0
+    
+    # 1. 盤上の駒を動かす手
+    for sq in range(81):
+        p=squares[sq]
+        if p and SIDE_OF[p]==side:
+            if sq!=king and not blocks:
+                continue
+            frm_code=sq<<MOVE_FROM_SHIFT
+            for to in _piece_targets(squares,sq,p,side):
+                if sq!=king and to not in blocks:
+                    continue
+                code=frm_code|to
+                undo=pos.do_move(code)
+                safe=not in_check(pos,side)
+                pos.undo_move(code,undo)
+                if not safe:
+                    continue
+                if p in PROMOTABLE_PIECES and (
+                        (SQ_RANK[sq]<=3 or SQ_RANK[to]<=3) if side==SENTE
+                        else (SQ_RANK[sq]>=7 or SQ_RANK[to]>=7)):
+                    code|=MOVE_PROMOTE
+                _push_move(buf,n,code); n+=1
+    
+    # 2. 合駒を打つ手
+    hand=pos.hands[side]
+    if interpose and any(hand.values()):
+        pawn='p' if side==SENTE else 'P'
+        pawn_files={SQ_FILE[sq] for sq in range(81) if squares[sq]==pawn}
+        for piece,count in list(hand.items()):
+            if not count: continue
+            drop_code=DROP_INDEX[piece.upper()]<<MOVE_DROP_SHIFT
+            if piece.islower():
+                drop_code|=MOVE_DROP_LOWER
+            is_pawn=piece.lower()=='p'
+            for to in interpose:
+                if is_pawn and SQ_FILE[to] in pawn_files: continue
+                if is_dead_drop(piece,SQ_RANK[to],turn): continue
+                if is_pawn and _is_uchifuzume_pos(pos,to): continue
+                code=drop_code|to
+                undo=pos.do_move(code)
+                safe=not in_check(pos,side)
+                pos.undo_move(code,undo)
+                if safe:
+                    _push_move(buf,n,code); n+=1
+    return n
+
+# ============================================================
+# 種類ごとの合法手の生成（駒を取る手・王手・それ以外）
+# ============================================================
+# generate_captures・generate_checks・generate_quiets の3つで、
+# generate_legal_moves の合法手をちょうど分け合う（重なりも漏れもない）。
+#   駒を取る手: 移動先に相手の駒がある手（王手になる駒取りもここ）
+#   王手: 駒を取らずに相手の玉に王手をかける手（打つ手を含む）
+#   それ以外: 駒を取らず、王手にもならない手
+# 理由: 駒の取り合いだけを読む探索・詰将棋・SEE での並べ替えは、合法手の一部しか
+#       使わない。全合法手（空きマスすべてへの打つ手を含む）を作ってから捨てるかわりに、
+#       必要な種類の手だけを作る。
+_GEN_CAPTURES, _GEN_CHECKS, _GEN_QUIETS = 0, 1, 2
+
+def _check_squares(squares, q, ek):
+    """
+    駒 q をそこに置けば、ek のマスの玉に王手がかかるマスの集合（今の盤面での利き）
+
+    実装の理由:
+        玉のマスから逆向きに is_attacked と同じ表をたどる。1マス動く駒は
+        STEP_ATTACKERS の移動元、長距離の駒は玉から各方向に最初の駒までのマス
+        （その駒のマスも含める。そこの駒を取って王手をかける手のため）。
+    """
+    side = SIDE_OF[q]
+    result = {src for src, p in STEP_ATTACKERS[side][ek] if p == q}
+    for ray, sliders in ATTACK_RAYS[side][ek]:
+        if q in sliders:
+            for t in ray:
+                result.add(t)
+                if squares[t]:
+                    break
+    return result
+
+def _discovered_check_blockers(squares, side, ek):
+    """
+    動くと side 側の長距離の駒の利きが ek の玉に通る（開き王手になる）side 側の駒のマス
+
+    実装の理由:
+        玉から各方向に見て、最初の駒が自分の駒で、その次の駒がその方向から
+        利く自分の長距離の駒なら、最初の駒は利きをさえぎっている。
+    """
+    blockers = set()
+    for ray, sliders in ATTACK_RAYS[side][ek]:
+        first = None
+        for t in ray:
+            q = squares[t]
+            if not q:
+                continue
+            if first is None:
+                if SIDE_OF[q] != side:
+                    break
+                first = t
+            else:
+                if q in sliders:
+                    blockers.add(first)
+                break
+    return blockers
+
+def _generate_kind(pos, buf, kind, with_captures=False):
+    """
+    generate_captures・generate_checks・generate_quiets の本体
+
+    Args:
+        kind: _GEN_CAPTURES / _GEN_CHECKS / _GEN_QUIETS
+        with_captures: kind が _GEN_CHECKS のとき、駒を取る王手も含めるか
+
+    Returns:
+        int: 書き込んだ合法手の数
+
+    実装の理由:
+        王手をかけられているときは、王手を受ける手（少ない）を generate_evasions で
+        作ってから、1手ずつ指して種類を調べる。
+        そうでなければ generate_legal_moves と同じ順に調べるが、種類の違う手は
+        自殺手の確認（do_move/undo_move）の前に捨てる。王手になるかは、
+        開き王手になりうる駒（_discovered_check_blockers）は指して確かめ、
+        それ以外の駒は動いた先（成るなら成った駒）が _check_squares に入るかで決まる
+        （動いた駒の元のマスが空いても、その駒自身の利きが新しく玉に通ることはない）。
+        王手をかけられていなければ、打つ手で自玉が王手になることはないので、
+        打つ手の自殺手の確認はしない。
+    """
+    side=pos.side
+    squares=pos.squares
+    n=0
+    if in_check(pos):
+        total=generate_evasions(pos,buf)
+        for i in range(total):
+            code=buf[i]
+            capture=not code&MOVE_DROP_MASK and bool(squares[code&MOVE_TO_MASK])
+            if kind==_GEN_CAPTURES:
+                keep=capture
+            elif capture and not with_captures:
+                keep=False
+            else:
+                undo=pos.do_move(code)
+                check=in_check(pos)
+                pos.undo_move(code,undo)
+                keep=check if kind==_GEN_CHECKS else not check
+            if keep:
+                buf[n]=code; n+=1
+        return n
+
+    turn=SIDE_NAMES[side]
+    ek=pos.kings[side^1]
+    need_check=kind!=_GEN_CAPTURES and ek>=0
+    blockers=_discovered_check_blockers(squares,side,ek) if need_check else ()
+    direct={}
+
+    # 1. 盤上の駒を動かす手
+    for sq in range(81):
+        p=squares[sq]
+        if p and SIDE_OF[p]==side:
+            frm_code=sq<<MOVE_FROM_SHIFT
+            discover=sq in blockers
+            for to in _piece_targets(squares,sq,p,side):
+                capture=bool(squares[to])
+                if kind==_GEN_CAPTURES:
+                    if not capture: continue
+                elif capture and (kind==_GEN_QUIETS or not with_captures):
+                    continue
+                promote=p in PROMOTABLE_PIECES and (
+                    (SQ_RANK[sq]<=3 or SQ_RANK[to]<=3) if side==SENTE
+                    else (SQ_RANK[sq]>=7 or SQ_RANK[to]>=7))
+                check=None
+                if need_check and not discover:
+                    q=PROMOTION_MAP[p] if promote else p
+                    targets=direct.get(q)
+                    if targets is None:
+                        targets=direct[q]=_check_squares(squares,q,ek)
+                    check=to in targets
+                    if check!=(kind==_GEN_CHECKS) and kind!=_GEN_CAPTURES:
+                        continue
+                code=frm_code|to
+                undo=pos.do_move(code)
+                safe=not in_check(pos,side)
+                if safe and discover:
+                    check=in_check(pos,side^1)
+                pos.undo_move(code,undo)
+                if not safe:
+                    continue
+                if kind==_GEN_CHECKS and not check:
+                    continue
+                if kind==_GEN_QUIETS and check:
+                    continue
+                if promote:
+                    code|=MOVE_PROMOTE
+                _push_move(buf,n,code); n+=1
+
+    # 2. 持ち駒を打つ手（駒を取ることはない）
+    hand=pos.hands[side]
+    if kind==_GEN_CAPTURES or not any(hand.values()):
+        return n
+    if kind==_GEN_CHECKS and not need_check:
+        return n
+    pawn='p' if side==SENTE else 'P'
+    pawn_files={SQ_FILE[sq] for sq in range(81) if squares[sq]==pawn}
+    for piece,count in list(hand.items()):
+        if not count: continue
+        drop_code=DROP_INDEX[piece.upper()]<<MOVE_DROP_SHIFT
+        if piece.islower():
+            drop_code|=MOVE_DROP_LOWER
+        is_pawn=piece.lower()=='p'
+        q=piece.lower() if side==SENTE else piece.upper()
+        targets=()
+        if need_check:
+            targets=direct.get(q)
+            if targets is None:
+                targets=direct[q]=_check_squares(squares,q,ek)
+        if kind==_GEN_CHECKS:
+            candidates=sorted(to for to in targets if not squares[to])
+        else:
+            candidates=[to for to in range(81) if not squares[to] and to not in targets]
+        for to in candidates:
+            if is_pawn and SQ_FILE[to] in pawn_files: continue
+            if is_dead_drop(piece,SQ_RANK[to],turn): continue
+            # 打ち歩詰めは王手になる歩を打つ手だけに起こる
+            if is_pawn and kind==_GEN_CHECKS and _is_uchifuzume_pos(pos,to): continue
+            _push_move(buf,n,drop_code|to); n+=1
+    return n
+
+def generate_captures(pos, buf):
+    """
+    駒を取る合法手だけを整数エンコードで指し手バッファに書き込む
+
+    Args:
+        pos: 局面（Position）
+        buf: 書き込み先の array('I')
+
+    Returns:
+        int: 書き込んだ合法手の数（並びは generate_legal_moves の中での順番のまま）
+
+    実装の理由:
+        駒の取り合いだけを読む探索や SEE での並べ替えのため。
+        打つ手は駒を取らないので、持ち駒があっても空きマスを調べない。
+    """
+    CALL_COUNTS['generate_captures'] += 1
+    return _generate_kind(pos,buf,_GEN_CAPTURES)
+
+def generate_checks(pos, buf, captures=False):
+    """
+    王手になる合法手だけを整数エンコードで指し手バッファに書き込む
+
+    Args:
+        pos: 局面（Position）
+        buf: 書き込み先の array('I')
+        captures: True なら駒を取る王手も含める（詰将棋用。generate_captures と重なる）
+
+    Returns:
+        int: 書き込んだ合法手の数（並びは generate_legal_moves の中での順番のまま）
+
+    実装の理由:
+        打つ手は、相手の玉のマスから逆向きに利きをたどった「置けば王手になるマス」だけを
+        調べる（全81マスに打ってみて王手になるか調べることはしない）。
+        盤上の駒を動かす手も、開き王手になりうる駒以外は動いた先のマスだけで判定する。
+    """
+    CALL_COUNTS['generate_checks'] += 1
+    return _generate_kind(pos,buf,_GEN_CHECKS,captures)
+
+def generate_quiets(pos, buf):
+    """
+    駒を取らず王手にもならない合法手だけを整数エンコードで指し手バッファに書き込む
+
+    Args:
+        pos: 局面（Position）
+        buf: 書き込み先の array('I')
+
+    Returns:
+        int: 書き込んだ合法手の数（並びは generate_legal_moves の中での順番のまま）
+    """
+    CALL_COUNTS['generate_quiets'] += 1
+    return _generate_kind(pos,buf,_GEN_QUIETS)
+
+def generate_legal_moves_into(board, hands, turn, buf):
+    """
+    従来の (board, hands, turn) 形式で generate_legal_moves を呼ぶアダプタ
+    
+    Returns:
+        int: 書き込んだ合法手の数
+    """
+    return generate_legal_moves(_to_position(board,hands,turn),buf)
+
+def get_all_legal_moves(board, hands=None, turn=None):
+    """
+    すべての合法手を生成（盤上の駒の移動 + 持ち駒を打つ手）
+    
+    Args:
+        board: 盤面（または Position。その場合 hands・turn は不要）
+        hands: 持ち駒
+        turn: 'sente' または 'gote'
+    
+    Returns:
+        list: 合法手のリスト [('move', 元, 先), ('drop', 駒, 位置), ...]
+    
+    実装の理由:
+        AIが次の手を選ぶためには、すべての合法手を知る必要がある。
+        特殊ルール（王手回避、二歩、打ち歩詰め等）でフィルタリング。
+        生成は generate_legal_moves に任せ、タプル形式に変換して返す
+        （王手をかけられているときは王手を受ける手だけを生成する）。
+    """
+    buf=_scratch_buffer
+    n=generate_legal_moves(_to_position(board,hands,turn),buf)
+    return [decode_move(buf[i]) for i in range(n)]
+
+# get_all_legal_moves 用の作業バッファ（探索のplyごとのバッファとは別）
+_scratch_buffer = array('I', [0]) * MAX_MOVES
 
 # ============================================================
 # AI評価関数（E1-E7: 局面の良し悪しを数値化）
 # ============================================================
 
-def evaluate_board(board, turn):
+def evaluate_board(board, turn=None):
     """
     盤面の評価値を計算（AIが局面を判断するための数値）
     
     Args:
-        board: 盤面
-        turn: 'sente' または 'gote'（評価する側）
+        board: 盤面（または Position）
+        turn: 'sente' または 'gote'（評価する側。Position なら省略時は手番側）
     
     Returns:
         int: 評価値（正の値が有利、負の値が不利）
@@ -645,66 +1925,266 @@ def evaluate_board(board, turn):
         AIが「どちらが有利か」を判断するために、盤面を数値化する。
         複数の要素を組み合わせて総合評価する。
     """
+    CALL_COUNTS['evaluate_board']+=1
+    # 盤面辞書なら評価に使わないハッシュは計算しない
+    pos=_to_position(board,None,turn,with_hash=False)
+    side=pos.side if turn is None else (SENTE if turn=='sente' else GOTE)
+    return _evaluate_position(pos,side)
+
+def _evaluate_position(pos, side):
+    """
+    evaluate_board の本体（Position と評価する側 SENTE/GOTE を受け取る）
+    """
+    CALL_COUNTS['evaluate_position']+=1
+    squares=pos.squares
+    opp=side^1
     score=0
     
     # E1-E5: 基本的な駒の価値
     # 理由: 駒の数と質が局面評価の基本。強い駒を多く持つほど有利。
-    for p in board.values():
-        v=PIECE_VALUES[p]
-        score+=v if (turn=='sente' and is_sente(p)) or (turn=='gote' and is_gote(p)) else -v
+    # E7: 駒の働き（相手陣への近さと中央配置のボーナス）
+    # 理由: 攻撃的な配置を評価。敵陣に近い駒や中央の駒は活躍しやすい。
+    for sq in range(81):
+        p=squares[sq]
+        if not p: continue
+        if SIDE_OF[p]!=side:
+            score-=PIECE_VALUES[p]
+            continue
+        score+=PIECE_VALUES[p]
+        # 相手陣に近いほどボーナス（玉以外）
+        # 先手は1段に近いほど良い、後手は9段に近いほど良い
+        if p!='k' and p!='K':
+            score+=(10-SQ_RANK[sq])*2 if side==SENTE else SQ_RANK[sq]*2
+        # 中央（5筋付近）にいる駒にボーナス
+        score+=max(0,3-abs(SQ_FILE[sq]-5))*5
     
     # E6: 玉の安全度（自玉の周囲8マスが攻撃されているかをチェック）
     # 理由: 王が危険な状態は大きなマイナス。守りの評価を追加。
-    king_pos = find_king(board, turn)
-    if king_pos:
-        safety_bonus = 0
-        for dr, df in [(-1,0),(1,0),(0,-1),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)]:
-            nr, nf = king_pos[0] + dr, king_pos[1] + df
-            if is_valid(nr, nf):
-                piece = get_piece(board, nr, nf)
-                # 自分の駒で守られている場合ボーナス
-                if piece and ((turn == 'sente' and is_sente(piece)) or (turn == 'gote' and is_gote(piece))):
-                    safety_bonus += 10
-                
-                # 相手の駒に攻撃されている場合ペナルティ
-                opp = 'gote' if turn == 'sente' else 'sente'
-                for (r,f), p in board.items():
-                    if (opp == 'sente' and is_sente(p)) or (opp == 'gote' and is_gote(p)):
-                        if (nr, nf) in get_legal_moves(board, r, f, opp):
-                            safety_bonus -= 15
-                            break
-        score += safety_bonus
-    
-    # E7: 駒の働き（相手陣への近さと中央配置のボーナス）
-    # 理由: 攻撃的な配置を評価。敵陣に近い駒や中央の駒は活躍しやすい。
-    for (r, f), p in board.items():
-        if (turn == 'sente' and is_sente(p)) or (turn == 'gote' and is_gote(p)):
-            # 相手陣に近いほどボーナス（玉以外）
-            if p.lower() != 'k':
-                if turn == 'sente':
-                    # 先手は1段に近いほど良い
-                    score += (10 - r) * 2
-                else:
-                    # 後手は9段に近いほど良い
-                    score += (r - 0) * 2
-            
-            # 中央（5筋付近）にいる駒にボーナス
-            # 理由: 中央の駒は左右どちらにも動きやすく、活用しやすい
-            center_bonus = max(0, 3 - abs(f - 5))
-            score += center_bonus * 5
+    kp=pos.kings[side]
+    if kp>=0:
+        safety_bonus=0
+        for t in STEP_TARGETS['k'][kp]:
+            q=squares[t]
+            # 自分の駒で守られている場合ボーナス
+            if q and SIDE_OF[q]==side:
+                safety_bonus+=10
+            # 相手の駒に攻撃されている場合ペナルティ
+            # （相手の駒が乗っているマスには相手は動けないので対象外）
+            if (not q or SIDE_OF[q]!=opp) and is_attacked(pos,t,opp):
+                safety_bonus-=15
+        score+=safety_bonus
     
     return score
 
+# ============================================================
+# 評価関数の差し替え
+# ============================================================
+# 探索の末端で使う評価関数を、evaluate_board 以外（NNUEなど）に差し替えられるようにする。
+# 理由: 評価関数だけを取り替えて強さ・速さを比べられるようにするため
+
+class Evaluator:
+    """
+    評価関数の共通インターフェース
+    
+    属性:
+        name: 評価関数の名前（表示用）
+        incremental: 差分更新する評価関数ならTrue（探索が reset/push を呼ぶ）
+    
+    実装の理由:
+        差分更新しない評価関数は evaluate だけを実装すればよい。
+        差分更新する評価関数（NNUEの累積器など）のために、探索は
+        開始時に reset(局面) を、探索木で1手進めるたびに push(局面, 指し手, 復元情報) を呼ぶ。
+        戻すときは何も呼ばない（局面の手数で、どの段の情報を使うかを決めるため）。
+    """
+    name = 'evaluator'
+    incremental = False
+
+    def evaluate(self, pos, side):
+        """局面 pos を side（SENTE/GOTE）から見た評価値（整数）"""
+        raise NotImplementedError
+
+    def reset(self, pos):
+        """探索の開始時に、ルート局面を受け取る"""
+
+    def push(self, pos, code, undo):
+        """pos.do_move(code) の直後に呼ばれる（undo は do_move の戻り値）"""
+
+class HandcraftedEvaluator(Evaluator):
+    """従来の評価関数（evaluate_board と同じ E1-E7）"""
+    name = 'handcrafted'
+
+    def evaluate(self, pos, side):
+        return _evaluate_position(pos, side)
+
+# 探索で使う評価関数（Noneなら従来の評価関数）
+_evaluator = None
+# 探索の末端で呼ぶ関数と、差分更新する評価関数（しないならNone）
+# 理由: 従来の評価関数のときは、メソッド呼び出しや判定を挟まずに直接呼ぶ
+_leaf_eval = _evaluate_position
+_incremental = None
+
+def set_evaluator(evaluator):
+    """
+    探索で使う評価関数を差し替える
+    
+    Args:
+        evaluator: Evaluator（Noneなら従来の評価関数に戻す）
+    
+    Returns:
+        それまで使っていた評価関数（元に戻すときに渡す）
+    """
+    global _evaluator, _leaf_eval, _incremental
+    previous = _evaluator
+    _evaluator = evaluator
+    if evaluator is None or isinstance(evaluator, HandcraftedEvaluator):
+        _leaf_eval = _evaluate_position
+        _incremental = None
+    else:
+        _leaf_eval = evaluator.evaluate
+        _incremental = evaluator if evaluator.incremental else None
+    return previous
+
+def get_evaluator():
+    """探索で使っている評価関数（Noneなら従来の評価関数）"""
+    return _evaluator
+
+def _start_evaluator(pos):
+    """探索の開始時に、差分更新する評価関数へルート局面を渡す"""
+    if _incremental is not None:
+        _incremental.reset(pos)
+
+# ============================================================
+# 持ち時間の管理
+# ============================================================
+
+# 1局の先後それぞれの手数の目安（残り手数の見積もりに使う）
+EXPECTED_MOVES_PER_SIDE = 60
+MIN_MOVES_LEFT = 15
+# 硬い上限は柔らかい上限の何倍まで許すか
+HARD_LIMIT_RATIO = 4.0
+# 経過時間が柔らかい上限のこの割合を超えたら、次の反復は始めない
+# （次の深さは、それまでの合計より長くかかることが多いため）
+NEXT_ITERATION_RATIO = 0.5
+# 同じ偶奇の深さでこれ以上評価値が動いたら「不安定」とみなす
+SCORE_INSTABILITY = 200
+# 持ち時間で指すときの最大深さ（実際は時間で打ち切られる）
+MAX_CLOCK_DEPTH = 20
+
+class TimeManager:
+    """
+    持ち時間・秒読み・加算（フィッシャー）を管理し、1手に使う時間を決める
+    
+    Args:
+        main_time: 持ち時間（秒）。数値なら先後同じ、{'sente': 秒, 'gote': 秒} でも可
+        byoyomi: 秒読み（秒）。持ち時間を使い切った後、1手ごとに使える時間
+        increment: 1手指すごとに持ち時間に加算される秒数
+        overhead: 通信や表示などで失う時間の見込み（秒）
+    
+    実装の理由:
+        1手ごとに「柔らかい上限（soft）」と「硬い上限（hard）」を決める。
+        soft は反復深化で次の深さを始めるかの判断に使い、
+        hard を過ぎたら探索を打ち切る（時間切れ負けを防ぐ）。
+        最善手が反復ごとに変わる・評価値が大きく動くときは soft を延ばし、
+        安定しているときは縮めて、持ち時間を必要な局面に回す。
+    """
+
+    def __init__(self, main_time, byoyomi=0.0, increment=0.0, overhead=0.05):
+        if not isinstance(main_time, dict):
+            main_time = {'sente': main_time, 'gote': main_time}
+        self.remaining = {'sente': float(main_time['sente']), 'gote': float(main_time['gote'])}
+        self.byoyomi = float(byoyomi)
+        self.increment = float(increment)
+        self.overhead = overhead
+        self.flagged = {'sente': False, 'gote': False}  # 時間切れになった側
+        self.turn = None
+        self.start = None
+        self.soft = self.hard = 0.0
+        self._base = 0.0
+        self._scores = {}
+        self._last_move = None
+
+    def start_move(self, turn, move_number=0):
+        """
+        1手の思考を始める（soft/hard の上限を決める）
+        
+        Args:
+            turn: 'sente' または 'gote'
+            move_number: 対局開始からの手数（残り手数の見積もりに使う）
+        """
+        self.turn = turn
+        self.start = time.monotonic()
+        rem = self.remaining[turn]
+        moves_left = max(MIN_MOVES_LEFT, EXPECTED_MOVES_PER_SIDE - move_number // 2)
+        # 使い切ると負けになる限界（持ち時間+秒読み）
+        max_time = max(0.01, rem + self.byoyomi - self.overhead)
+        self._base = rem / moves_left + self.byoyomi * 0.9 + self.increment * 0.75
+        self.hard = max(0.01, min(max_time, self._base * HARD_LIMIT_RATIO,
+                                  rem * 0.25 + self.byoyomi - self.overhead))
+        self.soft = min(self._base, self.hard)
+        self._scores = {}
+        self._last_move = None
+
+    def elapsed(self):
+        """この手の思考を始めてからの経過秒数"""
+        return time.monotonic() - self.start
+
+    def deadline(self):
+        """探索を打ち切る時刻（time.monotonic() の値）"""
+        return self.start + self.hard
+
+    def on_iteration(self, depth, score, move):
+        """
+        反復深化の1反復が終わるたびに呼び、soft を調整する
+        
+        Args:
+            depth: 読み切った深さ
+            score: その深さの評価値
+            move: その深さの最善手
+        """
+        scale = self.soft / self._base if self._base else 1.0
+        if self._last_move is not None and move != self._last_move:
+            scale *= 1.4   # 最善手が変わった: もっと読む
+        elif self._last_move is not None:
+            scale *= 0.9   # 最善手が安定: 早めに切り上げる
+        prev = self._scores.get(depth - 2)  # 評価値は深さの偶奇で傾向が変わるので2つ前と比べる
+        if prev is not None and abs(score - prev) > SCORE_INSTABILITY:
+            scale *= 1.2
+        self._scores[depth] = score
+        self._last_move = move
+        self.soft = min(self.hard, self._base * max(0.3, scale))
+
+    def should_stop(self):
+        """次の深さの反復を始めずに探索をやめるべきか"""
+        return self.elapsed() >= self.soft * NEXT_ITERATION_RATIO
+
+    def finish_move(self, turn=None):
+        """
+        1手指し終えたときに呼び、消費時間を持ち時間から引く
+        
+        Returns:
+            bool: 時間内に指せていればTrue（時間切れならFalse）
+        """
+        turn = turn or self.turn
+        used = self.elapsed()
+        rem = self.remaining[turn] - used
+        if rem < 0:
+            # 持ち時間を超えた分は秒読みの範囲内なら許される
+            if -rem > self.byoyomi:
+                self.flagged[turn] = True
+            rem = 0.0
+        self.remaining[turn] = rem + self.increment
+        return not self.flagged[turn]
+
 # ============================================================
 # AIアルゴリズム（A1-A3: ミニマックス法+αβ枝刈り）
 # ============================================================
 
-def minimax(board, hands, depth, alpha, beta, maxi, turn):
+def minimax(board, hands, depth, alpha, beta, maxi, turn=None):
     """
     ミニマックス法+αβ枝刈りで最善手を探索（A1, A3）
     
     Args:
-        board: 盤面
+        board: 盤面（または Position。その場合 hands・turn は使わない）
         hands: 持ち駒
         depth: 探索する深さ（残り手数）
         alpha: αβ枝刈り用のα値
@@ -720,59 +2200,677 @@ def minimax(board, hands, depth, alpha, beta, maxi, turn):
                        最適な手を見つけるアルゴリズム
         αβ枝刈り: 探索の無駄を省き、より深く読めるようにする最適化技術
                   これにより約√b倍の効率化（bは平均合法手数）
+        探索は Position を do_move/undo_move で書き換えながら行う
+        （渡された Position は複製してから使うので変更されない）。
+        指し手は整数で扱い、最善手だけをタプルに戻して返す。
+    """
+    if isinstance(board,Position):
+        pos=board.copy()
+    else:
+        pos=Position.from_board(board,hands,turn)
+    _start_evaluator(pos)
+    val,best=_minimax(pos,depth,alpha,beta,maxi,0)
+    return val,(decode_move(best) if best is not None else None)
+
+# 探索の統計（ai_choose_move の呼び出しごとにリセット）
+SEARCH_STATS = {
+    'nodes': 0,                 # 探索した局面数
+    'pvs_researches': 0,        # PVSのnull window探索がfail-highして再探索した回数
+    'aspiration_fail_low': 0,   # aspiration windowの下限を割って広げ直した回数
+    'aspiration_fail_high': 0,  # aspiration windowの上限を超えて広げ直した回数
+    'see_pruned': 0,            # 浅いノードで読まなかった、取り合いで損をする駒取りの数
+    'futility_pruned': 0,       # futility pruning で読まなかった手の数
+    'razored': 0,               # razoring で浅い探索の結果を返して打ち切ったノードの数
+}
+
+# aspiration windowの初期の半幅（評価値の単位）
+# 前の反復の評価値を中心にするので、深さの偶奇による値の揺れが収まる幅にする
+ASPIRATION_WINDOW = 200
+
+# 時間・停止要求の探索制限を確認する間隔（この値+1ノードごと。2のべき乗-1）
+# ノード数の上限は _node_limit で毎ノード確認する
+LIMIT_CHECK_MASK = 255
+
+class SearchAborted(Exception):
+    """探索制限（ノード数・時間・停止要求）に達して探索を打ち切ったことを表す例外"""
+
+# 実行中の探索の制限 (最大ノード数, 打ち切り時刻, 停止要求の関数)。制限なしならNone
+_search_limits = None
+# 実行中の探索のノード数の上限（なければNone）
+_node_limit = None
+
+# 読み筋（PV: Principal Variation）の表
+# _pv_table[ply] はそのplyの局面から最善と読んだ手順（整数の指し手のタプル）
+# 理由: 各局面で最善手が更新されたとき、子局面の読み筋の前に自分の手を付けるだけで
+#       ルートの読み筋が組み上がる（三角PV表）
+_pv_table = []
+
+# ============================================================
+# 探索の表（置換表・キラー手・ヒストリー）
+# ============================================================
+# 置換表の値の種類（fail-soft の αβ で得た値が、真の値とどういう関係か）
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+# 置換表に入れる局面数の上限（超えたら空にして入れ直す）
+DEFAULT_TT_ENTRIES = 1 << 18
+# ヒストリーと置換表の手の順番を使う最小の深さ（浅いノードでは並べ替えの手間の方が大きい）
+HISTORY_MIN_DEPTH = 2
+# 残りの深さがこれ以下のノードでは、SEE が負の駒取り（取り返されて損をする手）を読まない
+SEE_PRUNE_DEPTH = 2
+# 末端に近いノードの枝刈りの幅の既定値（残りの深さ -> 評価値の幅。空の辞書にするとその枝刈りをしない）
+# 探索ごとに変えるときは search・SearchTables・Engine の引数で渡す
+# futility pruning: 静的評価値に幅を足しても窓に届かなければ、駒を取らない手（打つ手を含む）を読まない
+FUTILITY_MARGINS = {1: 200, 2: 500}
+# razoring: 静的評価値に幅を足しても窓に届かず、駒の取り合いを読んでも届かなければ、そこで打ち切る
+RAZOR_MARGINS = {2: 600, 3: 900}
+# 探索で枝刈り（SEE で損をする駒取り・futility pruning・razoring）をするか（analyze の間だけ止める）
+_pruning = True
+
+class SearchTables:
+    """
+    探索中に覚えておく表
+    
+    属性:
+        tt: 置換表 ハッシュ -> (深さ, 最大化側か, 値の種類, 評価値, 最善手)
+        killers: ply ごとに、最近βカットを起こした駒を取らない手（2つまで）
+        history: 指し手 -> βカットを起こした深さの2乗の合計
+        max_entries: 置換表に入れる局面数の上限
+        futility_margins: futility pruning の幅（残りの深さ -> 評価値の幅）
+        razor_margins: razoring の幅（残りの深さ -> 評価値の幅）
+    
+    実装の理由:
+        評価値は「局面・残りの深さ・最大化側か」だけで決まるので、
+        同じ3つの組の結果は置換表からそのまま使える（値の種類に応じて枝刈りする）。
+        深さが違う結果は、その局面での最善手を最初に読む手の順番にだけ使う。
+        キラー手・ヒストリーは、ほかの局面でβカットを起こした手を先に読むための表。
+        search は呼ぶたびに新しい表を使う。Engine は同じ表を次の手の探索にも使い回す。
+        枝刈りの幅も探索ごとの設定なので、置換表の大きさと一緒にここで持つ
+        （幅を省略すると、作ったときの FUTILITY_MARGINS・RAZOR_MARGINS を写して使う）。
+    """
+    __slots__ = ('tt', 'killers', 'history', 'max_entries', 'futility_margins', 'razor_margins')
+
+    def __init__(self, max_entries=DEFAULT_TT_ENTRIES, futility_margins=None, razor_margins=None):
+        self.tt = {}
+        self.killers = []
+        self.history = {}
+        self.max_entries = max_entries
+        self.futility_margins = dict(FUTILITY_MARGINS if futility_margins is None else futility_margins)
+        self.razor_margins = dict(RAZOR_MARGINS if razor_margins is None else razor_margins)
+
+    def clear(self):
+        """すべての表を空にする（新しい対局を始めるとき）"""
+        self.tt.clear()
+        self.killers.clear()
+        self.history.clear()
+
+    def age(self, plies=0):
+        """
+        次の手の探索の前に表を古くする
+        
+        Args:
+            plies: 前の探索のルートから何手進んだか（キラー手の ply をずらす。0ならキラー手は捨てる）
+        """
+        if plies:
+            del self.killers[:plies]
+        else:
+            self.killers.clear()
+        # ヒストリーは捨てる（2手前のルートで多かった手は、今の局面では
+        # 良い手とは限らず、残すとかえって読む局面が増える）
+        self.history.clear()
+
+# 実行中の探索が使う表（_use_tables で切り替える）
+_tt = None
+_tt_max = DEFAULT_TT_ENTRIES
+_killers = []
+_history = {}
+_futility_margins = FUTILITY_MARGINS
+_razor_margins = RAZOR_MARGINS
+
+def _use_tables(tables):
+    """探索で使う表を切り替える（None なら置換表なし）"""
+    global _tt, _tt_max, _killers, _history, _futility_margins, _razor_margins
+    if tables is None:
+        _tt, _killers, _history = None, [], {}
+        _futility_margins, _razor_margins = FUTILITY_MARGINS, RAZOR_MARGINS
+    else:
+        _tt, _tt_max, _killers, _history = tables.tt, tables.max_entries, tables.killers, tables.history
+        _futility_margins, _razor_margins = tables.futility_margins, tables.razor_margins
+
+def _order_moves(pos, buf, n, ply, depth, hash_move):
+    """
+    置換表の手・駒を取る手・キラー手・ヒストリーの順に並べ替える
+    
+    Returns:
+        int: 取り合いで損をする駒取り（末尾にまとめる）の最初の位置（なければ n）
+    
+    実装の理由:
+        置換表の手（前の反復や前の手の探索で最善だった手）を最初に、
+        次に SEE が負でない駒取りを駒得の大きい順に、その次にキラー手を読む。
+        深いノードでは残りの手をヒストリーの多い順に並べる（同じ値なら生成順のまま）。
+        SEE が負の駒取りは最後に回す。枝刈りするノードでは、置換表の手でも
+        損をする駒取りなら最後に回し、枝刈りする手が手の順番で変わらないようにする。
+        駒を取る手がなければ、並べ替えずに先頭の数手だけを入れ替える
+        （浅いノードは手の数に比べて子の探索が軽い）。
+    """
+    squares=pos.squares
+    moves=buf[:n]
+    caps=[m for m in moves if squares[m & MOVE_TO_MASK]]
+    if caps:
+        scored=sorted([(see(pos,m),m) for m in caps],key=itemgetter(0),reverse=True)
+        good=[m for v,m in scored if v>=0]
+        bad=[m for v,m in scored if v<0]
+        if hash_move is not None and hash_move in bad and depth>SEE_PRUNE_DEPTH:
+            bad.remove(hash_move)
+        head=[hash_move] if hash_move is not None and hash_move in moves and hash_move not in bad else []
+        head+=[m for m in good if m!=hash_move]
+        if ply<len(_killers):
+            head+=[k for k in _killers[ply] if k!=hash_move and k in moves and k not in caps]
+        taken=set(head)
+        taken.update(bad)
+        rest=[m for m in moves if m not in taken]
+        if depth>=HISTORY_MIN_DEPTH and _history and len(rest)>1:
+            get=_history.get
+            rest.sort(key=lambda m: -get(m,0))
+        buf[0:n]=array('I',head+rest+bad)
+        return n-len(bad)
+    front=0
+    if hash_move is not None:
+        try:
+            i=buf.index(hash_move,0,n)
+        except ValueError:
+            pass
+        else:
+            buf[1:i+1]=buf[0:i]
+            buf[0]=hash_move
+            front=1
+    if ply<len(_killers):
+        for k in _killers[ply]:
+            if k==hash_move:
+                continue
+            try:
+                i=buf.index(k,front,n)
+            except ValueError:
+                continue
+            buf[front+1:i+1]=buf[front:i]
+            buf[front]=k
+            front+=1
+    if depth>=HISTORY_MIN_DEPTH and _history and n-front>1:
+        get=_history.get
+        buf[front:n]=array('I',sorted(buf[front:n],key=lambda m: -get(m,0)))
+    return n
+
+def _record_cutoff(pos, m, ply, depth):
+    """βカットを起こした手をキラー手・ヒストリーに記録する（駒を取る手は除く）"""
+    if pos.squares[m & MOVE_TO_MASK] is not None:
+        return
+    while len(_killers)<=ply:
+        _killers.append([])
+    ks=_killers[ply]
+    if not ks or ks[0]!=m:
+        ks.insert(0,m)
+        del ks[2:]
+    _history[m]=_history.get(m,0)+depth*depth
+
+def _check_search_limits():
+    """探索制限に達していれば SearchAborted を送出する"""
+    max_nodes, deadline, stop = _search_limits
+    if max_nodes is not None and SEARCH_STATS['nodes'] >= max_nodes:
+        raise SearchAborted('nodes')
+    if deadline is not None and time.monotonic() >= deadline:
+        raise SearchAborted('time')
+    if stop is not None and stop():
+        raise SearchAborted('stop')
+
+def reset_search_stats():
+    """探索の統計を0に戻す"""
+    for k in SEARCH_STATS:
+        SEARCH_STATS[k] = 0
+
+def _minimax(pos, depth, alpha, beta, maxi, ply, first=None):
+    """
+    minimax の本体（PVS: Principal Variation Search）
+    
+    Args:
+        pos: 局面（探索中に書き換え、戻ったときには元に戻っている）
+        ply: ルートからの手数（指し手バッファの選択に使う）
+        first: 最初に探索する指し手（前回の反復の最善手など。なければNone）
+    
+    Returns:
+        tuple: (評価値, 最善手の整数エンコード)
+    
+    実装の理由:
+        最初の手だけを (alpha, beta) の窓で探索し、2手目以降は
+        「最初の手より良いか」だけを幅1の窓（null window）で調べる。
+        良い手が先に来ていれば2手目以降はすぐに枝刈りされる。
+        null windowで良いと分かった手だけ (alpha, beta) で再探索する。
+        評価値は整数なので幅1の窓で判定できる。
     """
+    # ノード数の上限は毎ノード確認する（整数の比較だけなので軽く、
+    # LIMIT_CHECK_MASK より小さい上限でも超えずに止まる）
+    if _node_limit is not None and SEARCH_STATS['nodes']>=_node_limit:
+        raise SearchAborted('nodes')
+    SEARCH_STATS['nodes']+=1
+    # 時間・停止要求は時計を読む・関数を呼ぶので、一定ノードごとにだけ確認する
+    if _search_limits is not None and not SEARCH_STATS['nodes'] & LIMIT_CHECK_MASK:
+        _check_search_limits()
     # 終端条件: 深さ0で評価値を返す
+    # （最大化側=ルートの手番側から見た値。詰みの値と同じ向きにそろえる）
     if depth==0:
-        return evaluate_board(board,turn),None
-    
-    # 合法手を生成
-    moves=get_all_legal_moves(board,hands,turn)
-    if not moves:
+        return _leaf_eval(pos,pos.side if maxi else pos.side^1),None
+    
+    try:
+        _pv_table[ply]=()
+    except IndexError:
+        _pv_table.extend([()]*(ply+1-len(_pv_table)))
+    # 置換表: 同じ深さ・同じ側の結果があれば使う（読み筋が要る窓の広いノードでは使わない）
+    tt=_tt
+    hash_move=None
+    if tt is not None:
+        entry=tt.get(pos.hash)
+        if entry is not None:
+            e_depth,e_maxi,flag,v,hash_move=entry
+            if e_depth==depth and e_maxi==maxi and ply and beta-alpha<=1 and (
+                    flag==TT_EXACT or (v>=beta if flag==TT_LOWER else v<=alpha)):
+                return v,hash_move
+    alpha0,beta0=alpha,beta
+    # 末端に近いノードで、静的評価値が窓から大きく外れていれば読む手を減らす
+    # （ルート・読み筋が要る窓の広いノード・王手をかけられている局面では行わない）
+    futile=None
+    if _pruning and ply and beta-alpha<=1 and (depth in _futility_margins or depth in _razor_margins) \
+            and not in_check(pos):
+        static=_leaf_eval(pos,pos.side if maxi else pos.side^1)
+        margin=_razor_margins.get(depth)
+        if margin is not None and (static+margin<=alpha if maxi else static-margin>=beta):
+            v=_quiesce(pos,alpha,beta,maxi,ply)
+            if v<=alpha if maxi else v>=beta:
+                SEARCH_STATS['razored']+=1
+                return v,None
+        margin=_futility_margins.get(depth)
+        if margin is not None:
+            bound=static+margin if maxi else static-margin
+            if bound<=alpha if maxi else bound>=beta:
+                futile=bound
+    
+    # 合法手をこのplyのバッファに生成
+    buf=get_move_buffer(ply)
+    n=generate_legal_moves(pos,buf)
+    if n==0:
         # 合法手がない場合、詰みまたはステイルメイト
         return (-1000000 if maxi else 1000000),None
+    bad_from=_order_moves(pos,buf,n,ply,depth,first if first is not None else hash_move)
+    # 浅いノードでは、取り合いで損をする駒取りを読まない
+    # （ルート・王手をかけられている局面では枝刈りせず、王手になる手も読む）
+    if bad_from<n and (not _pruning or depth>SEE_PRUNE_DEPTH or not ply or in_check(pos)):
+        bad_from=n
 
-    opp='gote' if turn=='sente' else 'sente'
+    squares=pos.squares
     best=None
 
     # 最大化プレイヤー（自分のターン）
     if maxi:
         val=-1e9
-        for m in moves:
-            # 手を実行して新しい盤面を作成
-            nb,nh = make_move(board,m[1],m[2],hands,turn=turn) if m[0]=='move' else drop_piece(board,hands,m[1],m[2],turn)
-            # 再帰的に評価
-            s,_=minimax(nb,nh,depth-1,alpha,beta,False,opp)
-            if s>val: val,best=s,m
+        for i in range(n):
+            m=buf[i]
+            # 手を指して再帰的に評価し、元に戻す
+            quiet=futile is not None and not squares[m & MOVE_TO_MASK] and not m & MOVE_PROMOTE
+            undo=pos.do_move(m)
+            if (quiet or i>=bad_from and i) and not in_check(pos):
+                pos.undo_move(m,undo)
+                if quiet:
+                    # 駒を取らない手では窓に届かない（値は見積もった上限）
+                    SEARCH_STATS['futility_pruned']+=1
+                    if futile>val:
+                        val=futile
+                else:
+                    SEARCH_STATS['see_pruned']+=1
+                continue
+            if _incremental is not None:
+                _incremental.push(pos,m,undo)
+            if i==0:
+                s,_=_minimax(pos,depth-1,alpha,beta,False,ply+1)
+            else:
+                # null window: alphaを超えるかだけを調べる
+                s,_=_minimax(pos,depth-1,alpha,alpha+1,False,ply+1)
+                if alpha<s<beta:
+                    SEARCH_STATS['pvs_researches']+=1
+                    s,_=_minimax(pos,depth-1,alpha,beta,False,ply+1)
+            pos.undo_move(m,undo)
+            if s>val:
+                val,best=s,m
+                _pv_table[ply]=(m,)+_pv_table[ply+1] if depth>1 else (m,)
             
             # αβ枝刈り
             alpha=max(alpha,s)
             if beta<=alpha: 
+                _record_cutoff(pos,m,ply,depth)
                 break  # これ以上探索しても無駄（相手がより良い手を選ぶため）
-        return val,best
     
     # 最小化プレイヤー（相手のターン）
     else:
         val=1e9
-        for m in moves:
-            nb,nh = make_move(board,m[1],m[2],hands,turn=turn) if m[0]=='move' else drop_piece(board,hands,m[1],m[2],turn)
-            s,_=minimax(nb,nh,depth-1,alpha,beta,True,opp)
-            if s<val: val,best=s,m
+        for i in range(n):
+            m=buf[i]
+            quiet=futile is not None and not squares[m & MOVE_TO_MASK] and not m & MOVE_PROMOTE
+            undo=pos.do_move(m)
+            if (quiet or i>=bad_from and i) and not in_check(pos):
+                pos.undo_move(m,undo)
+                if quiet:
+                    # 駒を取らない手では窓に届かない（値は見積もった下限）
+                    SEARCH_STATS['futility_pruned']+=1
+                    if futile<val:
+                        val=futile
+                else:
+                    SEARCH_STATS['see_pruned']+=1
+                continue
+            if _incremental is not None:
+                _incremental.push(pos,m,undo)
+            if i==0:
+                s,_=_minimax(pos,depth-1,alpha,beta,True,ply+1)
+            else:
+                # null window: betaを下回るかだけを調べる
+                s,_=_minimax(pos,depth-1,beta-1,beta,True,ply+1)
+                if alpha<s<beta:
+                    SEARCH_STATS['pvs_researches']+=1
+                    s,_=_minimax(pos,depth-1,alpha,beta,True,ply+1)
+            pos.undo_move(m,undo)
+            if s<val:
+                val,best=s,m
+                _pv_table[ply]=(m,)+_pv_table[ply+1] if depth>1 else (m,)
             
             # αβ枝刈り
             beta=min(beta,s)
             if beta<=alpha: 
+                _record_cutoff(pos,m,ply,depth)
                 break  # これ以上探索しても無駄
-        return val,best
+    
+    if tt is not None:
+        if len(tt)>=_tt_max:
+            tt.clear()
+        flag=TT_UPPER if val<=alpha0 else (TT_LOWER if val>=beta0 else TT_EXACT)
+        tt[pos.hash]=(depth,maxi,flag,val,best)
+    return val,best
 
-def ai_choose_move(board, hands, turn, depth=3):
+def _quiesce(pos, alpha, beta, maxi, ply):
+    """
+    駒を取る手だけを読む静止探索（razoring で打ち切ってよいかを確かめる）
+    
+    Args:
+        pos: 局面（探索中に書き換え、戻ったときには元に戻っている）
+        maxi: 手番側が最大化側か
+        ply: ルートからの手数（指し手バッファの選択に使う）
+    
+    Returns:
+        int: 最大化側から見た評価値（fail-soft: 窓の外なら真の値の上限・下限）
+    
+    実装の理由:
+        razoring は静的評価値が窓から大きく外れたノードで、駒を取り返して
+        窓に届く手がないかだけを確かめれば打ち切れる。手番側は駒を取らずに
+        止めてもよい（静的評価値で打ち切れる）ものとして、駒を取る手を
+        取り合いで得の大きい順に、損をしない手（SEE が0以上）だけ読む。
+        打つ手は読まないので、盤上の駒が減るたびに読む手も減り、必ず終わる。
+        途中で王手がかかった局面も静的評価値で止める（打ち切るかの判断だけに使う見積もり）。
+    """
+    if _node_limit is not None and SEARCH_STATS['nodes']>=_node_limit:
+        raise SearchAborted('nodes')
+    SEARCH_STATS['nodes']+=1
+    if _search_limits is not None and not SEARCH_STATS['nodes'] & LIMIT_CHECK_MASK:
+        _check_search_limits()
+    val=_leaf_eval(pos,pos.side if maxi else pos.side^1)
+    if val>=beta if maxi else val<=alpha:
+        return val
+    if maxi:
+        alpha=max(alpha,val)
+    else:
+        beta=min(beta,val)
+    buf=get_move_buffer(ply)
+    n=generate_captures(pos,buf)
+    gains=sorted(((see(pos,buf[i]),buf[i]) for i in range(n)),reverse=True)
+    for gain,m in gains:
+        if gain<0:
+            break
+        undo=pos.do_move(m)
+        if _incremental is not None:
+            _incremental.push(pos,m,undo)
+        s=_quiesce(pos,alpha,beta,not maxi,ply+1)
+        pos.undo_move(m,undo)
+        if maxi:
+            if s>val:
+                val=s
+            alpha=max(alpha,s)
+        else:
+            if s<val:
+                val=s
+            beta=min(beta,s)
+        if beta<=alpha:
+            break
+    return val
+
+def _move_to_front(buf, n, code):
+    """buf[:n] の中の指し手 code を先頭に移す（他の手の順序は保つ）"""
+    for i in range(n):
+        if buf[i]==code:
+            buf[1:i+1]=buf[0:i]
+            buf[0]=code
+            return
+
+def _search_root(pos, depth, alpha, beta, moves, upper=None):
+    """
+    ルート局面で、指定した指し手 moves の中だけを探索する（PVS）
+    
+    Args:
+        moves: 探索する指し手（整数エンコードのリスト。この順に読む）
+        upper: 指し手 -> 評価値の上限 の辞書（同じ深さの探索の間で共有する）
+    
+    Returns:
+        tuple: (評価値, 最善手の整数エンコード)。読み筋は _pv_table[0] に入る
+    
+    実装の理由:
+        Multi-PV で、すでに見つけた読み筋の手を除いて探索し直すために使う。
+        ルートの合法手生成と除外を呼び出し側で1回だけ行えば、
+        あとは _minimax の最大化側と同じ手順で読める。
+        null windowで alpha 以下と分かった手の値（fail-soft なので真の値の上限）を
+        upper に覚えておき、再探索で上限が alpha 以下の手は読み直さない。
+    """
+    if _node_limit is not None and SEARCH_STATS['nodes']>=_node_limit:
+        raise SearchAborted('nodes')
+    SEARCH_STATS['nodes']+=1
+    get_move_buffer(0)
+    if not _pv_table:
+        _pv_table.append(())
+    if upper is None:
+        upper={}
+    val=-1e9
+    best=None
+    for i,m in enumerate(moves):
+        ub=upper.get(m)
+        if best is not None and ub is not None and ub<=alpha:
+            # この手が alpha を超えないことはすでに分かっている
+            if ub>val:
+                val=ub
+            continue
+        undo=pos.do_move(m)
+        if _incremental is not None:
+            _incremental.push(pos,m,undo)
+        if best is None:
+            s,_=_minimax(pos,depth-1,alpha,beta,False,1)
+        else:
+            s,_=_minimax(pos,depth-1,alpha,alpha+1,False,1)
+            if alpha<s<beta:
+                SEARCH_STATS['pvs_researches']+=1
+                s,_=_minimax(pos,depth-1,alpha,beta,False,1)
+        pos.undo_move(m,undo)
+        if s<beta:
+            upper[m]=s
+        if s>val:
+            val,best=s,m
+            _pv_table[0]=(m,)+_pv_table[1] if depth>1 else (m,)
+        alpha=max(alpha,s)
+        if beta<=alpha:
+            break
+    return val,best
+
+def _aspiration_search(pos, depth, guess, first, moves=None, upper=None):
+    """
+    前回の評価値 guess を中心とした狭い窓でルートを探索する
+    
+    Args:
+        moves: ルートで読む指し手のリスト（Noneなら全合法手）
+        upper: _search_root に渡す、指し手ごとの評価値の上限
+    
+    Returns:
+        tuple: (評価値, 最善手の整数エンコード)
+    
+    実装の理由:
+        真の評価値が窓の中に収まれば、全幅の窓より多く枝刈りできる。
+        窓の外に出たら（fail-low/fail-high）その側の窓を4倍に広げて探索し直す。
+    """
+    if moves is None:
+        root=lambda lo,hi: _minimax(pos,depth,lo,hi,True,0,first)
+    else:
+        root=lambda lo,hi: _search_root(pos,depth,lo,hi,moves,upper)
+    if guess is None:
+        return root(-1e9,1e9)
+    delta=ASPIRATION_WINDOW
+    lo,hi=guess-delta,guess+delta
+    while True:
+        val,best=root(lo,hi)
+        if val<=lo and lo>-1e9:
+            SEARCH_STATS['aspiration_fail_low']+=1
+            delta*=4
+            lo=guess-delta if delta<1000000 else -1e9
+        elif val>=hi and hi<1e9:
+            SEARCH_STATS['aspiration_fail_high']+=1
+            delta*=4
+            hi=guess+delta if delta<1000000 else 1e9
+        else:
+            return val,best
+
+def search(board, hands=None, turn=None, depth=3, nodes=None, time_limit=None, stop=None,
+           time_manager=None, evaluator=None, futility_margins=None, razor_margins=None):
+    """
+    反復深化で探索し、最善手と探索の情報を返す
+    
+    Args:
+        board: 盤面（または Position）
+        hands: 持ち駒
+        turn: 'sente' または 'gote'
+        depth: 探索する最大の深さ
+        nodes: 探索するノード数の上限（Noneなら無制限）
+        time_limit: 探索時間の上限（秒。Noneなら無制限）
+        stop: 呼ぶとTrueを返したら探索をやめる関数（外部からの中断用）
+        time_manager: 持ち時間を管理する TimeManager（start_move 済みのもの）
+        evaluator: この探索だけで使う評価関数（Evaluator。Noneなら set_evaluator の設定）
+        futility_margins: futility pruning の幅（残りの深さ -> 評価値の幅。Noneなら FUTILITY_MARGINS）
+        razor_margins: razoring の幅（残りの深さ -> 評価値の幅。Noneなら RAZOR_MARGINS）
+    
+    Returns:
+        dict: {'move': 最善手, 'score': 評価値, 'pv': 読み筋（指し手のリスト）,
+               'depth': 読み切った深さ, 'nodes': 探索ノード数, 'time': 経過秒数}
+    
+    実装の理由:
+        深さ1から順に探索し（反復深化）、前の反復の最善手を最初に読み、
+        評価値をaspiration windowの中心に使う。
+        評価値はルートの手番側から見た値なので、窓の中心には前の反復の値を使う。
+        制限に達したら途中の反復は捨て、最後に読み切った深さの結果を返す。
+        time_manager があれば、反復ごとに次の深さへ進むかを判断させ、
+        硬い上限の時刻で探索を打ち切る（時計は一定ノードごとにだけ見る）。
+        置換表などの表は呼び出しごとに新しく作る（次の手に持ち越すなら Engine を使う）。
+    """
+    root=board.copy() if isinstance(board,Position) else Position.from_board(board,hands,turn)
+    tables=SearchTables(futility_margins=futility_margins,razor_margins=razor_margins)
+    res=_iterative_search(root,depth,nodes,time_limit,stop,time_manager,evaluator,tables)
+    del res['scores'], res['pv_codes']
+    return res
+
+def _iterative_search(root, depth, nodes, time_limit, stop, time_manager, evaluator, tables,
+                      first=None, guesses=None):
+    """
+    search の本体（反復深化）
+    
+    Args:
+        root: ルート局面（変更しない）
+        tables: 使う SearchTables
+        first: 深さ1の反復で最初に読む手（整数。前の手の探索で予想した手など）
+        guesses: 深さ -> aspiration windowの中心に使う評価値（前の手の探索の結果など）
+    
+    Returns:
+        dict: search の戻り値に、深さごとの評価値 'scores' を加えたもの
+              （'pv' は整数の指し手のまま 'pv_codes' にも入れる）
+    """
+    global _search_limits, _node_limit
+    pos=root.copy()  # 打ち切ったときは局面が途中のままになるので複製で探索する
+    reset_search_stats()
+    start=time.monotonic()
+    deadline=start+time_limit if time_limit is not None else None
+    if time_manager is not None:
+        deadline=min(deadline,time_manager.deadline()) if deadline is not None else time_manager.deadline()
+    if nodes is not None or deadline is not None or stop is not None:
+        _search_limits=(nodes,deadline,stop)
+    _node_limit=nodes
+    saved=set_evaluator(evaluator) if evaluator is not None else None
+    _start_evaluator(pos)
+    _use_tables(tables)
+    scores={}
+    guesses=guesses or {}
+    best=first
+    score=None
+    pv=()
+    done=0
+    try:
+        for d in range(1,depth+1):
+            guess=scores[d-1] if d-1 in scores else guesses.get(d)
+            val,move=_aspiration_search(pos,d,guess,best)
+            scores[d]=val
+            score,done=val,d
+            if move is not None:
+                best=move
+                pv=_pv_table[0]
+            if time_manager is not None:
+                time_manager.on_iteration(d,val,best)
+                if time_manager.should_stop():
+                    break
+    except SearchAborted:
+        pass
+    finally:
+        _search_limits=None
+        _node_limit=None
+        _use_tables(None)
+        if evaluator is not None:
+            set_evaluator(saved)
+    if done==0:
+        # 深さ1も読み切れなかったときは、予想した手か最初の合法手を返す
+        buf=_scratch_buffer
+        n=generate_legal_moves(root,buf)
+        if best is None or best not in buf[:n]:
+            best=buf[0] if n else None
+        pv=(best,) if best is not None else ()
+    return {
+        'move': decode_move(best) if best is not None else None,
+        'score': score,
+        'pv': [decode_move(m) for m in pv],
+        'depth': done,
+        'nodes': SEARCH_STATS['nodes'],
+        'time': time.monotonic()-start,
+        'scores': scores,
+        'pv_codes': pv,
+    }
+
+def ai_choose_move(board, hands=None, turn=None, depth=3, nodes=None, time_limit=None,
+                   time_manager=None, evaluator=None, engine=None):
     """
     AIが指す手を決定（A2: 探索深さの設定）
     
     Args:
-        board: 盤面
+        board: 盤面（または Position）
         hands: 持ち駒
         turn: 'sente' または 'gote'
         depth: 探索する深さ（デフォルト3手先）
+        nodes: 探索するノード数の上限（Noneなら無制限）
+        time_limit: 探索時間の上限（秒。Noneなら無制限）
+        time_manager: 持ち時間を管理する TimeManager（start_move 済みのもの）
+        evaluator: 使う評価関数（Evaluator。例: nnue.NNUEEvaluator。Noneなら従来の評価関数）
+        engine: 前の手の探索の表を持ち越す Engine（Noneなら毎回新しく探索する。
+                指定したときは Engine の評価関数を使う）。
+                distributed.Coordinator を渡すと、探索をほかのマシンのワーカーに任せる
     
     Returns:
         最善手 ('move', 元, 先) または ('drop', 駒, 位置)
@@ -780,22 +2878,234 @@ def ai_choose_move(board, hands, turn, depth=3):
     実装の理由:
         depth=3は3手先まで読むことを意味する。
         深くするほど強くなるが、計算時間が指数関数的に増加する。
+        探索は search（反復深化+PVS+aspiration window）に任せる。
+    """
+    if engine is not None:
+        return engine.think(board,hands,turn,depth,nodes,time_limit,time_manager=time_manager)['move']
+    return search(board,hands,turn,depth,nodes,time_limit,time_manager=time_manager,
+                  evaluator=evaluator)['move']
+
+def analyze(board, hands=None, turn=None, multipv=3, depth=3, nodes=None, time_limit=None,
+            stop=None, evaluator=None):
+    """
+    上位 multipv 個の候補手を、評価値と読み筋つきで返す（Multi-PV）
+    
+    Args:
+        board: 盤面（または Position）
+        hands: 持ち駒
+        turn: 'sente' または 'gote'
+        multipv: 返す候補手の数
+        depth, nodes, time_limit, stop: search と同じ探索制限
+        evaluator: この探索だけで使う評価関数（Noneなら set_evaluator の設定）
+    
+    Returns:
+        dict: {'lines': [{'move': 指し手, 'score': 評価値, 'pv': 読み筋}, ...],
+               'depth': 読み切った深さ, 'nodes': 探索ノード数, 'time': 経過秒数}
+        lines は良い順。合法手が multipv 個より少なければその数だけ返す。
+    
+    実装の理由:
+        各深さで、まず全合法手から最善手を読み、次にその手を除いた残りから
+        2番目の手を読む…を multipv 回くり返す（除外して再探索）。
+        除外した残りの最善を全幅で読むので、どの候補の評価値も正確な値になる。
+        末端に近いノードの枝刈り（SEE・futility pruning・razoring）は止める
+        （枝刈りした値は窓の外の見積もりなので、2番目以降の評価値が全幅で読んだ値とずれる）。
+        候補ごとに独立した探索をするのではなく、1つの反復深化の中で行い、
+        前の深さの候補の順番で読み、前の深さの評価値を
+        aspiration windowの中心に使うので、2番目以降の探索も速く終わる。
+    """
+    global _search_limits, _node_limit, _pruning
+    root=board.copy() if isinstance(board,Position) else Position.from_board(board,hands,turn)
+    pos=root.copy()
+    reset_search_stats()
+    start=time.monotonic()
+    if nodes is not None or time_limit is not None or stop is not None:
+        _search_limits=(nodes,start+time_limit if time_limit is not None else None,stop)
+    _node_limit=nodes
+    saved=set_evaluator(evaluator) if evaluator is not None else None
+    _start_evaluator(pos)
+    _use_tables(SearchTables())
+    _pruning=False
+    buf=_scratch_buffer
+    legal=list(buf[:generate_legal_moves(root,buf)])
+    lines=[]
+    history={}  # 深さ -> その深さの各候補の評価値
+    done=0
+    try:
+        for d in range(1,depth+1):
+            # 前の深さの候補を先に、残りは生成順で読む
+            prev=[line[0] for line in lines]
+            remaining=prev+[m for m in legal if m not in prev]
+            found=[]
+            upper={}  # この深さで分かった、各指し手の評価値の上限
+            for k in range(min(multipv,len(legal))):
+                if k:
+                    # 上限の高い手ほど次の候補になりやすいので先に読む
+                    remaining.sort(key=lambda m: -upper.get(m,1e9))
+                guesses=history.get(d-1)
+                guess=guesses[k] if guesses is not None and k<len(guesses) else None
+                val,move=_aspiration_search(pos,d,guess,None,remaining,upper)
+                found.append((move,val,_pv_table[0]))
+                remaining.remove(move)
+            lines=found
+            history[d]=[val for _,val,_ in found]
+            done=d
+    except SearchAborted:
+        pass
+    finally:
+        _search_limits=None
+        _node_limit=None
+        _pruning=True
+        _use_tables(None)
+        if evaluator is not None:
+            set_evaluator(saved)
+    if done==0:
+        lines=[(m,None,(m,)) for m in legal[:multipv]]
+    return {
+        'lines': [{'move': decode_move(m), 'score': val, 'pv': [decode_move(c) for c in pv]}
+                  for m,val,pv in lines],
+        'depth': done,
+        'nodes': SEARCH_STATS['nodes'],
+        'time': time.monotonic()-start,
+    }
+
+def search_moves(pos, moves, depth, alpha=-1e9, beta=1e9, tables=None, time_limit=None):
     """
-    _,move=minimax(board,hands,depth,-1e9,1e9,True,turn)
-    return move
+    ルート局面の指定した手だけを、決まった深さと窓で探索する（分散探索のワーカー用）
+
+    Args:
+        pos: ルート局面（Position。変更しない）
+        moves: 読む指し手（整数エンコードのリスト。この順に読む）
+        depth: 探索する深さ
+        alpha: 窓の下限
+        beta: 窓の上限
+        tables: 使う SearchTables（Noneなら新しく作る。同じワーカーで使い回すと速い）
+        time_limit: 探索時間の上限（秒。Noneなら無制限）
+
+    Returns:
+        dict: {'score': 評価値, 'move': 最善手の整数エンコード, 'pv': 読み筋（整数のタプル）,
+               'nodes': 探索ノード数}
+
+    Raises:
+        SearchAborted: time_limit に達した場合
+
+    実装の理由:
+        反復深化は呼び出し側（distributed.Coordinator）が深さごとに行うので、
+        ここでは _search_root で1回だけ読む。search と同じ _minimax を使うので、
+        同じ局面・深さ・窓なら1台で読んだときと同じ意味の値になる
+        （fail-soft: 窓の外なら真の値の上限・下限）。
+    """
+    global _search_limits
+    pos=pos.copy()
+    reset_search_stats()
+    if time_limit is not None:
+        _search_limits=(None,time.monotonic()+time_limit,None)
+    _start_evaluator(pos)
+    _use_tables(tables if tables is not None else SearchTables())
+    try:
+        val,best=_search_root(pos,depth,alpha,beta,list(moves))
+        pv=_pv_table[0]
+    finally:
+        _search_limits=None
+        _use_tables(None)
+    return {'score': val, 'move': best, 'pv': pv, 'nodes': SEARCH_STATS['nodes']}
+
+class Engine:
+    """
+    対局の間使い続ける探索エンジン（前の手の探索の表と読み筋を次の手に持ち越す）
+    
+    Args:
+        depth: 探索する深さの既定値
+        evaluator: 使う評価関数（Noneなら set_evaluator の設定）
+        tt_entries: 置換表に入れる局面数の上限
+        futility_margins, razor_margins: 枝刈りの幅（search と同じ。Noneなら既定値）
+    
+    使い方:
+        engine = Engine()
+        move = engine.choose_move(board, hands, turn)   # 毎手同じ engine を使う
+        engine.new_game()                               # 新しい対局の前に表を空にする
+    
+    実装の理由:
+        次にAIが考える局面は、たいてい前の探索の読み筋を2手進めた局面になる。
+        置換表とキラー手を捨てずに使えば、前の探索で読んだ部分は
+        置換表の値と手の順番からすぐに読み終わる。実際の進行が読み筋どおりなら
+        （局面のハッシュで確かめる）、さらに
+          - 読み筋の3手目を深さ1の反復で最初に読む手にする
+          - 前の探索の深さ 3 の評価値を、深さ 1 の反復の aspiration windowの中心にする
+          - キラー手を2手分ずらして使う
+        ことで、最初の反復から前の探索の続きとして読める。
+        置換表の値は「局面・深さ・最大化側か」で決まるので、読み筋から外れても、
+        また先手・後手どちらの手番で使っても、残した表が間違った値を返すことはない。
+        評価関数を変えたときは new_game() で表を空にする。
+    """
+
+    def __init__(self, depth=3, evaluator=None, tt_entries=DEFAULT_TT_ENTRIES,
+                 futility_margins=None, razor_margins=None):
+        self.depth = depth
+        self.evaluator = evaluator
+        self.tables = SearchTables(tt_entries,futility_margins,razor_margins)
+        self.stats = {'searches': 0, 'predicted': 0}
+        self._expect = None  # (予想した局面のハッシュ, 残りの読み筋, 深さ -> 評価値)
+
+    def new_game(self):
+        """表と予想を捨てる"""
+        self.tables.clear()
+        self._expect = None
+
+    def think(self, board, hands=None, turn=None, depth=None, nodes=None, time_limit=None,
+              stop=None, time_manager=None):
+        """
+        探索して結果を返す（引数と戻り値は search と同じ。depth を省略すると既定の深さ）
+        
+        Returns:
+            dict: search の戻り値に 'predicted'（前の探索の予想どおりの局面だったか）を加えたもの
+        """
+        root=board.copy() if isinstance(board,Position) else Position.from_board(board,hands,turn)
+        first=None
+        guesses=None
+        expect=self._expect
+        predicted=expect is not None and expect[0]==root.hash
+        if predicted:
+            self.stats['predicted']+=1
+            rest,scores=expect[1],expect[2]
+            first=rest[0] if rest else None
+            guesses={d-2: v for d,v in scores.items() if d>2}
+            self.tables.age(2)
+        else:
+            self.tables.age(0)
+        res=_iterative_search(root,depth or self.depth,nodes,time_limit,stop,time_manager,
+                              self.evaluator,self.tables,first,guesses)
+        self.stats['searches']+=1
+        self._expect=self._predict(root,res.pop('pv_codes'),res.pop('scores'))
+        res['predicted']=predicted
+        return res
+
+    def choose_move(self, board, hands=None, turn=None, depth=None, nodes=None, time_limit=None,
+                    time_manager=None):
+        """think の最善手だけを返す（ai_choose_move と同じ形）"""
+        return self.think(board,hands,turn,depth,nodes,time_limit,time_manager=time_manager)['move']
+
+    @staticmethod
+    def _predict(root, pv, scores):
+        """読み筋の2手先の局面を予想として覚える"""
+        if len(pv)<2:
+            return None
+        pos=root.copy()
+        for m in pv[:2]:
+            pos.do_move(m)
+        return (pos.hash,pv[2:],scores)
 
 # ============================================================
 # ゲーム終了判定（T3: 詰み判定）
 # ============================================================
 
-def is_checkmate(board, hands, turn):
+def is_checkmate(board, hands=None, turn=None):
     """
     詰みの判定（T3: 手番・状態管理）
     
     Args:
-        board: 盤面
+        board: 盤面（または Position）
         hands: 持ち駒
-        turn: 'sente' または 'gote'（詰まされる側）
+        turn: 'sente' または 'gote'（詰まされる側。Position なら手番側）
     
     Returns:
         bool: 詰んでいればTrue
@@ -803,13 +3113,16 @@ def is_checkmate(board, hands, turn):
     実装の理由:
         詰み = 王手状態 + 逃げる手がない
         これでゲーム終了を判定できる。
+        王手を受ける手の生成は合法手キャッシュを使わないので、ハッシュは計算しない。
     """
+    pos=_to_position(board,hands,turn,with_hash=False)
+
     # 王手がかかっていない場合、詰みではない
-    if not is_check(board, turn):
+    if not in_check(pos):
         return False
     
-    # 合法手が一つもなければ詰み
-    return len(get_all_legal_moves(board, hands, turn)) == 0
+    # 王手を受ける手が一つもなければ詰み
+    return generate_evasions(pos,_scratch_buffer)==0
 
 # ============================================================
 # ユーザーインターフェース（表示・入力）
@@ -900,14 +3213,153 @@ def parse_input(s):
     if p[0]=='drop': 
         return ('drop',p[1],(int(p[2]),int(p[3])))
 
+# ============================================================
+# 局面の文字列表現（SFEN）
+# ============================================================
+# SFEN: 将棋の局面を1行の文字列で表す標準形式
+#   例: "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+#   盤面（1段目から、各段は9筋→1筋の順）・手番・持ち駒・手数
+#   SFENでは大文字が先手、小文字が後手（このプログラムとは逆）
+# 理由: 解析サーバーや一括解析で、局面を外部とやり取りするため
+
+STARTPOS_SFEN = 'lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1'
+
+# 持ち駒を書き出す順番（SFENの慣例: 飛角金銀桂香歩）
+SFEN_HAND_ORDER = 'RBGSNLP'
+
+def board_to_sfen(board, hands, turn, ply=1):
+    """
+    盤面・持ち駒・手番をSFEN文字列に変換
+    
+    Args:
+        board: 盤面（または Position。その場合 hands・turn は使わない）
+        hands: 持ち駒
+        turn: 'sente' または 'gote'
+        ply: 手数
+    
+    Returns:
+        str: SFEN文字列
+    
+    実装の理由:
+        このプログラムでは成った歩・香・桂・銀を金と同じ文字で表すので、
+        金として書き出す。龍王・龍馬は "+R"・"+B" と書く。
+    """
+    if isinstance(board, Position):
+        board, hands, turn = board.to_board()
+    rows = []
+    for r in range(1, 10):
+        row = ''
+        empty = 0
+        for f in range(9, 0, -1):
+            p = board.get((r, f))
+            if not p:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            if p in UNPROMOTED:
+                row += '+' + UNPROMOTED[p].swapcase()
+            else:
+                row += p.swapcase()
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    hand = ''
+    for side, conv in (('sente', str.upper), ('gote', str.lower)):
+        counts = {}
+        for p in hands[side]:
+            counts[p.upper()] = counts.get(p.upper(), 0) + 1
+        for p in SFEN_HAND_ORDER:
+            n = counts.get(p, 0)
+            if n:
+                hand += (str(n) if n > 1 else '') + conv(p)
+    return '%s %s %s %d' % ('/'.join(rows), 'b' if turn == 'sente' else 'w', hand or '-', ply)
+
+def sfen_to_board(sfen):
+    """
+    SFEN文字列を盤面・持ち駒・手番に変換
+    
+    Args:
+        sfen: SFEN文字列（"sfen " で始まってもよい。"startpos" は初期局面）
+    
+    Returns:
+        tuple: (盤面, 持ち駒, 手番, 手数)
+    
+    Raises:
+        ValueError: SFENとして解釈できない場合
+    
+    実装の理由:
+        持ち駒は先手・後手とも大文字で持つ（テストや drop_piece と同じ表記）。
+        成り駒（"+P" など）は、このプログラムの成り方に合わせて
+        歩・香・桂・銀は金、飛・角は龍王・龍馬として読む。
+    """
+    s = sfen.strip()
+    if s == 'startpos':
+        s = STARTPOS_SFEN
+    if s.startswith('sfen '):
+        s = s[5:]
+    fields = s.split()
+    if len(fields) < 3:
+        raise ValueError('SFENの項目が足りません: %r' % sfen)
+    rows = fields[0].split('/')
+    if len(rows) != 9:
+        raise ValueError('SFENの段の数が9ではありません: %r' % sfen)
+    board = {}
+    for r, row in enumerate(rows, 1):
+        f = 9
+        promoted = False
+        for c in row:
+            if c.isdigit():
+                f -= int(c)
+            elif c == '+':
+                promoted = True
+                continue
+            elif c.upper() in 'KRBGSNLP':
+                if f < 1:
+                    raise ValueError('SFENの段の長さが不正です: %r' % row)
+                p = c.swapcase()
+                if promoted and p in PROMOTION_MAP:
+                    p = PROMOTION_MAP[p]
+                board[(r, f)] = p
+                f -= 1
+            else:
+                raise ValueError('SFENに不明な駒があります: %r' % c)
+            promoted = False
+        if f != 0:
+            raise ValueError('SFENの段の長さが不正です: %r' % row)
+    if fields[1] not in ('b', 'w'):
+        raise ValueError('SFENの手番が不正です: %r' % fields[1])
+    turn = 'sente' if fields[1] == 'b' else 'gote'
+    hands = create_empty_hands()
+    if fields[2] != '-':
+        n = ''
+        for c in fields[2]:
+            if c.isdigit():
+                n += c
+                continue
+            if c.upper() not in SFEN_HAND_ORDER:
+                raise ValueError('SFENの持ち駒が不正です: %r' % fields[2])
+            hands['sente' if c.isupper() else 'gote'].extend([c.upper()] * int(n or 1))
+            n = ''
+    ply = int(fields[3]) if len(fields) > 3 else 1
+    return board, hands, turn, ply
+
 # ============================================================
 # メインゲームループ（T2: 対局メインループ）
 # ============================================================
 
-def play_game():
+def play_game(main_time=None, byoyomi=0, increment=0, profiler=None, engine=None):
     """
     対局を実行するメイン関数
     
+    Args:
+        main_time: 持ち時間（秒）。Noneなら時間制限なし（AIは深さ3で読む）
+        byoyomi: 秒読み（秒）
+        increment: 1手ごとの加算（秒）
+        profiler: AIの思考時間を計測する profiling.Profiler（Noneなら計測しない）
+        engine: AIが使う Engine（または distributed.Coordinator。Noneなら新しい Engine）
+    
     実装の理由:
         1. 初期盤面と持ち駒を作成
         2. ループで交互に手を指す
@@ -920,54 +3372,123 @@ def play_game():
     board=create_initial_board()
     hands=create_empty_hands()
     turn='sente'
-    print("あなたは先手です(下)")
-    
-    while True:
-        print_board(board, hands)
-        
-        # T3: 詰みチェック
-        if is_checkmate(board, hands, turn):
-            winner = '後手(AI)' if turn == 'sente' else '先手(あなた)'
-            print(f"\n{'='*40}")
-            print(f"  詰み！ {winner}の勝ちです！")
-            print(f"{'='*40}\n")
-            break
+    # 詰みチェックと合法手生成・AI探索で同じ局面の合法手を使い回す
+    # （対局が終わったら、呼び出し元のキャッシュの設定に戻す）
+    previous_cache=set_move_cache(MoveCache())
+    try:
+        # 持ち時間があるときは、深さではなく時間で探索を打ち切る
+        clock=TimeManager(main_time,byoyomi,increment) if main_time is not None else None
+        # 前の手の探索の表と読み筋を次の手に持ち越す
+        if engine is None:
+            engine=Engine()
+        move_number=0
+        print("あなたは先手です(下)")
         
-        # 先手のターン（人間プレイヤー）
-        if turn=='sente':
-            legal=get_all_legal_moves(board,hands,turn)
-            if not legal:
+        while True:
+            print_board(board, hands)
+            if clock is not None:
+                print(f"残り時間 先手:{clock.remaining['sente']:.1f}秒 後手:{clock.remaining['gote']:.1f}秒")
+            
+            # T3: 詰みチェック
+            if is_checkmate(board, hands, turn):
+                winner = '後手(AI)' if turn == 'sente' else '先手(あなた)'
                 print(f"\n{'='*40}")
-                print("  合法手がありません。後手の勝ちです。")
+                print(f"  詰み！ {winner}の勝ちです！")
                 print(f"{'='*40}\n")
                 break
             
-            # 合法手が入力されるまで繰り返す
-            while True:
-                m=parse_input(input("> "))
-                if m in legal: break
-                print("不正な手")
+            # 先手のターン（人間プレイヤー）
+            if turn=='sente':
+                legal=get_all_legal_moves(board,hands,turn)
+                if not legal:
+                    print(f"\n{'='*40}")
+                    print("  合法手がありません。後手の勝ちです。")
+                    print(f"{'='*40}\n")
+                    break
+                
+                # 合法手が入力されるまで繰り返す
+                if clock is not None:
+                    clock.start_move(turn,move_number)
+                while True:
+                    m=parse_input(input("> "))
+                    if m in legal: break
+                    print("不正な手")
+                
+                # 手を実行
+                board,hands = make_move(board,m[1],m[2],hands,turn=turn) if m[0]=='move' else drop_piece(board,hands,m[1],m[2],turn)
             
-            # 手を実行
-            board,hands = make_move(board,m[1],m[2],hands,turn=turn) if m[0]=='move' else drop_piece(board,hands,m[1],m[2],turn)
-        
-        # 後手のターン（AIプレイヤー）
-        else:
-            print("AI思考中...")
-            m=ai_choose_move(board,hands,turn)
-            if not m:
+            # 後手のターン（AIプレイヤー）
+            else:
+                print("AI思考中...")
+                if profiler is not None:
+                    profiler.start()
+                if clock is not None:
+                    clock.start_move(turn,move_number)
+                    m=ai_choose_move(board,hands,turn,depth=MAX_CLOCK_DEPTH,time_manager=clock,engine=engine)
+                else:
+                    m=ai_choose_move(board,hands,turn,engine=engine)
+                if profiler is not None:
+                    profiler.stop()
+                if not m:
+                    print(f"\n{'='*40}")
+                    print("  AIに指せる手がありません。先手の勝ちです。")
+                    print(f"{'='*40}\n")
+                    break
+                print("AI:",m)
+                
+                # 手を実行
+                board,hands = make_move(board,m[1],m[2],hands,turn=turn) if m[0]=='move' else drop_piece(board,hands,m[1],m[2],turn)
+            
+            # 持ち時間を使い切っていたら時間切れ負け
+            if clock is not None and not clock.finish_move(turn):
+                loser = '先手(あなた)' if turn == 'sente' else '後手(AI)'
                 print(f"\n{'='*40}")
-                print("  AIに指せる手がありません。先手の勝ちです。")
+                print(f"  時間切れ！ {loser}の負けです。")
                 print(f"{'='*40}\n")
                 break
-            print("AI:",m)
             
-            # 手を実行
-            board,hands = make_move(board,m[1],m[2],hands,turn=turn) if m[0]=='move' else drop_piece(board,hands,m[1],m[2],turn)
-        
-        # 手番交代
-        turn='gote' if turn=='sente' else 'sente'
+            # 手番交代
+            turn='gote' if turn=='sente' else 'sente'
+            move_number+=1
+    finally:
+        set_move_cache(previous_cache)
+
+
+def main(argv=None):
+    """
+    コマンドラインから対局を始める
+    
+    実装の理由:
+        --profile を付けると、AIが考えている間だけを計測し、
+        対局の終了時（Ctrl+Cで中断したときも）にレポートを書き出す。
+        --cluster を付けると、AIの探索を distributed のワーカーに任せる。
+    """
+    import argparse
+    parser=argparse.ArgumentParser(description='将棋AIと対局する')
+    parser.add_argument('--profile',nargs='?',const='sample',choices=('sample','cprofile'),
+                        help='AIの思考を計測する（sample: サンプリング, cprofile: cProfile）')
+    parser.add_argument('--profile-out',default='profile',help='計測結果の出力先（拡張子なし）')
+    parser.add_argument('--cluster',help='探索を任せるワーカーのアドレス（host:port をカンマ区切り）')
+    args=parser.parse_args(argv)
+    
+    engine=None
+    if args.cluster:
+        from distributed import Coordinator
+        engine=Coordinator(args.cluster.split(','))
+    if args.profile is None:
+        play_game(engine=engine)
+        return
+    from profiling import Profiler
+    profiler=Profiler(args.profile)
+    reset_call_counts()
+    try:
+        play_game(profiler=profiler,engine=engine)
+    except (KeyboardInterrupt, EOFError):
+        print()
+    finally:
+        paths=profiler.write(args.profile_out,CALL_COUNTS)
+        print("計測結果: %s, %s" % paths)
 
 
 if __name__=="__main__":
-    play_game()
+    main()
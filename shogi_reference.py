@@ -0,0 +1,246 @@
+# ============================================================
+# 将棋AI ルールの参照実装
+# ============================================================
+# 合法手生成・王手判定・打ち歩詰め判定・評価関数を、高速化する前の
+# shogi.py と同じ書き方（盤面の辞書を1マスずつ調べる）で残したもの。
+# 速さは考えず、ルールの定義そのものとして読めることを優先する。
+#
+# shogi.py の高速な実装（事前計算テーブル・Position・王手を受ける手の
+# 生成など）は、fuzz.py でこの実装と同じ結果になることを確かめる。
+# ルールそのものを変えるときは shogi.py と一緒にこちらも直す。
+
+from shogi import (
+    PIECE_VALUES, MOVES, PROMOTION_MAP,
+    can_promote, demote, get_piece, has_pawn_on_file, is_dead_drop, is_gote, is_sente, is_valid,
+)
+
+# ============================================================
+# 合法手生成（基本移動）
+# ============================================================
+
+def get_legal_moves(board, r, f, turn):
+    """
+    指定位置の駒が移動できるマス目のリストを生成
+
+    Args:
+        board: 盤面
+        r: 駒の現在位置の段
+        f: 駒の現在位置の筋
+        turn: 'sente' または 'gote'
+
+    Returns:
+        list: 移動可能な座標のリスト [(段, 筋), ...]
+
+    実装の理由:
+        - MOVESの定義を使って基本移動を計算
+        - 飛車・角・香車は長距離移動なので別処理
+        - 味方の駒がいる場所や盤外には移動できない
+    """
+    moves=[]
+    p=get_piece(board,r,f)
+    if not p: return moves
+
+    # 手番と駒の所有者が一致しない場合は空リストを返す
+    if (turn=='sente' and not is_sente(p)) or (turn=='gote' and is_sente(p)):
+        return moves
+
+    # 基本移動（王、金、銀、桂、歩）
+    if p in MOVES:
+        for dr,df in MOVES[p]:
+            nr,nf=r+dr,f+df
+            if is_valid(nr,nf):
+                t=get_piece(board,nr,nf)
+                # 移動先が空きマス、または相手の駒がある場合のみ移動可能
+                if not t or is_sente(t)!=is_sente(p):
+                    moves.append((nr,nf))
+
+    # 長距離移動（飛車・角・香車。龍王・龍馬は基本移動に加えて飛車・角と同じ動き）
+    if p.lower() in ['r','b','l','d','h']:
+        dirs=[]
+        if p.lower() in ['r','d']: dirs=[(-1,0),(1,0),(0,-1),(0,1)]  # 飛車: 縦横4方向
+        if p.lower() in ['b','h']: dirs=[(-1,-1),(-1,1),(1,-1),(1,1)]  # 角: 斜め4方向
+        if p.lower()=='l': dirs=[(-1,0)] if p.islower() else [(1,0)]  # 香車: 前方のみ
+
+        for dr,df in dirs:
+            nr,nf=r,f
+            while True:
+                nr+=dr; nf+=df
+                if not is_valid(nr,nf): break  # 盤外に出たら終了
+                t=get_piece(board,nr,nf)
+                if t:
+                    # 駒がある場合、相手の駒なら取れるのでリストに追加して終了
+                    if is_sente(t)!=is_sente(p): moves.append((nr,nf))
+                    break
+                moves.append((nr,nf))
+    return moves
+
+# ============================================================
+# 盤面操作：駒の移動と打つ
+# ============================================================
+
+def make_move(board, frm, to, hands, turn):
+    """
+    駒を移動させた新しい盤面と持ち駒を返す（取った駒は持ち駒、敵陣への出入りで自動成り）
+    """
+    if frm not in board:
+        return None, None
+    b=board.copy()
+    h={'sente':hands['sente'][:],'gote':hands['gote'][:]}
+    p=b.pop(frm)
+    if to in b:
+        h[turn].append(demote(b.pop(to)))
+    if can_promote(p, frm, to, turn):
+        p=PROMOTION_MAP[p]
+    b[to]=p
+    return b,h
+
+def drop_piece(board, hands, piece, to, turn):
+    """
+    持ち駒を打った新しい盤面と持ち駒を返す（先手なら小文字、後手なら大文字で置く）
+    """
+    if piece not in hands[turn] or get_piece(board,*to):
+        return None,None
+    b=board.copy()
+    h={'sente':hands['sente'][:],'gote':hands['gote'][:]}
+    b[to]=piece.lower() if turn=='sente' else piece.upper()
+    h[turn].remove(piece)
+    return b,h
+
+# ============================================================
+# 王手判定
+# ============================================================
+
+def find_king(board, turn):
+    """指定した側の王の位置（いなければNone）"""
+    k='k' if turn=='sente' else 'K'
+    for pos,p in board.items():
+        if p==k: return pos
+
+def is_check(board, turn):
+    """
+    turn 側の王に王手がかかっているか
+
+    実装の理由:
+        相手の全駒の移動可能位置に自分の王があるかを調べる
+    """
+    kp=find_king(board,turn)
+    if not kp:
+        return False
+    opp='gote' if turn=='sente' else 'sente'
+    for (r,f),p in board.items():
+        if (opp=='sente' and is_sente(p)) or (opp=='gote' and is_gote(p)):
+            if kp in get_legal_moves(board,r,f,opp):
+                return True
+    return False
+
+# ============================================================
+# 特殊ルール
+# ============================================================
+
+def is_safe(board, hands, move, turn):
+    """その手を指した後に自玉が王手にならないか"""
+    if move[0]=='move':
+        b,_=make_move(board,move[1],move[2],hands,turn)
+    else:
+        b,_=drop_piece(board,hands,move[1],move[2],turn)
+    if b is None:
+        return False
+    return not is_check(b,turn)
+
+def is_uchifuzume(board, hands, pos, turn):
+    """
+    打ち歩詰めか（歩を打つと王手になり、相手に盤上の駒を動かす合法手がない）
+
+    実装の理由:
+        shogi.is_uchifuzume と同じく、歩を持っているとき（'P'・'p' のどちらの
+        表記でもよい）だけ判定し、相手の手は盤上の駒の移動だけを調べる。
+    """
+    piece = 'P' if 'P' in hands[turn] else 'p'
+    if piece not in hands[turn]:
+        return False
+    test_board, test_hands = drop_piece(board, hands, piece, pos, turn)
+    if not test_board:
+        return False
+    opp = 'gote' if turn == 'sente' else 'sente'
+    if not is_check(test_board, opp):
+        return False
+    for (r,f), p in test_board.items():
+        if (opp == 'sente' and is_sente(p)) or (opp == 'gote' and is_gote(p)):
+            for to in get_legal_moves(test_board, r, f, opp):
+                b2, _ = make_move(test_board, (r,f), to, test_hands, opp)
+                if b2 and not is_check(b2, opp):
+                    return False
+    return True
+
+# ============================================================
+# 全合法手の生成
+# ============================================================
+
+def get_all_legal_moves(board, hands, turn):
+    """
+    すべての合法手（盤上の駒の移動 + 持ち駒を打つ手）
+
+    Returns:
+        list: 合法手のリスト [('move', 元, 先), ('drop', 駒, 位置), ...]
+
+    実装の理由:
+        盤上の駒の移動先と、持ち駒を打てる空きマスをすべて挙げ、
+        自殺手・二歩・行き所のない駒・打ち歩詰めを除く。
+        同じ駒を何枚持っていても、打つ手は駒の種類ごとに1つ（持ち駒の並び順）。
+    """
+    moves=[]
+    for (r,f),p in board.items():
+        if (turn=='sente' and is_sente(p)) or (turn=='gote' and is_gote(p)):
+            for to in get_legal_moves(board,r,f,turn):
+                m=('move',(r,f),to)
+                if is_safe(board,hands,m,turn):
+                    moves.append(m)
+    for piece in dict.fromkeys(hands[turn]):
+        for r in range(1,10):
+            for f in range(1,10):
+                if get_piece(board,r,f): continue
+                if piece.lower()=='p' and has_pawn_on_file(board,f,turn): continue
+                if is_dead_drop(piece,r,turn): continue
+                if piece.lower()=='p' and is_uchifuzume(board,hands,(r,f),turn): continue
+                m=('drop',piece,(r,f))
+                if is_safe(board,hands,m,turn):
+                    moves.append(m)
+    return moves
+
+# ============================================================
+# 評価関数
+# ============================================================
+
+def evaluate_board(board, turn):
+    """
+    turn 側から見た盤面の評価値（駒の価値・玉の安全度・駒の働き）
+    """
+    score=0
+    # 駒の価値
+    for p in board.values():
+        v=PIECE_VALUES[p]
+        score+=v if (turn=='sente' and is_sente(p)) or (turn=='gote' and is_gote(p)) else -v
+    # 玉の安全度: 周囲8マスの味方の駒はボーナス、相手の駒が利いていればペナルティ
+    king_pos = find_king(board, turn)
+    if king_pos:
+        safety_bonus = 0
+        opp = 'gote' if turn == 'sente' else 'sente'
+        for dr, df in [(-1,0),(1,0),(0,-1),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)]:
+            nr, nf = king_pos[0] + dr, king_pos[1] + df
+            if is_valid(nr, nf):
+                piece = get_piece(board, nr, nf)
+                if piece and ((turn == 'sente' and is_sente(piece)) or (turn == 'gote' and is_gote(piece))):
+                    safety_bonus += 10
+                for (r,f), p in board.items():
+                    if (opp == 'sente' and is_sente(p)) or (opp == 'gote' and is_gote(p)):
+                        if (nr, nf) in get_legal_moves(board, r, f, opp):
+                            safety_bonus -= 15
+                            break
+        score += safety_bonus
+    # 駒の働き: 相手陣に近い駒（玉以外）と中央の駒にボーナス
+    for (r, f), p in board.items():
+        if (turn == 'sente' and is_sente(p)) or (turn == 'gote' and is_gote(p)):
+            if p.lower() != 'k':
+                score += (10 - r) * 2 if turn == 'sente' else r * 2
+            score += max(0, 3 - abs(f - 5)) * 5
+    return score
@@ -0,0 +1,40 @@
+import analysis_server
+import shogi
+
+def test_analysis_service():
+    """解析サービス（ワーカープール・待ち行列）のテスト"""
+    service = analysis_server.AnalysisService(workers=1, max_queue=1)
+    try:
+        job = service.submit('startpos', depth=2)
+        assert job.done.wait(30)
+        res = analysis_server.job_response(job)
+        board, hands, turn, _ = shogi.sfen_to_board('startpos')
+        assert tuple(res['move']) in shogi.get_all_legal_moves(board, hands, turn)
+        assert res['depth'] == 2 and res['nodes'] > 0
+        
+        # ワーカーが埋まっている間は待ち行列に入り、上限を超えると断られる
+        running = service.submit('startpos', depth=20, job_id='long')
+        queued = service.submit('startpos', depth=1, job_id='queued')
+        try:
+            service.submit('startpos', depth=1)
+            assert False, "待ち行列の上限を超えても受け付けてしまいました"
+        except analysis_server.QueueFull:
+            pass
+        
+        # 待ち行列の要求も実行中の要求も中断できる
+        assert service.cancel('queued')
+        assert queued.done.wait(5) and queued.error == 'cancelled'
+        assert service.cancel('long')
+        assert running.done.wait(30)
+        assert running.result['cancelled'] and running.result['move'] is not None
+        
+        stats = service.stats()
+        assert stats['completed'] == 2 and stats['rejected'] == 1
+        assert stats['queue_depth'] == 0
+        assert stats['latency_ms']['p50'] > 0
+    finally:
+        service.close()
+    print("✓ 解析サービス: OK")
+
+if __name__ == "__main__":
+    test_analysis_service()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+import bench
+import shogi
+
+TINY_SUITE = [
+    {'name': 'startpos', 'sfen': shogi.STARTPOS_SFEN, 'depth': 2},
+    {'name': 'nodes', 'sfen': '4k4/9/4P4/9/9/9/9/9/4K4 b G 1', 'depth': 6, 'nodes': 300},
+]
+
+def test_bench_run():
+    """ベンチマークの計測と基準値の保存・読み込みのテスト"""
+    results = bench.run_suite(TINY_SUITE, repeat=2)
+    assert [r['name'] for r in results] == ['startpos', 'nodes']
+    for entry, r in zip(TINY_SUITE, results):
+        board, hands, turn, _ = shogi.sfen_to_board(entry['sfen'])
+        assert r['move'] in shogi.get_all_legal_moves(board, hands, turn)
+        assert r['nodes'] > 0 and r['time'] > 0 and r['nps'] > 0 and r['rss_kb'] > 0
+    assert results[0]['depth'] == 2
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'baseline.json')
+        bench.save_baseline(results, path)
+        baseline = bench.load_baseline(path)
+        assert bench.compare(results, baseline) == []
+    assert bench.load_baseline(os.path.join(tempfile.gettempdir(), 'no-such-baseline.json')) is None
+    # 置いてある基準値は SUITE のすべての局面を含む
+    names = {r['name'] for r in bench.load_baseline()['results']}
+    assert names == {e['name'] for e in bench.SUITE}
+    print("✓ ベンチマークの計測: OK")
+
+def test_bench_compare():
+    """基準値との比較で、速度の低下と選んだ手の変化を検出するかのテスト"""
+    base = {'results': [
+        {'name': 'a', 'move': ['move', [7, 7], [6, 7]], 'nodes': 1000, 'time': 1.0, 'nps': 1000, 'rss_kb': 1},
+        {'name': 'b', 'move': ['drop', 'P', [5, 5]], 'nodes': 3000, 'time': 1.0, 'nps': 3000, 'rss_kb': 1},
+    ]}
+    def result(name, move, nodes, elapsed):
+        return {'name': name, 'move': move, 'nodes': nodes, 'time': elapsed,
+                'nps': round(nodes / elapsed), 'rss_kb': 1}
+    same = [result('a', ('move', (7, 7), (6, 7)), 1000, 1.1), result('b', ('drop', 'P', (5, 5)), 3000, 1.1)]
+    assert bench.compare(same, base) == []
+    # 合計の nps が 20% を超えて下がったら失敗（局面ごとではなく合計で判定）
+    slow = [result('a', ('move', (7, 7), (6, 7)), 1000, 2.0), result('b', ('drop', 'P', (5, 5)), 3000, 1.0)]
+    assert len(bench.compare(slow, base)) == 1
+    assert bench.compare(slow, base, threshold=0.5) == []
+    # 選んだ手が変わったら失敗
+    changed = [result('a', ('move', (7, 7), (6, 7)), 1000, 1.0), result('b', ('drop', 'P', (5, 4)), 3000, 1.0)]
+    failures = bench.compare(changed, base)
+    assert len(failures) == 1 and failures[0].startswith('b:')
+    assert bench.compare(changed, base, allow_move_change=True) == []
+    # 基準値にない局面は比べない
+    assert bench.compare([result('new', ('move', (1, 1), (2, 2)), 10, 1.0)], base) == []
+    print("✓ ベンチマークの比較: OK")
+
+def test_bench_movegen():
+    """合法手生成の計測のテスト（種類ごとの手の数を合わせると全合法手の数）"""
+    results = bench.bench_movegen(TINY_SUITE, repeat=3)
+    assert [r['name'] for r in results] == ['startpos', 'nodes']
+    for r in results:
+        assert r['legal']['moves'] == r['captures']['moves'] + r['checks']['moves'] + r['quiets']['moves']
+        assert all(r[kind]['usec'] > 0 for kind, _ in bench.MOVEGEN_KINDS)
+    assert results[0]['legal']['moves'] == 30 and results[1]['checks']['moves'] > 0
+    assert shogi.get_move_cache() is None
+    assert len(bench.format_movegen(results).splitlines()) == 3
+    print("✓ 合法手生成の計測: OK")
+
+def test_bench_profile():
+    """--profile のテスト（探索・合法手生成を計測してレポートと折りたたみスタックを書く）"""
+    with tempfile.TemporaryDirectory() as d:
+        prefix = os.path.join(d, 'prof')
+        assert bench.main(['--only', 'startpos', '--profile', '--profile-out', prefix]) == 0
+        with open(prefix + '.txt', encoding='utf-8') as f:
+            report = f.read()
+        assert 'generate_legal_moves' in report and os.path.exists(prefix + '.collapsed')
+        results, paths = bench.profile_suite(TINY_SUITE, 'cprofile', prefix, movegen=True)
+        assert [r['name'] for r in results] == ['startpos', 'nodes']
+        with open(paths[0], encoding='utf-8') as f:
+            assert 'generate_captures' in f.read()
+    # 既定では複数回計測して最も速い回を使う（1回だけの計測は揺れが大きい）
+    assert bench.DEFAULT_REPEAT > 1
+    print("✓ ベンチマークのプロファイル: OK")
+
+if __name__ == "__main__":
+    test_bench_run()
+    test_bench_compare()
+    test_bench_movegen()
+    test_bench_profile()
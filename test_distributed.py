@@ -0,0 +1,98 @@
+import socket
+import threading
+
+import distributed
+import shogi
+
+TACTICAL_SFEN = 'ln1gk2nl/1r1s2g2/p1pppp1pp/6p2/1p5P1/2P6/PPSPPPP1P/7R1/LN1GKGSNL b Bbs 1'
+
+def _flaky_worker():
+    """仕事を1つ受け取ったら応答せずに接続を切るワーカー（アドレスを返す）"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+
+    def run():
+        while True:
+            conn, _ = server.accept()
+            conn.makefile('rb').readline()
+            conn.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return '127.0.0.1:%d' % server.getsockname()[1]
+
+def test_pack_position():
+    """局面の受け渡しのテスト（持ち駒の大文字・小文字もそのまま）"""
+    board, hands, turn, _ = shogi.sfen_to_board(TACTICAL_SFEN)
+    hands['sente'].append('p')
+    pos = shogi.Position.from_board(board, hands, 'gote')
+    got = distributed.unpack_position(distributed.pack_position(pos))
+    assert got.squares == pos.squares and got.hands == pos.hands
+    assert got.side == pos.side and got.hash == pos.hash
+    print("✓ 局面の受け渡し: OK")
+
+def test_search_moves():
+    """ルートの手ごとの探索のテスト（手ごとの最大が search の評価値と一致）"""
+    for sfen in (shogi.STARTPOS_SFEN, TACTICAL_SFEN):
+        board, hands, turn, _ = shogi.sfen_to_board(sfen)
+        pos = shogi.Position.from_board(board, hands, turn)
+        buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+        moves = list(buf[:shogi.generate_legal_moves(pos, buf)])
+        results = [shogi.search_moves(pos, [m], 3) for m in moves]
+        best = max(results, key=lambda r: r['score'])
+        expected = shogi.search(board, hands, turn, depth=3)
+        assert best['score'] == expected['score']
+        assert best['pv'][0] == best['move'] and len(best['pv']) == 3
+        assert all(r['nodes'] > 0 for r in results)
+    print("✓ ルートの手ごとの探索: OK")
+
+def test_coordinator():
+    """分散探索のテスト（1台で読んだ結果と同じ手・評価値になる）"""
+    procs, addresses = distributed.start_local_workers(2)
+    try:
+        with distributed.Coordinator(addresses, depth=3) as c:
+            for sfen in (shogi.STARTPOS_SFEN, TACTICAL_SFEN):
+                board, hands, turn, _ = shogi.sfen_to_board(sfen)
+                res = c.think(board, hands, turn)
+                expected = shogi.search(board, hands, turn, depth=3)
+                assert (res['move'], res['score'], res['depth']) == \
+                    (expected['move'], expected['score'], 3)
+                assert res['pv'][0] == res['move'] and res['redispatched'] == 0
+                assert all(w['alive'] and w['jobs'] > 0 for w in res['workers'])
+                assert res['nodes'] == sum(w['nodes'] for w in res['workers'])
+                assert 0 < res['utilization'] <= 1.0
+                assert shogi.ai_choose_move(board, hands, turn, depth=3, engine=c) == expected['move']
+            # 時間の制限: ワーカーが打ち切り、読み切った深さの結果を返す
+            res = c.think(board, hands, turn, depth=30, time_limit=0.3)
+            assert 1 <= res['depth'] < 30 and res['move'] in shogi.get_all_legal_moves(board, hands, turn)
+            c.new_game()
+            assert c.stats == {'searches': 5, 'lost': 0}
+    finally:
+        distributed.stop_local_workers(procs)
+    print("✓ 分散探索: OK")
+
+def test_worker_loss():
+    """ワーカーを失ったときのテスト（ほかのワーカー、最後は自分で読み直す）"""
+    board, hands, turn, _ = shogi.sfen_to_board(TACTICAL_SFEN)
+    expected = shogi.search(board, hands, turn, depth=3)
+    procs, addresses = distributed.start_local_workers(1)
+    try:
+        with distributed.Coordinator([_flaky_worker()] + addresses) as c:
+            res = c.think(board, hands, turn)
+            assert (res['move'], res['score']) == (expected['move'], expected['score'])
+            assert res['redispatched'] == 1 and c.stats['lost'] == 1
+            assert [w['alive'] for w in res['workers']] == [False, True]
+    finally:
+        distributed.stop_local_workers(procs)
+    # すべてのワーカーを失ったら、コーディネーターのプロセスで読む
+    with distributed.Coordinator([_flaky_worker(), addresses[0]]) as c:
+        res = c.think(board, hands, turn)
+        assert (res['move'], res['score']) == (expected['move'], expected['score'])
+        assert c.stats['lost'] == 2 and res['utilization'] == 0.0
+    print("✓ ワーカーを失ったとき: OK")
+
+if __name__ == "__main__":
+    test_pack_position()
+    test_search_moves()
+    test_coordinator()
+    test_worker_loss()
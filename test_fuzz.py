@@ -0,0 +1,45 @@
+import fuzz
+import shogi
+
+def test_random_position():
+    """ランダムな局面の再現性のテスト"""
+    seen = set()
+    for case in range(20):
+        sfen, board, hands, turn = fuzz.random_position(5, case)
+        assert fuzz.random_position(5, case)[0] == sfen  # 同じ seed・番号なら同じ局面
+        assert shogi.sfen_to_board(sfen)[:3] == (board, hands, turn)
+        assert list(board.values()).count('k') == list(board.values()).count('K') == 1
+        seen.add(sfen)
+    assert len(seen) > 15
+    print("✓ ランダムな局面: OK")
+
+def test_fuzz_run():
+    """決まった seed での突き合わせのテスト（食い違いがないこと）"""
+    res = fuzz.run(seed=1, cases=60, workers=2)
+    assert res['cases'] == 60 and res['mismatches'] == 0 and res['reports'] == []
+    print("✓ 決まった seed での突き合わせ: OK")
+
+def test_shrink():
+    """食い違いの縮小のテスト（わざと壊した実装を突き合わせる）"""
+    # 先手の銀があるのに「ない」と答える壊れた実装
+    fuzz.CHECKS['broken'] = lambda board, hands, turn: ('s' in board.values(), False)
+    try:
+        case = next(c for c in range(100)
+                    if fuzz.run_check('broken', *fuzz.random_position(2, c)[1:]) is not None)
+        reports = fuzz.fuzz_case(2, case, ['broken'])
+    finally:
+        del fuzz.CHECKS['broken']
+    assert len(reports) == 1
+    report = reports[0]
+    assert report['check'] == 'broken' and report['case'] == case
+    assert report['expected'] is True and report['actual'] is False
+    # 玉2枚と銀1枚だけが残り、持ち駒はなくなる
+    board, hands, _, _ = shogi.sfen_to_board(report['shrunk'])
+    assert sorted(board.values()) == ['K', 'k', 's']
+    assert hands == {'sente': [], 'gote': []}
+    print("✓ 食い違いの縮小: OK")
+
+if __name__ == "__main__":
+    test_random_position()
+    test_fuzz_run()
+    test_shrink()
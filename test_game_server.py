@@ -0,0 +1,172 @@
+import asyncio
+import json
+
+import game_server
+import shogi
+
+async def _request(reader, writer, obj):
+    writer.write((json.dumps(obj) + '\n').encode())
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+async def _play_games():
+    server = game_server.GameServer(workers=1, max_think=2.0)
+    host, port = await server.start('127.0.0.1', 0)
+    try:
+        r1, w1 = await asyncio.open_connection(host, port)
+        r2, w2 = await asyncio.open_connection(host, port)
+        # 人間が先手の対局と、AIが先手（持ち時間あり）の対局を同時に進める
+        g1 = await _request(r1, w1, {'op': 'new', 'human': 'sente', 'depth': 1})
+        g2 = await _request(r2, w2, {'op': 'new', 'human': 'gote', 'depth': 2, 'main_time': 60})
+        assert g1['type'] == 'started' and g1['turn'] == 'sente' and not g1['thinking']
+        assert g2['thinking'] and g2['clock'] == {'sente': 60.0, 'gote': 60.0}
+        moved = await _request(r1, w1, {'op': 'move', 'game': g1['game'], 'move': 'move 7 7 6 7', 'id': 7})
+        assert moved['type'] == 'moved' and moved['turn'] == 'gote' and moved['id'] == 7
+        # AIが考えている間も、ほかの要求にはすぐ答える
+        err = await _request(r1, w1, {'op': 'move', 'game': g1['game'], 'move': ['move', [7, 6], [6, 6]]})
+        assert err['type'] == 'error'
+        stats = await _request(r1, w1, {'op': 'stats'})
+        assert stats['type'] == 'stats' and stats['games'] == 2
+        # 他の接続の対局は触れない
+        err = await _request(r1, w1, {'op': 'state', 'game': g2['game']})
+        assert err['type'] == 'error'
+        
+        for reader, game in ((r1, g1), (r2, g2)):
+            ai = json.loads(await asyncio.wait_for(reader.readline(), 30))
+            assert ai['type'] == 'ai_move' and ai['game'] == game['game']
+            assert ai['turn'] == game['human'] and ai['moves'] == (2 if game is g1 else 1)
+            board, hands, turn, _ = shogi.sfen_to_board(ai['sfen'])
+            assert turn == game['human'] and shogi.get_all_legal_moves(board, hands, turn)
+        assert ai['clock']['sente'] < 60.0 and ai['clock']['gote'] == 60.0
+        
+        # 不正な手・終局後の手
+        err = await _request(r2, w2, {'op': 'move', 'game': g2['game'], 'move': ['drop', 'P', [5, 5]]})
+        assert err['type'] == 'error'
+        res = await _request(r2, w2, {'op': 'resign', 'game': g2['game']})
+        assert res['status'] == 'finished' and res['winner'] == 'sente' and res['reason'] == 'resign'
+        err = await _request(r2, w2, {'op': 'move', 'game': g2['game'], 'move': 'move 3 3 4 3'})
+        assert err['type'] == 'error'
+        assert (await _request(r2, w2, {'op': 'bogus'}))['type'] == 'error'
+        w2.write(b'not json\n')
+        assert json.loads(await r2.readline())['type'] == 'error'
+        
+        # 接続が切れたらその接続の対局はなくなる
+        w2.close()
+        await w2.wait_closed()
+        for _ in range(50):
+            if len(server.games) == 1:
+                break
+            await asyncio.sleep(0.02)
+        assert list(server.games) == [g1['game']]
+        w1.close()
+        await w1.wait_closed()
+    finally:
+        await server.close()
+
+def test_game_server():
+    """対局サーバー（複数の対局の同時進行）のテスト"""
+    asyncio.run(_play_games())
+    print("✓ 対局サーバー: OK")
+
+async def _hand_letters():
+    server = game_server.GameServer(workers=1, max_think=5.0)
+    host, port = await server.start('127.0.0.1', 0)
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        # 人間（先手）が取った歩は 'p' で持つが、state と同じ大文字の 'P' で打てる
+        game = await _request(reader, writer, {'op': 'new', 'human': 'sente', 'depth': 1,
+                                               'sfen': '4k4/9/9/9/4p4/4P4/9/9/4K4 b - 1'})
+        moved = await _request(reader, writer, {'op': 'move', 'game': game['game'], 'move': 'move 6 5 5 5'})
+        assert moved['sfen'].split()[2] == 'P'
+        ai = json.loads(await asyncio.wait_for(reader.readline(), 30))
+        assert ai['type'] == 'ai_move'
+        moved = await _request(reader, writer, {'op': 'move', 'game': game['game'], 'move': ['drop', 'P', [7, 1]]})
+        assert moved['type'] == 'moved' and moved['sfen'].split()[2] == '-'
+        ai = json.loads(await asyncio.wait_for(reader.readline(), 30))
+        
+        # AI（先手）が取った歩を持っているとき: ワーカーは SFEN から読むので 'P' を打つ手を返す
+        # （先手の玉は動けず、指せる手は歩を打つ手だけ）
+        game = await _request(reader, writer, {'op': 'new', 'human': 'gote', 'depth': 1,
+                                               'sfen': '4k4/9/9/9/9/9/1gn6/9/K8 w - 1'})
+        server.games[game['game']].hands['sente'] = ['p']
+        await _request(reader, writer, {'op': 'move', 'game': game['game'], 'move': 'move 1 5 1 4'})
+        ai = json.loads(await asyncio.wait_for(reader.readline(), 30))
+        assert ai['type'] == 'ai_move' and ai['move'][:2] == ['drop', 'P']
+        assert ai['status'] == 'playing' and ai['turn'] == 'gote' and ai['moves'] == 2
+        board, hands, _, _ = shogi.sfen_to_board(ai['sfen'])
+        assert board[tuple(ai['move'][2])] == 'p' and hands == {'sente': [], 'gote': []}
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        await server.close()
+
+def test_hand_letters():
+    """持ち駒の表記（取った駒は大小反転、SFENでは大文字）が違っても打てるかのテスト"""
+    asyncio.run(_hand_letters())
+    # 指せない手は局面を変えずに断る
+    game = game_server.Game('g')
+    try:
+        game.play(('drop', 'P', (5, 5)))
+        assert False, '持っていない駒は打てないはず'
+    except game_server.GameError:
+        pass
+    assert game.board == shogi.create_initial_board() and not game.moves
+    print("✓ 持ち駒の表記: OK")
+
+async def _resign_while_thinking():
+    server = game_server.GameServer(workers=1, max_think=5.0)
+    host, port = await server.start('127.0.0.1', 0)
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        game = await _request(reader, writer, {'op': 'new', 'human': 'gote', 'depth': 4, 'main_time': 60})
+        assert game['thinking']
+        res = await _request(reader, writer, {'op': 'resign', 'game': game['game']})
+        assert res['status'] == 'finished' and res['moves'] == 0 and res['winner'] == 'sente'
+        # 探索が終わっても手は指さず、ai_move も送らない（次に届くのは state の返事）
+        for _ in range(500):
+            if server.searches:
+                break
+            await asyncio.sleep(0.02)
+        assert server.searches == 1
+        state = await _request(reader, writer, {'op': 'state', 'game': game['game']})
+        assert state['type'] == 'state' and not state['thinking']
+        assert (state['moves'], state['sfen'], state['winner'], state['reason']) == \
+            (0, res['sfen'], 'sente', 'resign')
+        writer.close()
+        await writer.wait_closed()
+    finally:
+        await server.close()
+
+def test_resign_while_thinking():
+    """AIが考えている間に投了したら、探索の結果を指さないかのテスト"""
+    asyncio.run(_resign_while_thinking())
+    print("✓ 思考中の投了: OK")
+
+async def _schedule():
+    scheduler = game_server.FairScheduler(1)
+    order = []
+    async def job(name, used):
+        await scheduler.acquire(used)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        scheduler.release()
+    await scheduler.acquire(0)  # 空きを埋めておく
+    tasks = [asyncio.ensure_future(job(n, u)) for n, u in (('heavy', 9.0), ('light', 1.0), ('new', 0.0), ('mid', 1.0))]
+    await asyncio.sleep(0.01)
+    assert scheduler.waiting == 4
+    tasks[1].cancel()  # 待っている間に取り消された対局は飛ばす
+    scheduler.release()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert order == ['new', 'mid', 'heavy']
+    assert scheduler.running == 0 and scheduler.waiting == 0
+
+def test_fair_scheduler():
+    """思考の割り当てが、使った思考時間の短い対局から順になるかのテスト"""
+    asyncio.run(_schedule())
+    print("✓ 思考の公平な割り当て: OK")
+
+if __name__ == "__main__":
+    test_game_server()
+    test_hand_letters()
+    test_resign_while_thinking()
+    test_fair_scheduler()
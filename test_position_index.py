@@ -0,0 +1,107 @@
+import json
+import os
+import random
+import tempfile
+
+import position_index
+import shogi
+
+def _random_games(n, seed):
+    """初期局面からランダムに指した棋譜（序盤は手が重なりやすいよう選ぶ手を絞る）"""
+    rng = random.Random(seed)
+    games = []
+    for g in range(n):
+        board, hands, turn = shogi.create_initial_board(), shogi.create_empty_hands(), 'sente'
+        moves = []
+        for ply in range(rng.randint(4, 40)):
+            legal = sorted(shogi.get_all_legal_moves(board, hands, turn), key=str)
+            if not legal:
+                break
+            m = legal[rng.randrange(min(len(legal), 2 if ply < 4 else len(legal)))]
+            moves.append(m)
+            if m[0] == 'move':
+                board, hands = shogi.make_move(board, m[1], m[2], hands, turn=turn)
+            else:
+                board, hands = shogi.drop_piece(board, hands, m[1], m[2], turn)
+            turn = 'gote' if turn == 'sente' else 'sente'
+        games.append({'id': g, 'moves': moves, 'winner': rng.choice(['sente', 'gote', None])})
+    return games
+
+def test_replay_game():
+    """棋譜の再生のテスト（指し手の表記・持ち駒の表記・壊れた棋譜）"""
+    # 角交換: 先手は後手の角を小文字 'b' で持つが、打つ手は "B" で書いてもよい
+    game = {'moves': ['move 7 3 6 3', ['move', [3, 7], [4, 7]], ['move', [8, 8], [2, 2]],
+                      ['move', [1, 3], [2, 2]], ['drop', 'B', [5, 5]]], 'winner': 'gote'}
+    entries = position_index.replay_game(game)
+    assert [r for _, _, r in entries] == [-1, 1, -1, 1, -1]
+    assert entries[0][0] == position_index.position_key(*shogi.sfen_to_board('startpos')[:3])
+    # 打った後の局面は SFEN（持ち駒は大文字）から引いても同じキーになる
+    board, hands = shogi.create_initial_board(), shogi.create_empty_hands()
+    for i, m in enumerate(game['moves'][:4]):
+        m = position_index.parse_move(m)
+        board, hands = shogi.make_move(board, m[1], m[2], hands, turn=('sente', 'gote')[i % 2])
+    assert hands == {'sente': ['b'], 'gote': ['B']}
+    sfen = shogi.board_to_sfen(board, hands, 'sente')
+    assert entries[4][0] == position_index.position_key(*shogi.sfen_to_board(sfen)[:3])
+    assert entries[4][1] == shogi.encode_move(('drop', 'B', (5, 5)))
+
+    for bad in ({'moves': ['move 3 3 4 3']},                 # 後手の駒を先手が動かす
+                {'moves': [['drop', 'P', [5, 5]]]},          # 持っていない駒を打つ
+                {'moves': ['pass']},
+                {'moves': [], 'winner': 'black'}):
+        try:
+            position_index.replay_game(bad)
+            assert False, bad
+        except ValueError:
+            pass
+    print("✓ 棋譜の再生: OK")
+
+def test_build_and_lookup():
+    """索引の作成・足し込み・問い合わせのテスト（1局ずつ数えた結果と比べる）"""
+    games = _random_games(60, 4)
+    lines = [json.dumps(g) for g in games] + ['', 'not json', json.dumps({'moves': ['move 1 1 2 1']})]
+    expected = {}
+    for g in games:
+        for key, move, result in position_index.replay_game(g):
+            s = expected.setdefault(key, {}).setdefault(move, [0, 0, 0, 0])
+            s[0] += 1
+            s[2 - result] += 1
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'games.db')
+        res = position_index.build(iter(lines), path, workers=2, chunk=7)
+        assert res['games'] == 60 and res['errors'] == 2
+        with position_index.PositionIndex(path) as index:
+            assert index.games() == 60
+            start = index.lookup(shogi.STARTPOS_SFEN)
+            assert start['games'] == 60 and sum(m['wins'] for m in start['moves']) == \
+                sum(g['winner'] == 'sente' for g in games)
+            assert [m['games'] for m in start['moves']] == sorted((m['games'] for m in start['moves']),
+                                                                  reverse=True)
+            # 途中の局面: SFEN からでも (盤面, 持ち駒, 手番) からでも同じ結果
+            g = games[0]
+            board, hands, turn = shogi.create_initial_board(), shogi.create_empty_hands(), 'sente'
+            for m in g['moves']:
+                res = index.lookup(shogi.board_to_sfen(board, hands, turn))
+                assert res == index.lookup(board, hands, turn)
+                key = position_index.position_key(board, hands, turn)
+                got = {position_index.move_key(x['move']): [x['games'], x['wins'], x['draws'], x['losses']]
+                       for x in res['moves']}
+                assert got == expected[key]
+                if m[0] == 'move':
+                    board, hands = shogi.make_move(board, m[1], m[2], hands, turn=turn)
+                else:
+                    board, hands = shogi.drop_piece(board, hands, m[1], m[2], turn)
+                turn = 'gote' if turn == 'sente' else 'sente'
+            assert index.lookup('9/9/9/9/4k4/9/9/9/4K4 b - 1') == {'games': 0, 'moves': []}
+
+        # 同じ棋譜をもう一度足し込むと、回数がちょうど2倍になる
+        position_index.build(iter(lines), path, workers=2)
+        with position_index.PositionIndex(path) as index:
+            assert index.games() == 120
+            again = index.lookup(shogi.STARTPOS_SFEN)
+            assert [m['games'] for m in again['moves']] == [m['games'] * 2 for m in start['moves']]
+    print("✓ 索引の作成と問い合わせ: OK")
+
+if __name__ == "__main__":
+    test_replay_game()
+    test_build_and_lookup()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+import profiling
+import shogi
+
+def test_call_counts():
+    """呼び出し回数カウンタのテスト"""
+    board = shogi.create_initial_board()
+    hands = shogi.create_empty_hands()
+    shogi.reset_call_counts()
+    assert not any(shogi.CALL_COUNTS.values())
+    res = shogi.search(board, hands, 'sente', depth=2)
+    # 探索した局面の数だけ合法手を生成し、末端で評価関数を呼ぶ
+    assert 0 < shogi.CALL_COUNTS['generate_legal_moves'] <= res['nodes']
+    assert shogi.CALL_COUNTS['evaluate_position'] > 0
+    assert shogi.CALL_COUNTS['do_move'] > 0
+    shogi.make_move(board, (7, 7), (6, 7), hands, turn='sente')
+    assert shogi.CALL_COUNTS['make_move'] == 1
+    print("✓ 呼び出し回数カウンタ: OK")
+
+def test_profiler():
+    """プロファイラのレポートと折りたたみスタックの出力のテスト"""
+    board = shogi.create_initial_board()
+    hands = shogi.create_empty_hands()
+    for mode in ('sample', 'cprofile'):
+        profiler = profiling.Profiler(mode, interval=0.0005)
+        with profiler:
+            shogi.search(board, hands, 'sente', depth=3)
+        with tempfile.TemporaryDirectory() as d:
+            report, collapsed = profiler.write(os.path.join(d, 'out', 'prof'), shogi.CALL_COUNTS)
+            with open(report, encoding='utf-8') as f:
+                text = f.read()
+            with open(collapsed, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        assert 'is_attacked' in text and 'generate_legal_moves' in text
+        assert ('cProfile' in text) == (mode == 'cprofile')
+        # 1行に「根元;...;実行中の関数 サンプル数」
+        assert lines and sum(int(line.rsplit(' ', 1)[1]) for line in lines) == profiler.sampler.total()
+        assert any('_minimax' in line.split(';')[-1] or 'search' in line for line in lines)
+    print("✓ プロファイラ: OK")
+
+if __name__ == "__main__":
+    test_call_counts()
+    test_profiler()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+
+import selfplay
+import shogi
+
+def test_sample_record():
+    """学習データのレコードの書き出しと読み込みのテスト"""
+    board, hands, turn, _ = shogi.sfen_to_board(
+        'lnsgk2nl/1r4gs1/p1pppp1pp/6p2/1p7/2P6/PP1PPPPPP/1SG4R1/LN2KGSNL b Bbp 17')
+    hands['sente'].append('P')  # 取った駒の大文字・小文字はそのまま残る
+    pos = shogi.Position.from_board(board, hands, turn, ply=16)
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    n = shogi.generate_legal_moves(pos, buf)
+    data = selfplay.pack_sample(pos, -40000, buf[n - 1], -1)
+    assert len(data) == selfplay.RECORD_SIZE == 120
+    s = selfplay.unpack_sample(data)
+    assert s['position'].squares == pos.squares and s['position'].hands == pos.hands
+    assert s['position'].hash == pos.hash and s['position'].side == pos.side
+    assert s['move'] == buf[n - 1] and s['result'] == -1 and s['ply'] == 16
+    assert s['score'] == -selfplay.SCORE_LIMIT  # int16 に収まるよう丸める
+    print("✓ 学習データのレコード: OK")
+
+def test_selfplay_run():
+    """自己対局の実行・シャードの切り替え・再開のテスト"""
+    opts = dict(workers=2, nodes=50, opening=(2, 4), max_plies=24, seed=3, shard_size=16)
+    with tempfile.TemporaryDirectory() as d:
+        stats = selfplay.run(d, games=3, **opts)
+        assert stats['games'] == 3 and stats['positions'] > 16 and stats['positions_per_sec'] > 0
+        with open(os.path.join(d, selfplay.MANIFEST)) as f:
+            manifest = json.load(f)
+        assert manifest['games'] == 3 and manifest['records'] == stats['positions']
+        shards = manifest['shards']
+        assert len(shards) == stats['shards'] == -(-stats['positions'] // 16)
+        assert all(s['records'] == 16 for s in shards[:-1]) and 0 < shards[-1]['records'] <= 16
+        assert sorted(os.listdir(d)) == sorted([s['file'] for s in shards] + [selfplay.MANIFEST])
+        
+        # 最初のレコードは0局目の最初の探索局面（同じ seed なら同じ対局になる）
+        first = next(selfplay.read_shard(os.path.join(d, shards[0]['file'])))
+        data, count, _ = selfplay.play_selfplay_game((0, 3, 50, (2, 4), 24))
+        assert selfplay.unpack_sample(data)['position'].hash == first['position'].hash
+        for s in selfplay.read_shard(os.path.join(d, shards[0]['file'])):
+            pos = s['position']
+            buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+            assert s['move'] in buf[:shogi.generate_legal_moves(pos, buf)]
+            assert s['result'] in (-1, 0, 1)
+        
+        # 再実行すると続きの対局番号・シャード番号から書く
+        more = selfplay.run(d, games=2, **opts)
+        with open(os.path.join(d, selfplay.MANIFEST)) as f:
+            manifest = json.load(f)
+        assert manifest['games'] == 5
+        assert manifest['records'] == stats['positions'] + more['positions']
+        assert len(manifest['shards']) == len(shards) + -(-more['positions'] // 16)
+    print("✓ 自己対局の実行: OK")
+
+if __name__ == "__main__":
+    test_sample_record()
+    test_selfplay_run()
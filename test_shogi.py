@@ -1,3 +1,7 @@
+import contextlib
+import io
+import time
+
 import shogi
 
 def test_two_pawns():
@@ -106,6 +110,11 @@ def test_uchifuzume():
     
     # 打ち歩詰めなので不可
     assert ('drop', 'P', (2, 5)) not in moves, "打ち歩詰めが禁止されていません"
+    
+    # 取った歩（小文字の表記）を打つ場合も同じ
+    hands = {'sente': ['p'], 'gote': []}
+    assert shogi.is_uchifuzume(board, hands, (2, 5), 'sente')
+    assert ('drop', 'p', (2, 5)) not in shogi.get_all_legal_moves(board, hands, 'sente')
     print("✓ 打ち歩詰めチェック: OK")
 
 def test_capture():
@@ -213,6 +222,40 @@ def test_promotion_edge_cases():
     assert new_board[(3, 5)] == 'g'  # そのまま金
     print("✓ 成りのエッジケース: OK")
 
+def test_rook_bishop_promotion():
+    """飛車・角が龍王・龍馬に成るテスト（持ち主は変わらない）"""
+    board = shogi.create_initial_board()
+    hands = {'sente': [], 'gote': []}
+    board, _ = shogi.make_move(board, (7, 7), (6, 7), hands, turn='sente')
+    opened, _ = shogi.make_move(board, (3, 3), (4, 3), hands, turn='gote')
+    
+    # 先手の角が敵陣に入ると先手の龍馬になる（取った角は先手の持ち駒）
+    new_board, new_hands = shogi.make_move(opened, (8, 8), (2, 2), hands, turn='sente')
+    assert new_board[(2, 2)] == 'h' and new_hands['sente'] == ['b']
+    
+    # 龍馬を取ると角に戻って持ち駒になる
+    _, taken = shogi.make_move(new_board, (1, 3), (2, 2), new_hands, turn='gote')
+    assert taken['gote'] == ['B']
+    
+    # 後手の角が敵陣に入ると後手の龍馬になる（先手の駒にならない）
+    new_board, new_hands = shogi.make_move(opened, (2, 2), (8, 8), hands, turn='gote')
+    assert new_board[(8, 8)] == 'H' and new_hands['gote'] == ['B']
+    assert ('move', (2, 2), (8, 8)) in shogi.get_all_legal_moves(opened, hands, 'gote')
+    
+    # 龍王は飛車の動き + 斜め1マス、龍馬は角の動き + 縦横1マス
+    dragon = shogi.get_legal_moves({(5, 5): 'd'}, 5, 5, 'sente')
+    assert (1, 5) in dragon and (4, 4) in dragon and (3, 3) not in dragon
+    horse = shogi.get_legal_moves({(5, 5): 'H'}, 5, 5, 'gote')
+    assert (9, 9) in horse and (6, 5) in horse and (7, 5) not in horse
+    
+    # 駒の価値は先手・後手で同じ
+    for p in 'RBDH':
+        assert shogi.PIECE_VALUES[p] == shogi.PIECE_VALUES[p.lower()]
+    
+    # 飛車・角が敵陣に入る手を読んでも探索が止まらない
+    assert shogi.ai_choose_move(board, hands, 'gote', depth=3) is not None
+    print("✓ 飛車・角の成り: OK")
+
 def test_king_safety():
     """王が存在しない場合のエラーハンドリング"""
     board = {}
@@ -223,6 +266,464 @@ def test_king_safety():
     assert shogi.is_check(board, 'sente') == False
     print("✓ 王不在時の処理: OK")
 
+def test_move_cache():
+    """合法手キャッシュのテスト"""
+    board = shogi.create_initial_board()
+    hands = shogi.create_empty_hands()
+    cache = shogi.enable_move_cache(max_entries=2)
+    try:
+        expected = shogi.get_all_legal_moves(board, hands, 'sente')
+        # 同じ局面はキャッシュから同じ合法手が返る
+        assert shogi.get_all_legal_moves(board, hands, 'sente') == expected
+        assert cache.hits == 1 and cache.misses == 1
+        
+        # 手番・持ち駒が違えば別の局面として扱う
+        shogi.get_all_legal_moves(board, hands, 'gote')
+        with_pawn = {'sente': ['P'], 'gote': []}
+        assert shogi.position_hash(board, with_pawn, 'sente') != shogi.position_hash(board, hands, 'sente')
+        shogi.get_all_legal_moves(board, with_pawn, 'sente')
+        assert cache.misses == 3
+        
+        # 上限(2局面)を超えた分は古い順に追い出される
+        assert cache.evictions == 1
+        assert len(cache.entries) == 2
+        
+        # ハッシュが衝突した別の局面には、登録された合法手を返さない
+        cache.clear()
+        buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+        pos = shogi.Position.from_board(board, hands, 'sente')
+        other = shogi.Position.from_board(board, {'sente': ['G'], 'gote': []}, 'sente')
+        expected = list(buf[:shogi.generate_legal_moves(other, buf)])
+        cache.clear()
+        assert list(buf[:shogi.generate_legal_moves(pos, buf)]) != expected
+        other.hash = pos.hash
+        assert list(buf[:shogi.generate_legal_moves(other, buf)]) == expected
+        assert cache.stats()['collisions'] == 1 and cache.hits == 0
+        
+        # 差し替えたキャッシュは元に戻せる
+        assert shogi.set_move_cache(None) is cache and shogi.get_move_cache() is None
+        assert shogi.set_move_cache(cache) is None and shogi.get_move_cache() is cache
+    finally:
+        shogi.disable_move_cache()
+    
+    # 対局は専用のキャッシュを使い、終わったら（中断されても）元の設定に戻す
+    def quit_game(prompt):
+        assert shogi.get_move_cache() is not None
+        raise EOFError
+    shogi.input = quit_game
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            shogi.play_game()
+    except EOFError:
+        pass
+    finally:
+        del shogi.input
+    assert shogi.get_move_cache() is None
+    print("✓ 合法手キャッシュ: OK")
+
+def test_move_encoding():
+    """指し手の整数エンコードのテスト"""
+    board = shogi.create_initial_board()
+    hands = {'sente': ['P', 'g'], 'gote': []}
+    moves = shogi.get_all_legal_moves(board, hands, 'sente')
+    # タプル → 整数 → タプルで元に戻る（小文字の持ち駒も区別される）
+    assert ('drop', 'g', (5, 5)) in moves
+    for m in moves:
+        assert shogi.decode_move(shogi.encode_move(m)) == m
+    
+    # バッファに書き込んだ合法手は get_all_legal_moves と同じ
+    buf = shogi.get_move_buffer(0)
+    n = shogi.generate_legal_moves_into(board, hands, 'sente', buf)
+    assert [shogi.decode_move(buf[i]) for i in range(n)] == moves
+    
+    # 敵陣に入る手には成りフラグが立つ
+    board = {(4, 5): 'p'}
+    n = shogi.generate_legal_moves_into(board, {'sente': [], 'gote': []}, 'sente', buf)
+    assert n == 1 and buf[0] & shogi.MOVE_PROMOTE
+    assert shogi.decode_move(buf[0]) == ('move', (4, 5), (3, 5))
+    print("✓ 指し手の整数エンコード: OK")
+
+def test_position():
+    """Positionクラスのテスト"""
+    board = shogi.create_initial_board()
+    board[(5, 5)] = 'B'  # 後手の角（先手の金・銀を取れる）
+    hands = {'sente': ['P', 'P'], 'gote': ['g']}
+    pos = shogi.Position.from_board(board, hands, 'sente')
+    assert pos.hash == shogi.position_hash(board, hands, 'sente')
+    assert pos.kings == [shogi.square_index((9, 5)), shogi.square_index((1, 5))]
+    assert pos.to_board() == (board, hands, 'sente')
+    
+    # 従来の関数に Position をそのまま渡せる
+    assert shogi.get_all_legal_moves(pos) == shogi.get_all_legal_moves(board, hands, 'sente')
+    assert shogi.is_check(pos) == shogi.is_check(board, 'sente')
+    assert shogi.evaluate_board(pos) == shogi.evaluate_board(board, 'sente')
+    
+    # ハッシュなしで作った局面も、盤面・王の位置は同じ
+    light = shogi.Position.from_board(board, hands, 'sente', with_hash=False)
+    assert light.hash == 0 and light.squares == pos.squares and light.kings == pos.kings
+    
+    # 指して戻すと元の局面（ハッシュ・王の位置を含む）に戻る
+    before = pos.to_board()
+    buf = shogi.get_move_buffer(0)
+    n = shogi.generate_legal_moves(pos, buf)
+    for i in range(n):
+        code = buf[i]
+        undo = pos.do_move(code)
+        b, h, t = shogi.apply_move_code(board, hands, code, 'sente') + ('gote',)
+        assert pos.hash == shogi.position_hash(b, h, t)
+        assert pos.squares == shogi.Position.from_board(b, h, t).squares
+        pos.undo_move(code, undo)
+        assert pos.to_board() == before
+    assert pos.hash == shogi.position_hash(board, hands, 'sente')
+    print("✓ Positionクラス: OK")
+
+def test_move_tables():
+    """事前計算テーブルによる移動先・利きのテスト"""
+    # 盤の端の駒は盤外に出ない
+    assert shogi.STEP_TARGETS['n'][shogi.square_index((3, 1))] == (shogi.square_index((1, 2)),)
+    assert shogi.STEP_TARGETS['n'][shogi.square_index((2, 5))] == ()
+    
+    # 香車は前方の駒にぶつかるまで進み、相手の駒なら取れる
+    board = {(9, 1): 'l', (5, 1): 'P'}
+    assert shogi.get_legal_moves(board, 9, 1, 'sente') == [(8, 1), (7, 1), (6, 1), (5, 1)]
+    
+    # 利きの判定は全駒の移動先を生成した結果と一致する
+    board = shogi.create_initial_board()
+    pos = shogi.Position.from_board(board)
+    for side, turn in ((shogi.SENTE, 'sente'), (shogi.GOTE, 'gote')):
+        reach = set()
+        for (r, f), p in board.items():
+            if (turn == 'sente') == shogi.is_sente(p):
+                reach.update(shogi.get_legal_moves(board, r, f, turn))
+        for sq, rf in enumerate(shogi.SQUARES):
+            if rf not in board or shogi.SIDE_OF[board[rf]] != side:
+                assert shogi.is_attacked(pos, sq, side) == (rf in reach), rf
+    print("✓ 事前計算テーブル: OK")
+
+def test_pvs_search():
+    """PVS+aspiration windowの探索結果が通常のαβ探索と一致するかのテスト"""
+    board = shogi.create_initial_board()
+    board[(5, 5)] = 'P'  # 後手の歩を5五に出しておく（取れる手を作る）
+    del board[(3, 5)]
+    hands = {'sente': ['G'], 'gote': []}
+    expected, _ = shogi.minimax(board, hands, 2, -1e9, 1e9, True, 'sente')
+    
+    m = shogi.ai_choose_move(board, hands, 'sente', depth=2)
+    assert m in shogi.get_all_legal_moves(board, hands, 'sente')
+    assert shogi.SEARCH_STATS['nodes'] > 0
+    # 選んだ手の評価値が最善の評価値と一致する
+    nb, nh = shogi.make_move(board, m[1], m[2], hands, turn='sente') if m[0] == 'move' \
+        else shogi.drop_piece(board, hands, m[1], m[2], 'sente')
+    value, _ = shogi.minimax(nb, nh, 1, -1e9, 1e9, False, 'gote')
+    assert value == expected, (value, expected)
+    print("✓ PVS+aspiration window: OK")
+
+def test_leaf_perspective():
+    """末端の評価値の向きのテスト（読む深さが奇数でも偶数でも、ただの駒を取る）"""
+    hands = {'sente': [], 'gote': []}
+    board = {(9, 5): 'k', (1, 1): 'K', (8, 3): 'r', (4, 3): 'G'}
+    # 先後を入れ替えた局面でも同じ
+    mirrored = {(10 - r, 10 - f): p.swapcase() for (r, f), p in board.items()}
+    for depth in (1, 2, 3):
+        res = shogi.search(board, hands, 'sente', depth=depth)
+        assert res['move'] == ('move', (8, 3), (4, 3)) and res['score'] > 0, (depth, res)
+        res = shogi.search(mirrored, hands, 'gote', depth=depth)
+        assert res['move'] == ('move', (2, 7), (6, 7)) and res['score'] > 0, (depth, res)
+    print("✓ 末端の評価値の向き: OK")
+
+def test_sfen():
+    """SFENの読み書きのテスト"""
+    board, hands, turn, ply = shogi.sfen_to_board('startpos')
+    assert board == shogi.create_initial_board()
+    assert turn == 'sente' and ply == 1
+    assert shogi.board_to_sfen(board, hands, turn) == shogi.STARTPOS_SFEN
+    
+    # 持ち駒（先手は大文字、後手は小文字）と手番が往復で保たれる
+    sfen = '4k4/9/9/9/9/9/9/9/4K4 w R2Pb3p 10'
+    board, hands, turn, ply = shogi.sfen_to_board(sfen)
+    assert board == {(1, 5): 'K', (9, 5): 'k'}
+    assert sorted(hands['sente']) == ['P', 'P', 'R'] and sorted(hands['gote']) == ['B', 'P', 'P', 'P']
+    assert turn == 'gote' and ply == 10
+    assert shogi.board_to_sfen(board, hands, turn, ply) == sfen
+    
+    # 成った歩・香・桂・銀は金、成った飛車・角は龍王・龍馬として読む
+    board, _, _, _ = shogi.sfen_to_board('4k4/9/9/9/9/9/9/4+P4/4K4 b - 1')
+    assert board[(8, 5)] == 'g'
+    sfen = '4k4/9/9/9/3+b+R4/9/9/9/4K4 b - 1'
+    board, hands, turn, _ = shogi.sfen_to_board(sfen)
+    assert board[(5, 6)] == 'H' and board[(5, 5)] == 'd'
+    assert shogi.board_to_sfen(board, hands, turn) == sfen
+    print("✓ SFEN: OK")
+
+def test_search_limits():
+    """探索制限（ノード数・中断要求）のテスト"""
+    board = shogi.create_initial_board()
+    hands = shogi.create_empty_hands()
+    res = shogi.search(board, hands, 'sente', depth=10, nodes=3000)
+    # 制限に達したら、読み切った深さまでの結果を返す
+    assert res['nodes'] <= 3000
+    assert 1 <= res['depth'] < 10
+    assert res['move'] in shogi.get_all_legal_moves(board, hands, 'sente')
+    
+    # 確認間隔より小さいノード数の上限も超えない
+    res = shogi.search(board, hands, 'sente', depth=10, nodes=50)
+    assert res['nodes'] <= 50
+    assert res['move'] in shogi.get_all_legal_moves(board, hands, 'sente')
+    
+    # すぐに中断されても合法手を返す
+    res = shogi.search(board, hands, 'sente', depth=10, stop=lambda: True)
+    assert res['move'] in shogi.get_all_legal_moves(board, hands, 'sente')
+    print("✓ 探索制限: OK")
+
+def test_time_manager():
+    """持ち時間の管理のテスト"""
+    tm = shogi.TimeManager(60, byoyomi=0, increment=1)
+    tm.start_move('gote', 0)
+    assert 0 < tm.soft <= tm.hard < 60
+    # 最善手が変わると柔らかい上限を延ばし、安定すると縮める（硬い上限は超えない）
+    soft = tm.soft
+    tm.on_iteration(1, 0, 'a')
+    tm.on_iteration(2, 0, 'b')
+    assert soft < tm.soft <= tm.hard
+    soft = tm.soft
+    tm.on_iteration(3, 0, 'b')
+    assert tm.soft < soft
+    # 消費時間を引いて加算を足す
+    assert tm.finish_move('gote')
+    assert 60 < tm.remaining['gote'] <= 61
+    assert tm.remaining['sente'] == 60
+    
+    # 持ち時間が尽きても秒読みの範囲内なら時間切れにならない
+    tm = shogi.TimeManager({'sente': 0, 'gote': 0}, byoyomi=1)
+    tm.start_move('sente')
+    assert tm.hard < 1
+    assert tm.finish_move('sente')
+    tm.start = time.monotonic() - 2
+    assert not tm.finish_move('sente') and tm.flagged['sente']
+    
+    # 探索は硬い上限の時刻で打ち切られる
+    board = shogi.create_initial_board()
+    hands = shogi.create_empty_hands()
+    tm = shogi.TimeManager(2)
+    tm.start_move('sente')
+    res = shogi.search(board, hands, 'sente', depth=20, time_manager=tm)
+    assert res['time'] < tm.hard + 0.2
+    assert res['move'] in shogi.get_all_legal_moves(board, hands, 'sente')
+    print("✓ 持ち時間の管理: OK")
+
+def test_multipv():
+    """Multi-PV（上位の候補手と読み筋）のテスト"""
+    board = shogi.create_initial_board()
+    hands = shogi.create_empty_hands()
+    new_board, _ = shogi.make_move(board, (7, 7), (6, 7), hands, turn='sente')
+    res = shogi.analyze(new_board, hands, 'gote', multipv=3, depth=2)
+    lines = res['lines']
+    assert len(lines) == 3 and res['depth'] == 2
+    assert len({line['move'] for line in lines}) == 3
+    # 良い順に並び、評価値はその手を全幅で読んだ値と一致する
+    pos = shogi.Position.from_board(new_board, hands, 'gote')
+    exact = []
+    for move in shogi.get_all_legal_moves(new_board, hands, 'gote'):
+        child = pos.copy()
+        child.do_move(shogi.encode_move(move))
+        exact.append(shogi.minimax(child, None, 1, -1e9, 1e9, False)[0])
+    exact.sort(reverse=True)
+    assert [line['score'] for line in lines] == exact[:3]
+    # 読み筋は候補手から始まる
+    for line in lines:
+        assert line['pv'][0] == line['move'] and len(line['pv']) == 2
+    # 1番目の候補は search の最善手と同じ評価値（search は浅いノードで損をする駒取りを
+    # 枝刈りするので、比べるのは枝刈りするノードがない深さ1）
+    first = shogi.analyze(new_board, hands, 'gote', multipv=1, depth=1)['lines'][0]
+    res = shogi.search(new_board, hands, 'gote', depth=1)
+    assert (first['move'], first['score']) == (res['move'], res['score'])
+    print("✓ Multi-PV: OK")
+
+def test_evasions():
+    """王手を受ける手の生成のテスト"""
+    board = {(9, 5): 'k', (1, 5): 'R', (1, 1): 'K', (8, 4): 's'}
+    hands = {'sente': ['G'], 'gote': []}
+    # 飛車の王手: 玉が逃げる・銀で合駒・金を間に打つ
+    moves = set(shogi.get_all_legal_moves(board, hands, 'sente'))
+    expected = {('move', (9, 5), (8, 6)), ('move', (9, 5), (9, 4)), ('move', (9, 5), (9, 6)),
+                ('move', (8, 4), (7, 5))}
+    expected |= {('drop', 'G', (r, 5)) for r in range(2, 9)}
+    assert moves == expected
+    # 通常の生成と同じ手が同じ順番で並ぶ
+    pos = shogi.Position.from_board(board, hands, 'sente')
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    n = shogi.generate_evasions(pos, buf)
+    assert [shogi.decode_move(c) for c in buf[:n]] == shogi.get_all_legal_moves(board, hands, 'sente')
+    # 両王手（飛車と桂馬）: 玉を動かす手だけ
+    board[(7, 4)] = 'N'
+    moves = set(shogi.get_all_legal_moves(board, hands, 'sente'))
+    assert moves == {('move', (9, 5), (8, 6)), ('move', (9, 5), (9, 4)), ('move', (9, 5), (9, 6))}
+    # 逃げ道を自分の駒でふさぐと詰み
+    board.update({(8, 6): 's', (9, 4): 'g', (9, 6): 'g'})
+    assert shogi.is_checkmate(board, hands, 'sente')
+    print("✓ 王手を受ける手の生成: OK")
+
+def test_engine():
+    """次の手に表と読み筋を持ち越すエンジンのテスト"""
+    # 置換表を使う探索の評価値が、表を使わないαβ探索と一致する
+    board, hands, turn, _ = shogi.sfen_to_board(shogi.STARTPOS_SFEN)
+    expected, _ = shogi.minimax(board, hands, 3, -1e9, 1e9, True, turn)
+    assert shogi.search(board, hands, turn, depth=3)['score'] == expected
+    engine = shogi.Engine(depth=4)
+    first = engine.think(board, hands, turn)
+    assert not first['predicted'] and engine.tables.tt
+    # 読み筋どおりに2手進めた局面は予想どおりで、新しく探索したときと同じ評価値
+    pos = shogi.Position.from_board(board, hands, turn)
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    for move in first['pv'][:2]:
+        n = shogi.generate_legal_moves(pos, buf)
+        pos.do_move(next(c for c in buf[:n] if shogi.decode_move(c) == move))
+    second = engine.think(pos)
+    fresh = shogi.search(pos, depth=4)
+    assert second['predicted']
+    assert second['score'] == fresh['score']
+    assert second['nodes'] < fresh['nodes'], (second['nodes'], fresh['nodes'])
+    assert engine.stats == {'searches': 2, 'predicted': 1}
+    # 新しい対局では表を空にする
+    engine.new_game()
+    assert not engine.tables.tt and not engine.tables.history
+    assert not engine.think(board, hands, turn)['predicted']
+    print("✓ 探索エンジン（表の持ち越し）: OK")
+
+def test_see():
+    """静的交換評価（SEE）と、損をする駒取りの枝刈りのテスト"""
+    def see(board, move):
+        pos = shogi.Position.from_board(board, None, 'sente')
+        return shogi.see(pos, shogi.encode_move(move))
+    kings = {(9, 5): 'k', (1, 1): 'K'}
+    # 金に守られた歩を飛車で取ると、飛車を取り返されて損
+    board = {**kings, (8, 5): 'r', (4, 5): 'P', (3, 5): 'G'}
+    assert see(board, ('move', (8, 5), (4, 5))) == 100 - 1000
+    # 守られていない歩ならそのまま得
+    del board[(3, 5)]
+    assert see(board, ('move', (8, 5), (4, 5))) == 100
+    # 歩で取れば、金で取り返すと後ろの飛車に金を取られるので取り返さない
+    board = {**kings, (8, 5): 'r', (5, 5): 'p', (4, 5): 'P', (3, 5): 'G'}
+    assert see(board, ('move', (5, 5), (4, 5))) == 100
+    # 敵陣に入る歩は金に成る（成りの得も数える）
+    board = {**kings, (4, 3): 'p', (3, 3): 'L'}
+    assert see(board, ('move', (4, 3), (3, 3))) == 200 + 500
+    # 敵陣に入る飛車は龍王に成る
+    board = {**kings, (4, 5): 'r', (3, 5): 'P'}
+    assert see(board, ('move', (4, 5), (3, 5))) == 100 + 1300 - 1000
+    # 相手の駒が利いているマスに打つと取られる
+    board = {**kings, (3, 5): 'G'}
+    pos = shogi.Position.from_board(board, {'sente': ['S'], 'gote': []}, 'sente')
+    assert shogi.see(pos, shogi.encode_move(('drop', 'S', (4, 5)))) == -500
+    # 玉は相手の駒がまだ利いているマスでは取り返せない（飛車の後ろに香車）
+    board = {**kings, (9, 4): 'g', (8, 5): 'S', (2, 5): 'R', (1, 5): 'L'}
+    # （取り返す飛車は敵陣に入って龍王に成る）
+    assert see(board, ('move', (9, 4), (8, 5))) == 500 - (600 + 1300 - 1000)
+    # 浅いノードでは損をする駒取りを読まない
+    board, hands, turn, _ = shogi.sfen_to_board(
+        'ln2kgsnl/3s1r1b1/pgppppppp/1p7/9/2PP5/PP2PPPPP/1B1G2SR1/LNS1KG1NL b - 1')
+    res = shogi.search(board, hands, turn, depth=3)
+    assert shogi.SEARCH_STATS['see_pruned'] > 0
+    assert res['move'] in shogi.get_all_legal_moves(board, hands, turn)
+    saved = shogi.SEE_PRUNE_DEPTH
+    shogi.SEE_PRUNE_DEPTH = 0
+    try:
+        shogi.search(board, hands, turn, depth=3)
+        assert shogi.SEARCH_STATS['see_pruned'] == 0
+    finally:
+        shogi.SEE_PRUNE_DEPTH = saved
+    print("✓ 静的交換評価（SEE）: OK")
+
+def test_frontier_pruning():
+    """futility pruning と razoring のテスト"""
+    # 玉だけの盤で、先手は飛車・金・銀、後手は飛車を持ち駒にしている（打つ手が多い）
+    board, hands, turn, _ = shogi.sfen_to_board('4k4/9/9/9/9/9/9/9/4K4 b RGSr 1')
+    res = shogi.search(board, hands, turn, depth=3)
+    pruned = dict(shogi.SEARCH_STATS)
+    assert pruned['futility_pruned'] > 0
+    # 幅を空にすると枝刈りしない
+    full = shogi.search(board, hands, turn, depth=3, futility_margins={}, razor_margins={})
+    assert shogi.SEARCH_STATS['futility_pruned'] == shogi.SEARCH_STATS['razored'] == 0
+    # 枝刈りしても同じ手を選び、読む局面は減る
+    assert res['move'] == full['move']
+    assert pruned['nodes'] < full['nodes']
+    engine = shogi.Engine(futility_margins={}, razor_margins={})
+    engine.think(board, hands, turn)
+    assert shogi.SEARCH_STATS['futility_pruned'] == 0
+    
+    # 駒を取り合っても窓に届かないノードは razoring で打ち切る
+    sfen = '1ng2gsnl/l6b1/1pskp1p1p/p1p4p1/3r1P2P/P2pP4/LPP3PPN/1BK3G2/1NSGR1S1L w Pp 1'
+    board, hands, turn, _ = shogi.sfen_to_board(sfen)
+    res = shogi.search(board, hands, turn, depth=4, futility_margins={})
+    assert shogi.SEARCH_STATS['razored'] > 0
+    full = shogi.search(board, hands, turn, depth=4, futility_margins={}, razor_margins={})
+    assert shogi.SEARCH_STATS['razored'] == 0
+    assert res['move'] == full['move'] and res['score'] == full['score']
+    # Multi-PV では評価値を正確に出すため枝刈りしない
+    shogi.analyze(board, hands, turn, multipv=2, depth=3)
+    assert shogi.SEARCH_STATS['futility_pruned'] == shogi.SEARCH_STATS['razored'] == 0
+    assert shogi.SEARCH_STATS['see_pruned'] == 0
+    print("✓ futility pruning・razoring: OK")
+
+def test_move_kinds():
+    """駒を取る手・王手・それ以外の手の生成のテスト（合わせると合法手にちょうどなる）"""
+    import random
+    buf = shogi.array('I', [0]) * shogi.MAX_MOVES
+    def generated(generate, pos, *args):
+        return list(buf[:generate(pos, buf, *args)])
+    def check_position(pos):
+        legal = generated(shogi.generate_legal_moves, pos)
+        captures = generated(shogi.generate_captures, pos)
+        checks = generated(shogi.generate_checks, pos)
+        quiets = generated(shogi.generate_quiets, pos)
+        all_checks = generated(shogi.generate_checks, pos, True)
+        # 重なりも漏れもなく、それぞれ合法手の中での順番のまま
+        assert sorted(captures + checks + quiets) == sorted(legal)
+        for part in (captures, checks, quiets, all_checks):
+            assert part == [c for c in legal if c in set(part)]
+        # 1手ずつ指して確かめた結果と同じ
+        for code in legal:
+            undo = pos.do_move(code)
+            gives_check = shogi.in_check(pos)
+            pos.undo_move(code, undo)
+            capture = not shogi.decode_move(code)[0] == 'drop' and bool(pos.squares[code & shogi.MOVE_TO_MASK])
+            assert (code in captures) == capture
+            assert (code in checks) == (gives_check and not capture)
+            assert (code in all_checks) == gives_check
+        return len(captures), len(checks)
+
+    # 開き王手（銀が動くと飛車の利きが通る）・成って王手・王手になる打つ手
+    board, hands, turn, _ = shogi.sfen_to_board('4k4/9/9/9/4S4/9/9/9/K3R4 b GP 1')
+    pos = shogi.Position.from_board(board, hands, turn)
+    checks = {shogi.decode_move(c) for c in generated(shogi.generate_checks, pos)}
+    assert {('move', (5, 5), (4, 4)), ('move', (5, 5), (4, 6)), ('move', (5, 5), (6, 6))} <= checks
+    assert ('drop', 'G', (2, 5)) in checks and ('drop', 'P', (2, 5)) in checks
+    check_position(pos)
+    # 打ち歩詰めになる歩は王手の手にも入らない
+    board, hands, turn, _ = shogi.sfen_to_board('3lkl3/9/4G4/9/9/9/9/9/4K4 b P 1')
+    pos = shogi.Position.from_board(board, hands, turn)
+    assert ('drop', 'P', (2, 5)) not in [shogi.decode_move(c) for c in generated(shogi.generate_checks, pos)]
+    check_position(pos)
+
+    # ランダムに指し進めた局面（持ち駒あり・王手をかけられている局面を含む）
+    rng = random.Random(48)
+    found = [0, 0, 0]
+    for case in range(120):
+        hands = {side: [rng.choice('PLNSGBR') for _ in range(rng.randint(0, 4))]
+                 for side in ('sente', 'gote')}
+        pos = shogi.Position.from_board(shogi.create_initial_board(), hands, 'sente')
+        for _ in range(rng.randint(0, 80)):
+            n = shogi.generate_legal_moves(pos, buf)
+            if not n:
+                break
+            pos.do_move(buf[rng.randrange(n)])
+        captures, checks = check_position(pos)
+        found[0] += captures > 0
+        found[1] += checks > 0
+        found[2] += shogi.in_check(pos)
+    assert all(found), found
+    print("✓ 駒を取る手・王手・それ以外の手の生成: OK")
+
 def run_all_tests():
     print("=== 将棋ルールテスト開始 ===\n")
     test_two_pawns()
@@ -230,12 +731,28 @@ def run_all_tests():
     test_self_check()
     test_promotion()
     test_promotion_edge_cases()
+    test_rook_bishop_promotion()
     test_check_detection()
     test_checkmate()
     test_uchifuzume()
     test_capture()
     test_drop_piece()
     test_king_safety()
+    test_move_cache()
+    test_move_encoding()
+    test_position()
+    test_move_tables()
+    test_pvs_search()
+    test_leaf_perspective()
+    test_sfen()
+    test_search_limits()
+    test_time_manager()
+    test_multipv()
+    test_evasions()
+    test_engine()
+    test_see()
+    test_frontier_pruning()
+    test_move_kinds()
     print("\n=== 全テスト完了 ===")
 
 if __name__ == "__main__":
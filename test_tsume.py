@@ -0,0 +1,74 @@
+import io
+import json
+
+import shogi
+import tsume
+
+MATE1 = '8k/9/8P/9/9/9/9/9/4K4 b G 1'
+MATE3 = '9/8k/6s2/8G/9/9/9/9/4K4 b RS 1'
+MATE3_ALT = '9/6S1k/4R4/9/4g4/9/9/9/4K4 b 2S 1'  # 余詰めがある
+NOMATE = '4k4/9/4P4/9/9/9/9/9/4K4 b - 1'
+UCHIFUZUME = '4k4/9/9/9/9/9/7s1/9/7LK w p 1'  # 後手の攻め。詰ませる手は打ち歩詰めだけ
+
+def _solve(sfen, max_ply=5, max_nodes=None):
+    board, hands, turn, _ = shogi.sfen_to_board(sfen)
+    pos = shogi.Position.from_board(board, hands, turn)
+    res = tsume.MateSolver(max_nodes).solve(pos, max_ply)
+    assert pos.hash == shogi.Position.from_board(board, hands, turn).hash  # 局面は元に戻る
+    return res, board, hands, turn
+
+def test_mate_solver():
+    """詰将棋の探索のテスト"""
+    res, _, _, _ = _solve(MATE1)
+    assert res['mate'] == 1 and res['unique']
+    assert shogi.decode_move(res['solution'][0]) == ('drop', 'G', (2, 1))
+    
+    # 解答手順をたどると、最後の局面で玉方に合法手がない
+    res, board, hands, turn = _solve(MATE3)
+    assert res['mate'] == 3 and len(res['solution']) == 3 and res['unique']
+    for code in res['solution']:
+        move = shogi.decode_move(code)
+        assert move in shogi.get_all_legal_moves(board, hands, turn)
+        board, hands = shogi.apply_move_code(board, hands, code, turn)
+        turn = 'gote' if turn == 'sente' else 'sente'
+        if turn == 'gote':
+            assert shogi.is_check(board, 'gote')  # 攻め方は王手だけ
+    assert shogi.is_checkmate(board, hands, 'gote')
+    
+    res, _, _, _ = _solve(MATE3_ALT)
+    assert res['mate'] == 3 and not res['unique']
+    res, _, _, _ = _solve(NOMATE)
+    assert res['mate'] is None
+    # 打ち歩詰めは詰みにしない（後手が攻め方で、持ち駒の歩が大文字の表記でも）
+    res, _, _, _ = _solve(UCHIFUZUME, max_ply=1)
+    assert res['mate'] is None
+    # 1手詰めの局面を3手以上の上限で読んでも最短の手数を返す
+    res, _, _, _ = _solve(MATE1, max_ply=7)
+    assert res['mate'] == 1
+    try:
+        _solve(MATE3, max_nodes=3)
+        assert False, 'ノード数の上限で止まるはず'
+    except shogi.SearchAborted:
+        pass
+    print("✓ 詰将棋の探索: OK")
+
+def test_tsume_run():
+    """詰将棋の一括解答の出力のテスト"""
+    src = '\n'.join(['# コメント', MATE1, '{"id": "p3", "sfen": "%s"}' % MATE3, NOMATE, 'bad', MATE3_ALT]) + '\n'
+    out = io.StringIO()
+    counts = tsume.run(io.StringIO(src), out, workers=2, max_ply=5, max_nodes=100000)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r['line'] for r in rows] == [2, 3, 4, 5, 6]
+    assert [r['status'] for r in rows] == ['mate', 'mate', 'nomate', 'error', 'mate']
+    assert rows[1]['id'] == 'p3' and rows[1]['mate'] == 3 and len(rows[1]['solution']) == 3
+    assert rows[4]['unique'] is False
+    assert counts == {'mate': 3, 'nomate': 1, 'error': 1}
+    # ノード数の上限に達した問題
+    out = io.StringIO()
+    tsume.run(io.StringIO(MATE3 + '\n'), out, workers=1, max_ply=5, max_nodes=3)
+    assert json.loads(out.getvalue())['status'] == 'limit'
+    print("✓ 詰将棋の一括解答: OK")
+
+if __name__ == "__main__":
+    test_mate_solver()
+    test_tsume_run()
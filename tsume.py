@@ -0,0 +1,273 @@
+# ============================================================
+# 将棋AI 詰将棋の一括解答
+# ============================================================
+# 詰将棋（SFEN）のファイルを読み、複数のワーカープロセスで解いて
+# 手数・解答手順・解が1つだけか（余詰めがないか）をJSONLで書き出す。
+#
+# 使い方:
+#   python tsume.py problems.sfen -o answers.jsonl --workers 4 --max-ply 15
+#   cat problems.jsonl | python tsume.py - --nodes 500000
+#
+# 入力: 1行1問。SFEN文字列、または {"id": ..., "sfen": ...} のJSON（batch_analyze と同じ）
+#       手番側が攻め方。'#' で始まる行は読み飛ばす
+# 出力: 1行1問のJSON（入力と同じ順番）
+#   {"id", "line", "status", "mate", "solution", "unique", "nodes", "time"}
+#   status: "mate"（詰み）, "nomate"（max-ply 以内に詰みなし）,
+#           "limit"（ノード数の上限に達した）, "error"（局面が読めない）
+
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import time
+
+import shogi
+from batch_analyze import parse_line
+
+DEFAULT_MAX_PLY = 15
+DEFAULT_NODES = 1000000
+
+
+class MateSolver:
+    """
+    詰将棋専用の探索
+
+    Args:
+        max_nodes: 探索する局面数の上限（Noneなら無制限。超えたら shogi.SearchAborted）
+
+    実装の理由:
+        minimax で深く読んで末端で is_checkmate を調べると、王手でない手や
+        評価値の計算まで読むことになる。詰将棋では
+          攻め方: 王手になる手だけ（1つでも詰めば詰み）
+          玉方:   すべての合法手（王手を受ける手。1つでも逃れれば不詰め）
+        と読めばよく、合法手がなければ詰み。打ち歩詰めの手は
+        合法手の生成（is_uchifuzume と同じ判定）で除かれている。
+        手数を1, 3, 5, ...と増やして読み（反復深化）、最短の手数を求める。
+        同じ局面を何度も読まないよう、局面ごとに「何手以内なら詰む」
+        「何手では詰まない」を覚えておく。
+    """
+
+    def __init__(self, max_nodes=None):
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.proven = {}     # ハッシュ -> その手数以内で詰むと分かった最小の手数
+        self.disproven = {}  # ハッシュ -> その手数では詰まないと分かった最大の手数
+        self._buffers = []
+
+    def _buffer(self, ply):
+        while len(self._buffers) <= ply:
+            self._buffers.append(shogi.array('I', [0]) * shogi.MAX_MOVES)
+        return self._buffers[ply]
+
+    def _count(self):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise shogi.SearchAborted('nodes')
+
+    def checks(self, pos, ply):
+        """攻め方の王手になる合法手のリスト"""
+        buf = self._buffer(ply)
+        return list(buf[:shogi.generate_checks(pos, buf, captures=True)])
+
+    def evasions(self, pos, ply):
+        """玉方の合法手（王手を受ける手）のリスト"""
+        buf = self._buffer(ply)
+        return list(buf[:shogi.generate_legal_moves(pos, buf)])
+
+    def attack(self, pos, depth, ply=0):
+        """攻め方の手番で、depth 手以内に詰むか"""
+        if depth <= 0:
+            return False
+        h = pos.hash
+        if self.proven.get(h, depth + 1) <= depth:
+            return True
+        if self.disproven.get(h, -1) >= depth:
+            return False
+        self._count()
+        for code in self.checks(pos, ply):
+            undo = pos.do_move(code)
+            mate = self.defend(pos, depth - 1, ply + 1)
+            pos.undo_move(code, undo)
+            if mate:
+                self.proven[h] = depth
+                return True
+        self.disproven[h] = depth
+        return False
+
+    def defend(self, pos, depth, ply):
+        """玉方の手番（王手をかけられている）で、depth 手以内に詰まされるか"""
+        h = pos.hash
+        if self.proven.get(h, depth + 1) <= depth:
+            return True
+        if self.disproven.get(h, -1) >= depth:
+            return False
+        self._count()
+        moves = self.evasions(pos, ply)
+        if not moves:
+            self.proven[h] = 0
+            return True
+        if depth < 2:
+            return False
+        for code in moves:
+            undo = pos.do_move(code)
+            mate = self.attack(pos, depth - 1, ply + 1)
+            pos.undo_move(code, undo)
+            if not mate:
+                self.disproven[h] = depth
+                return False
+        self.proven[h] = depth
+        return True
+
+    def shortest_mate(self, pos, max_ply):
+        """攻め方の手番で、max_ply 手以内の最短の詰み手数（詰まなければNone）"""
+        for depth in range(1, max_ply + 1, 2):
+            if self.attack(pos, depth):
+                return depth
+        return None
+
+    def solve(self, pos, max_ply=DEFAULT_MAX_PLY):
+        """
+        詰将棋を解く
+
+        Args:
+            pos: 攻め方の手番の局面（書き換えるが、戻ったときには元に戻っている）
+            max_ply: 読む最大の手数
+
+        Returns:
+            dict: {'mate': 手数（詰まなければNone）, 'solution': 手順（整数の指し手）,
+                   'unique': 余詰めがなければTrue}
+
+        実装の理由:
+            手順は、攻め方は最短で詰む手、玉方は最も長く逃れる手を選んでたどる。
+            余詰めは、この手順の攻め方の各手で「残りの手数以内で詰む王手」が
+            ほかにもあるかで判定する（最終手の余詰めは慣例どおり問わない）。
+            無駄合いの判定はしない。
+        """
+        mate = self.shortest_mate(pos, max_ply)
+        if mate is None:
+            return {'mate': None, 'solution': [], 'unique': None}
+        solution = []
+        unique = True
+        undos = []
+        depth = mate
+        while True:
+            # 攻め方: 残り depth 手以内で詰む王手を探す
+            ply = len(solution)
+            mating = []
+            for code in self.checks(pos, ply):
+                undo = pos.do_move(code)
+                if self.defend(pos, depth - 1, ply + 1):
+                    mating.append(code)
+                pos.undo_move(code, undo)
+            if len(mating) > 1 and depth > 1:
+                unique = False
+            code = mating[0]
+            undos.append((code, pos.do_move(code)))
+            solution.append(code)
+            # 玉方: 最も長く逃れる手を選ぶ
+            best = None
+            for code in self.evasions(pos, ply + 1):
+                undo = pos.do_move(code)
+                length = self.shortest_mate(pos, depth - 2) or 0
+                pos.undo_move(code, undo)
+                if best is None or length > best[1]:
+                    best = (code, length)
+            if best is None:
+                break  # 詰み
+            code, depth = best
+            undos.append((code, pos.do_move(code)))
+            solution.append(code)
+        for code, undo in reversed(undos):
+            pos.undo_move(code, undo)
+        return {'mate': mate, 'solution': solution, 'unique': unique}
+
+
+def solve_problem(task):
+    """
+    1問を解く（ワーカープロセスで動く）
+
+    Args:
+        task: (行番号, ID, SFEN, 最大手数, ノード数の上限)
+
+    Returns:
+        dict: 出力する1行分の結果
+    """
+    lineno, pos_id, sfen, max_ply, max_nodes = task
+    start = time.monotonic()
+    result = {'id': pos_id, 'line': lineno}
+    try:
+        board, hands, turn, _ = shogi.sfen_to_board(sfen)
+    except ValueError as e:
+        result.update(status='error', error=str(e))
+        return result
+    pos = shogi.Position.from_board(board, hands, turn)
+    solver = MateSolver(max_nodes)
+    try:
+        res = solver.solve(pos, max_ply)
+    except shogi.SearchAborted:
+        result.update(status='limit', mate=None, solution=[], unique=None)
+    else:
+        result.update(status='mate' if res['mate'] else 'nomate', mate=res['mate'],
+                      solution=[shogi.decode_move(code) for code in res['solution']],
+                      unique=res['unique'])
+    result.update(nodes=solver.nodes, time=round(time.monotonic() - start, 6))
+    return result
+
+
+def _iter_tasks(stream, max_ply, max_nodes):
+    """入力を1行ずつ読み、解く問題を順に返す（読めない行はエラー結果）"""
+    for lineno, line in enumerate(stream, 1):
+        if line.lstrip().startswith('#'):
+            continue
+        try:
+            parsed = parse_line(line, lineno)
+        except (ValueError, KeyError) as e:
+            yield {'id': lineno, 'line': lineno, 'status': 'error', 'error': 'invalid input: %s' % e}
+            continue
+        if parsed is not None:
+            yield (lineno, parsed[0], parsed[1], max_ply, max_nodes)
+
+
+def _solve_or_pass(task):
+    return task if isinstance(task, dict) else solve_problem(task)
+
+
+def run(stream, out, workers=2, max_ply=DEFAULT_MAX_PLY, max_nodes=DEFAULT_NODES):
+    """
+    問題を解いて結果を入力順に書き出す
+
+    Returns:
+        dict: 結果の種類（status）ごとの件数
+    """
+    counts = {}
+    tasks = _iter_tasks(stream, max_ply, max_nodes)
+    with mp.Pool(workers) as pool:
+        # 1問ごとの時間の差が大きいので、1問ずつワーカーに渡す
+        for result in pool.imap(_solve_or_pass, tasks, chunksize=1):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='将棋AI 詰将棋の一括解答')
+    parser.add_argument('input', help="入力ファイル（'-' で標準入力）")
+    parser.add_argument('-o', '--output', help='出力ファイル（省略時は標準出力）')
+    parser.add_argument('--workers', type=int, default=max(1, mp.cpu_count()))
+    parser.add_argument('--max-ply', type=int, default=DEFAULT_MAX_PLY, help='読む最大の手数')
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help='1問あたりの探索局面数の上限')
+    args = parser.parse_args(argv)
+
+    stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    out = sys.stdout if args.output is None else open(args.output, 'w', encoding='utf-8')
+    start = time.monotonic()
+    counts = run(stream, out, args.workers, args.max_ply, args.nodes)
+    if out is not sys.stdout:
+        out.close()
+    elapsed = time.monotonic() - start
+    summary = ', '.join('%s: %d' % kv for kv in sorted(counts.items()))
+    print(f"{sum(counts.values())}問を解きました（{summary}）{elapsed:.1f}秒", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()